@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A small package for reduced ordered binary decision diagrams (BDDs).
+#
+# Nodes are ints indexing three parallel lists (level, low, high), 0 and 1 are
+# the terminals. Nodes are hash-consed in a unique table (like expressions in
+# data.instances), so two functions are equal iff they're the same node, and
+# the results of operations are remembered in an operation cache.
+#
+# Users get Function objects, which the manager tracks weakly. Garbage
+# collection frees the nodes that can't be reached from a live Function, it
+# runs at the start of an operation (never during one) once the unique table
+# has grown past a threshold, which then adapts to the amount of live nodes.
+#
+# The operations recurse one level per variable, so the amount of variables
+# should stay well below the recursion limit.
+#
+# Usage:
+#     bdd = BDD(['a', 'b'])
+#     f = bdd.var('a') & ~bdd.var('b')
+#     f.count(['a', 'b'])              # 1
+#     f.exists(['a']) == ~bdd.var('b') # True
+import weakref
+
+FALSE, TRUE = 0, 1
+_TERMINAL   = 1 << 62   # the level of the terminals, below every variable
+
+
+class BDD:
+    """
+    A BDD manager: the variables (in their order, the first declared is the
+    top level), the node table, the unique table and the operation cache.
+
+    gc_threshold : the size of the unique table above which the next
+                   operation first collects garbage
+    """
+    def __init__(self, names=(), gc_threshold=1 << 16):
+        self._names  = []                    # level -> variable name
+        self._levels = {}                    # variable name -> level
+        self._level  = [_TERMINAL, _TERMINAL]
+        self._low    = [FALSE, TRUE]
+        self._high   = [FALSE, TRUE]
+        self._unique = {}                    # (level, low, high) -> node
+        self._cache  = {}                    # (operation, operands...) -> node
+        self._free   = []                    # nodes freed by collect, to be reused
+        self._roots  = weakref.WeakValueDictionary()   # id -> the live Function objects
+        self.gc_threshold = self._minimum = gc_threshold
+        self.collections  = 0
+        for name in names:
+            self.declare(name)
+
+    def __len__(self):
+        "the amount of nodes in the table (terminals included)"
+        return len(self._unique) + 2
+
+    def __repr__(self):
+        return "BDD(%d variables, %d nodes)" % (len(self._names), len(self))
+
+    def declare(self, name):
+        "Adds a variable below all existing ones, returns it as a Function"
+        if name in self._levels:
+            raise ValueError("variable %s already exists" % name)
+        self._levels[name] = len(self._names)
+        self._names.append(name)
+        return self.var(name)
+
+    def variables(self):
+        "the variable names, in order"
+        return list(self._names)
+
+    def var(self, name):
+        "the function that is true iff variable name is"
+        return Function(self, self._mk(self._levels[name], FALSE, TRUE))
+
+    @property
+    def true(self):
+        return Function(self, TRUE)
+
+    @property
+    def false(self):
+        return Function(self, FALSE)
+
+    def collect(self):
+        "Frees every node unreachable from a live Function, returns the amount freed"
+        low, high = self._low, self._high
+        marked, stack = set((FALSE, TRUE)), [f.node for f in self._roots.values()]
+        while stack:
+            u = stack.pop()
+            if u not in marked:
+                marked.add(u)
+                stack.append(low[u])
+                stack.append(high[u])
+        dead = [key for key, u in self._unique.items() if u not in marked]
+        for key in dead:
+            self._free.append(self._unique.pop(key))
+        self._cache.clear()
+        self.gc_threshold = max(self._minimum, 2 * len(self._unique))
+        self.collections += 1
+        return len(dead)
+
+    def _maybe_collect(self):
+        if len(self._unique) > self.gc_threshold:
+            self.collect()
+
+    def _mk(self, level, low, high):
+        "the unique node testing level with children low (false) and high (true)"
+        if low == high:
+            return low
+        key = (level, low, high)
+        u = self._unique.get(key)
+        if u is None:
+            if self._free:
+                u = self._free.pop()
+                self._level[u], self._low[u], self._high[u] = level, low, high
+            else:
+                u = len(self._level)
+                self._level.append(level)
+                self._low.append(low)
+                self._high.append(high)
+            self._unique[key] = u
+        return u
+
+    def _cofactors(self, u, level):
+        "the (low, high) cofactors of u for the variable at level"
+        if self._level[u] == level:
+            return self._low[u], self._high[u]
+        return u, u
+
+    # the operations on nodes, Function wraps them
+    def _and(self, u, v):
+        if u == FALSE or v == FALSE:
+            return FALSE
+        if u == TRUE or u == v:
+            return v
+        if v == TRUE:
+            return u
+        if u > v:
+            u, v = v, u
+        key = ('&', u, v)
+        r = self._cache.get(key)
+        if r is None:
+            level = min(self._level[u], self._level[v])
+            (u0, u1), (v0, v1) = self._cofactors(u, level), self._cofactors(v, level)
+            r = self._cache[key] = self._mk(level, self._and(u0, v0), self._and(u1, v1))
+        return r
+
+    def _or(self, u, v):
+        if u == TRUE or v == TRUE:
+            return TRUE
+        if u == FALSE or u == v:
+            return v
+        if v == FALSE:
+            return u
+        if u > v:
+            u, v = v, u
+        key = ('|', u, v)
+        r = self._cache.get(key)
+        if r is None:
+            level = min(self._level[u], self._level[v])
+            (u0, u1), (v0, v1) = self._cofactors(u, level), self._cofactors(v, level)
+            r = self._cache[key] = self._mk(level, self._or(u0, v0), self._or(u1, v1))
+        return r
+
+    def _xor(self, u, v):
+        if u == v:
+            return FALSE
+        if u == FALSE:
+            return v
+        if v == FALSE:
+            return u
+        if u == TRUE:
+            return self._not(v)
+        if v == TRUE:
+            return self._not(u)
+        if u > v:
+            u, v = v, u
+        key = ('^', u, v)
+        r = self._cache.get(key)
+        if r is None:
+            level = min(self._level[u], self._level[v])
+            (u0, u1), (v0, v1) = self._cofactors(u, level), self._cofactors(v, level)
+            r = self._cache[key] = self._mk(level, self._xor(u0, v0), self._xor(u1, v1))
+        return r
+
+    def _not(self, u):
+        if u <= TRUE:
+            return TRUE - u
+        key = ('~', u)
+        r = self._cache.get(key)
+        if r is None:
+            r = self._cache[key] = self._mk(self._level[u], self._not(self._low[u]), self._not(self._high[u]))
+        return r
+
+    def _exists(self, u, levels, last):
+        "u with the variables at levels (a frozenset, the largest is last) quantified away"
+        if u <= TRUE or self._level[u] > last:
+            return u
+        key = ('E', u, levels)
+        r = self._cache.get(key)
+        if r is None:
+            level = self._level[u]
+            r0 = self._exists(self._low[u], levels, last)
+            if level in levels:
+                r = r0 if r0 == TRUE else self._or(r0, self._exists(self._high[u], levels, last))
+            else:
+                r = self._mk(level, r0, self._exists(self._high[u], levels, last))
+            self._cache[key] = r
+        return r
+
+    def _and_exists(self, u, v, levels, last):
+        "the relational product: exists levels. u & v, without building u & v"
+        if u == FALSE or v == FALSE:
+            return FALSE
+        if u == TRUE or u == v:
+            return self._exists(v, levels, last)
+        if v == TRUE:
+            return self._exists(u, levels, last)
+        if u > v:
+            u, v = v, u
+        key = ('AE', u, v, levels)
+        r = self._cache.get(key)
+        if r is None:
+            level = min(self._level[u], self._level[v])
+            if level > last:
+                r = self._and(u, v)
+            else:
+                (u0, u1), (v0, v1) = self._cofactors(u, level), self._cofactors(v, level)
+                r0 = self._and_exists(u0, v0, levels, last)
+                if level in levels:
+                    r = r0 if r0 == TRUE else self._or(r0, self._and_exists(u1, v1, levels, last))
+                else:
+                    r = self._mk(level, r0, self._and_exists(u1, v1, levels, last))
+            self._cache[key] = r
+        return r
+
+    def _rename(self, u, mapping, name):
+        "u with the variables at the levels in mapping (a dict) replaced, name identifies mapping"
+        if u <= TRUE:
+            return u
+        key = ('R', u, name)
+        r = self._cache.get(key)
+        if r is None:
+            level = self._level[u]
+            level = mapping.get(level, level)
+            r0, r1 = self._rename(self._low[u], mapping, name), self._rename(self._high[u], mapping, name)
+            if level < self._level[r0] and level < self._level[r1]:
+                r = self._mk(level, r0, r1)
+            else:
+                # the new variable ends up below others, so build it as ite(var, r1, r0)
+                x = self._mk(level, FALSE, TRUE)
+                r = self._or(self._and(x, r1), self._and(self._not(x), r0))
+            self._cache[key] = r
+        return r
+
+
+class Function:
+    """
+    A boolean function over the variables of a BDD manager. Supports &, |, ^,
+    ~ and == (which is a constant time comparison, BDDs are canonical).
+    """
+    __slots__ = ('bdd', 'node', '__weakref__')
+
+    def __init__(self, bdd, node):
+        self.bdd, self.node = bdd, node
+        bdd._roots[id(self)] = self   # by identity, equal functions are different roots
+
+    def __repr__(self):
+        return "Function(node %d of %r)" % (self.node, self.bdd)
+
+    def __eq__(self, other):
+        return isinstance(other, Function) and self.bdd is other.bdd and self.node == other.node
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.node)
+
+    def __len__(self):
+        "the amount of nodes of this function (terminals included)"
+        seen, stack = set(), [self.node]
+        while stack:
+            u = stack.pop()
+            if u not in seen:
+                seen.add(u)
+                if u > TRUE:
+                    stack.extend((self.bdd._low[u], self.bdd._high[u]))
+        return len(seen)
+
+    @property
+    def is_true(self):
+        return self.node == TRUE
+
+    @property
+    def is_false(self):
+        return self.node == FALSE
+
+    def _apply(self, operation, *others):
+        bdd = self.bdd
+        for other in others:
+            if other.bdd is not bdd:
+                raise ValueError("functions of different BDD managers")
+        bdd._maybe_collect()
+        return Function(bdd, operation(self.node, *[other.node for other in others]))
+
+    def __and__(self, other):
+        return self._apply(self.bdd._and, other)
+
+    def __or__(self, other):
+        return self._apply(self.bdd._or, other)
+
+    def __xor__(self, other):
+        return self._apply(self.bdd._xor, other)
+
+    def __invert__(self):
+        return self._apply(self.bdd._not)
+
+    def _levels(self, names):
+        levels = frozenset(self.bdd._levels[name] for name in names)
+        return levels, max(levels) if levels else -1
+
+    def exists(self, names):
+        "the function with the variables in names quantified existentially"
+        levels, last = self._levels(names)
+        return self._apply(lambda u: self.bdd._exists(u, levels, last))
+
+    def forall(self, names):
+        "the function with the variables in names quantified universally"
+        return ~(~self).exists(names)
+
+    def and_exists(self, other, names):
+        "the relational product, (self & other).exists(names) in one pass"
+        levels, last = self._levels(names)
+        return self._apply(lambda u, v: self.bdd._and_exists(u, v, levels, last), other)
+
+    def rename(self, mapping):
+        "the function with the variables renamed by mapping (a dict of names)"
+        levels = self.bdd._levels
+        pairs  = dict((levels[old], levels[new]) for old, new in mapping.items())
+        return self._apply(lambda u: self.bdd._rename(u, pairs, frozenset(pairs.items())))
+
+    def support(self):
+        "the names of the variables the function depends on, in order"
+        bdd, seen, stack, levels = self.bdd, set(), [self.node], set()
+        while stack:
+            u = stack.pop()
+            if u > TRUE and u not in seen:
+                seen.add(u)
+                levels.add(bdd._level[u])
+                stack.extend((bdd._low[u], bdd._high[u]))
+        return [bdd._names[level] for level in sorted(levels)]
+
+    def count(self, names):
+        "the amount of assignments to the variables in names that satisfy the function"
+        bdd = self.bdd
+        position = dict((level, i) for i, level in enumerate(sorted(bdd._levels[n] for n in names)))
+        n = len(position)
+        pos = lambda u: n if u <= TRUE else position[bdd._level[u]]
+
+        counts = {FALSE: 0, TRUE: 1}   # u -> assignments to the variables from u's level on
+        stack  = [self.node]
+        while stack:
+            u = stack[-1]
+            if u in counts:
+                stack.pop()
+                continue
+            if bdd._level[u] not in position:
+                raise ValueError("the function depends on %s, which isn't counted" % bdd._names[bdd._level[u]])
+            low, high = bdd._low[u], bdd._high[u]
+            if low in counts and high in counts:
+                counts[u] = (counts[low] << (pos(low) - pos(u) - 1)) + (counts[high] << (pos(high) - pos(u) - 1))
+                stack.pop()
+            else:
+                stack.extend(c for c in (low, high) if c not in counts)
+        return counts[self.node] << pos(self.node)
+
+    def assignments(self, names):
+        """
+        Generates the satisfying assignments to the variables in names (as
+        tuples of booleans in the order of names), the function may only
+        depend on those
+        """
+        bdd    = self.bdd
+        levels = sorted(bdd._levels[n] for n in names)
+        order  = [levels.index(bdd._levels[n]) for n in names]
+        stack  = [(self.node, 0, ())]
+        while stack:
+            u, i, values = stack.pop()
+            if u == FALSE:
+                continue
+            if i == len(levels):
+                yield tuple(values[j] for j in order)
+                continue
+            if bdd._level[u] < levels[i]:
+                raise ValueError("the function depends on %s, which isn't enumerated" % bdd._names[bdd._level[u]])
+            low, high = bdd._cofactors(u, levels[i])
+            stack.append((high, i + 1, values + (True,)))
+            stack.append((low, i + 1, values + (False,)))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmark runner: times parsing formulas, loading .kripke files and calc,
+# stack_calc and entails over generated models (see generate.py), sweeping
+# model shapes and sizes.
+#
+# Every measurement is written as a json line:
+#
+#   {"benchmark": "calc", "shape": "grid", "worlds": 1000, "transitions": 3872,
+#    "formulas": 20, "seconds": 0.0123, "per_second": 1626.0}
+#
+# seconds is the best of --repeat runs over all formulas (or the one model
+# file for load). Two runs can be compared with --compare, which matches the
+# records by benchmark, shape and worlds and reports the ratio of the times.
+#
+# The numpy and parallel benchmarks (not run by default, they need NumPy)
+# evaluate the formulas with numpy_backend.FrozenKripke and with the sharded
+# backend of evaluator.py -P (sharded.ShardedKripke, in --processes
+# processes), so the two records of a model show whether -P pays off there.
+# The backends are built once per model, outside the timing, like they are
+# for a batch.
+#
+# The startup benchmark times a cold start of every modlog.py subcommand in
+# STARTUP, in a fresh interpreter each time, against starting a bare
+# interpreter ("overhead" is the difference). --startup-budget makes the run
+# fail when an overhead is over budget.
+#
+# Usage:
+#     ./bench.py -o before.json
+#     ./bench.py --compare before.json
+#     ./bench.py --shapes chain,grid --sizes 100,10000 --benchmarks load,calc
+#     ./bench.py --benchmarks startup --startup-budget 50
+#     ./bench.py --shapes random --sizes 100000,1000000 --benchmarks numpy,parallel -P 4
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+from evaluator import parse_kripke_file
+from generate  import SHAPES, generate_model, random_formulas, write_kripke
+from parser    import parse
+
+BENCHMARKS = ('startup', 'parse', 'load', 'calc', 'stack_calc', 'entails')
+NUMPY_BENCHMARKS = ('numpy', 'parallel')   # only run when asked for
+
+_here   = os.path.dirname(os.path.abspath(__file__))
+_modlog = os.path.join(_here, 'modlog.py')
+
+# subcommand -> its arguments, for the startup benchmark
+STARTUP = {
+    'parse': ['parse', 'p -> diamond q'],
+    'tree':  ['tree', 'p -> diamond q'],
+    'eval':  ['eval', os.path.join(_here, 'examples', 'example1.kripke'), 'p -> diamond q'],
+}
+
+
+def _best(function, repeat):
+    "the fastest of repeat runs of function(), in seconds"
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        function()
+        times.append(timer() - start)
+    return min(times)
+
+
+def startup(repeat=5):
+    "times cold starts of the subcommands in STARTUP, generates a record per subcommand"
+    with open(os.devnull, 'w') as devnull:
+        start = lambda arguments: subprocess.check_call([sys.executable] + arguments, stdout=devnull)
+        interpreter = _best(lambda: start(['-c', 'pass']), repeat)
+        for command in sorted(STARTUP):
+            seconds = _best(lambda: start([_modlog] + STARTUP[command]), repeat)
+            yield {'benchmark': 'startup', 'command': command, 'seconds': seconds,
+                   'interpreter': interpreter, 'overhead': seconds - interpreter}
+
+
+def backends(kripke, expressions, benchmarks, repeat, processes=None):
+    """
+    times evaluating expressions with the NumPy backend and the sharded one
+    (in processes processes), generates a record per benchmark asked for
+    """
+    from numpy_backend import FrozenKripke
+    if 'numpy' in benchmarks:
+        frozen  = FrozenKripke(kripke)
+        seconds = _best(lambda: [e.evaluate(frozen) for e in expressions], repeat)
+        yield {'benchmark': 'numpy', 'seconds': seconds}
+    if 'parallel' in benchmarks:
+        from sharded import ShardedKripke
+        with ShardedKripke(kripke, processes) as sharded:
+            seconds = _best(lambda: [e.evaluate(sharded) for e in expressions], repeat)
+            yield {'benchmark': 'parallel', 'processes': sharded.processes, 'seconds': seconds}
+
+
+def run(shapes=('random', 'chain', 'tree', 'grid'), sizes=(100, 1000, 10000), benchmarks=BENCHMARKS,
+        density=2.0, variables=3, formulas=20, depth=6, modal=0.3, sharing=0.0, repeat=3, seed=0,
+        processes=None):
+    """
+    Runs the benchmarks over every shape and size, generates a record (a
+    dict, see above) per measurement. The formulas are the same for every
+    model, see generate.random_formulas for their arguments. processes is
+    the amount of processes of the parallel benchmark (default: one per core).
+    """
+    if 'startup' in benchmarks:
+        for record in startup(max(repeat, 5)):
+            yield record
+    strings = [str(f) for f in random_formulas(formulas, depth, variables, modal, None, sharing, seed)]
+    if 'parse' in benchmarks:
+        seconds = _best(lambda: [parse(s) for s in strings], repeat)
+        yield {'benchmark': 'parse', 'formulas': len(strings), 'depth': depth,
+               'seconds': seconds, 'per_second': len(strings) / max(seconds, 1e-9)}
+    expressions = [parse(s) for s in strings]
+
+    for shape in shapes:
+        for size in sizes:
+            kripke = generate_model(shape, size, density, variables, seed=seed)
+            common = {'shape': shape, 'worlds': size,
+                      'transitions': sum(len(successors) for successors in kripke.R.values())}
+
+            if 'load' in benchmarks:
+                handle, filename = tempfile.mkstemp(suffix='.kripke')
+                try:
+                    with os.fdopen(handle, 'w') as stream:
+                        write_kripke(kripke, stream)
+                    seconds = _best(lambda: parse_kripke_file(filename), repeat)
+                finally:
+                    os.remove(filename)
+                record = {'benchmark': 'load', 'seconds': seconds,
+                          'per_second': common['transitions'] / max(seconds, 1e-9)}
+                record.update(common)
+                yield record
+
+            timed = {
+                'calc':       lambda: [e.calc(kripke) for e in expressions],
+                'stack_calc': lambda: [e.stack_calc(kripke) for e in expressions],
+                # entails goes through the bitset of the model, which is
+                # built once and kept, like it would be between formulas
+                'entails':    lambda: [kripke.entails(e) for e in expressions],
+            }
+            for name in BENCHMARKS:
+                if name in timed and name in benchmarks:
+                    seconds = _best(timed[name], repeat)
+                    record  = {'benchmark': name, 'formulas': len(expressions), 'seconds': seconds,
+                               'per_second': len(expressions) / max(seconds, 1e-9)}
+                    record.update(common)
+                    yield record
+
+            for record in backends(kripke, expressions, benchmarks, repeat, processes):
+                record.update(common, formulas=len(expressions),
+                              per_second=len(expressions) / max(record['seconds'], 1e-9))
+                yield record
+
+
+def _key(record):
+    return record['benchmark'], record.get('command'), record.get('shape'), record.get('worlds')
+
+
+def compare(baseline, records):
+    """
+    Matches records with those of a baseline run (same benchmark, command,
+    shape and worlds), generates (record, ratio) where ratio is seconds / baseline
+    seconds, so above 1 is slower. Records without a match get ratio None.
+    """
+    before = dict((_key(record), record) for record in baseline)
+    for record in records:
+        old = before.get(_key(record))
+        yield record, old and record['seconds'] / max(old['seconds'], 1e-9)
+
+
+def read_results(filename):
+    "reads the records of a run written by bench.py"
+    with open(filename) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse   import ArgumentParser
+    from contextlib import nullcontext
+
+    parser = ArgumentParser(prog=prog, description="times start up, parse, model loading, calc, stack_calc "
+        "and entails over generated models, writes a json record per measurement")
+    parser.add_argument("--shapes", default='random,chain,tree,grid',
+        help="comma separated model shapes, of %s (default: random,chain,tree,grid)" % ", ".join(sorted(SHAPES)))
+    parser.add_argument("--sizes", default='100,1000,10000',
+        help="comma separated amounts of worlds (default: 100,1000,10000)")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+        help="comma separated benchmarks to run, of %s (default: %s)" % (
+            ", ".join(BENCHMARKS + NUMPY_BENCHMARKS), ",".join(BENCHMARKS)))
+    parser.add_argument("-d", "--density", type=float, default=2.0,
+        help="transitions per world (random) or children per world (tree), default: 2")
+    parser.add_argument("-v", "--variables", type=int, default=3, help="the amount of variables (default: 3)")
+    parser.add_argument("-f", "--formulas", type=int, default=20, help="the amount of formulas (default: 20)")
+    parser.add_argument("--depth", type=int, default=6, help="the depth of the formulas (default: 6)")
+    parser.add_argument("--modal", type=float, default=0.3,
+        help="the chance an operator is a Box or Diamond (default: 0.3)")
+    parser.add_argument("--sharing", type=float, default=0.0,
+        help="the chance a sub formula is one generated before (default: 0)")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per measurement, the best counts (default: 3)")
+    parser.add_argument("-P", "--processes", type=int, default=None,
+        help="the amount of processes of the parallel benchmark (default: #cores)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="the seed of the generators (default: 0)")
+    parser.add_argument("-o", "--output", help="file to write the records to (default stdout)")
+    parser.add_argument("--startup-budget", type=float, metavar='MS',
+        help="fails when a subcommand takes more than MS milliseconds longer to start than the interpreter")
+    parser.add_argument("-c", "--compare", metavar='FILE',
+        help="compares with the records of an earlier run, prints the ratio of the times per measurement")
+    args = parser.parse_args(argv)
+
+    benchmarks = args.benchmarks.split(',')
+    unknown = [name for name in benchmarks if name not in BENCHMARKS + NUMPY_BENCHMARKS] + \
+              [shape for shape in args.shapes.split(',') if shape not in SHAPES]
+    if unknown:
+        parser.error("unknown benchmark or shape: %s" % ", ".join(unknown))
+
+    records = run(args.shapes.split(','), [int(size) for size in args.sizes.split(',')], benchmarks,
+                  args.density, args.variables, args.formulas, args.depth, args.modal, args.sharing,
+                  args.repeat, args.seed, args.processes)
+    if args.compare:
+        records = compare(read_results(args.compare), records)
+    else:
+        records = ((record, None) for record in records)
+    over_budget = []
+    with open(args.output, 'w') if args.output else nullcontext(sys.stdout) as output:
+        for record, ratio in records:
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            if args.compare:
+                sys.stderr.write("%-10s %-7s %7s  %9.4fs  %s\n" % (
+                    record['benchmark'], record.get('shape', record.get('command', '-')), record.get('worlds', '-'),
+                    record['seconds'], "new" if ratio is None else "%.2fx %s" % (ratio, "slower" if ratio > 1 else "faster")))
+            if args.startup_budget is not None and record.get('overhead', 0) * 1000 > args.startup_budget:
+                over_budget.append(record)
+    for record in over_budget:
+        sys.stderr.write("%s starts in %.1fms more than the interpreter, the budget is %.1fms\n" % (
+            record['command'], record['overhead'] * 1000, args.startup_budget))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Compact binary (.kbin) format for Kripke models, meant to be memory mapped.
+#
+# Loading a .kbin file only maps it, nothing is parsed or materialised up
+# front: world names are decoded when they're needed, the relation is read
+# straight from the CSR arrays and valuations are bitmaps that map directly on
+# the bitsets of bitset.py. All numbers are little endian, every section
+# starts at a multiple of 8 bytes:
+#
+#   header    magic, #worlds (n), #worlds in W (w), #transitions (e),
+#             #variables (v), width of a world index (4 or 8 bytes)
+#   names     offsets u64[n+1] into the utf-8 blob that follows
+#   indptr    u64[w+1], the successors of world i are indices[indptr[i]:indptr[i+1]]
+#   indices   u32/u64[e]
+#   variables offsets u64[v+1] into the utf-8 blob of variable names that
+#             follows, then v bitmaps of ceil(n/8) bytes (bit i is world i)
+#
+# Worlds are indexed like bitset.WorldIndex, so the worlds of W come first.
+import mmap
+import struct
+import sys
+from array import array
+
+from bitset import reporting
+
+MAGIC  = b'KRIPKE\x00\x01'
+HEADER = struct.Struct('<8s5Q')
+
+
+def _pad(n):
+    "rounds n up to a multiple of 8"
+    return (n + 7) & ~7
+
+
+def _write_array(out, code, items):
+    "writes items as a little endian array padded to 8 bytes, returns the size"
+    data = array(code, items)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    raw = data.tobytes()
+    out.write(raw + b'\0' * (_pad(len(raw)) - len(raw)))
+    return _pad(len(raw))
+
+
+def _write_blob(out, strings):
+    "writes an offset table and a utf-8 blob for strings"
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = [0]
+    for e in encoded:
+        offsets.append(offsets[-1] + len(e))
+    _write_array(out, 'Q', offsets)
+    blob = b''.join(encoded)
+    out.write(blob + b'\0' * (_pad(len(blob)) - len(blob)))
+
+
+def save_kripke(kripke, filename):
+    "Writes a Kripke model to filename in the .kbin format"
+    index  = kripke.bitset()
+    n, w   = index.size, index.count(index.all)
+    width  = 4 if n < 2 ** 32 else 8
+    rows   = index.names[:w]
+    nbytes = _pad((n + 7) // 8)
+    names  = sorted(kripke.V)
+
+    with open(filename, 'wb') as out:
+        indptr = [0]
+        for world in rows:
+            indptr.append(indptr[-1] + len(kripke.R.get(world, ())))
+
+        out.write(HEADER.pack(MAGIC, n, w, indptr[-1], len(names), width))
+        _write_blob(out, index.names)
+        _write_array(out, 'Q', indptr)
+        _write_array(out, 'I' if width == 4 else 'Q',
+                     (index.index[v] for world in rows for v in kripke.R.get(world, ())))
+        _write_blob(out, names)
+        for name in names:
+            out.write(index.var(name).to_bytes(nbytes, 'little'))
+
+
+class MappedKripke:
+    """
+    A read only Kripke model backed by a memory mapped .kbin file.
+
+    It is its own bitset algebra (see bitset.WorldIndex and
+    LogicExpression.combine), so expressions can be evaluated on it directly:
+    expression.bit_calc(model), EvalContext(model) and model.entails(...)
+    all work without materialising the model. Use to_kripke for a mutable,
+    regular Kripke object.
+    """
+    version = 0   # the model never changes, see EvalContext
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._map  = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, w, e, v, width = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise ValueError("%s is not a .kbin file" % filename)
+
+        self.size  = n
+        self.all   = (1 << w) - 1
+        self._rows = w
+        view, pos  = memoryview(self._map), HEADER.size
+
+        self._name_offsets, pos = self._array(view, pos, 'Q', n + 1)
+        self._names,        pos = view[pos:pos + self._name_offsets[n]], _pad(pos + self._name_offsets[n])
+        self.indptr,        pos = self._array(view, pos, 'Q', w + 1)
+        self.indices,       pos = self._array(view, pos, 'I' if width == 4 else 'Q', e)
+        var_offsets,        pos = self._array(view, pos, 'Q', v + 1)
+        var_names = bytes(view[pos:pos + var_offsets[v]])
+        pos = _pad(pos + var_offsets[v])
+
+        nbytes = _pad((n + 7) // 8)
+        self._bitmaps = {}
+        for i in range(v):
+            name = var_names[var_offsets[i]:var_offsets[i + 1]].decode('utf-8')
+            self._bitmaps[name] = view[pos:pos + nbytes]
+            pos += nbytes
+
+        # every view on the map has to be released before it can be closed
+        self._views = [view, self._name_offsets, self._names, self.indptr, self.indices, var_offsets]
+        self._views.extend(self._bitmaps.values())
+
+        self._index = None
+        self._vals  = {}
+
+    @staticmethod
+    def _array(view, pos, code, count):
+        "returns a (zero copy when possible) view of count numbers at pos and the next position"
+        size = array(code).itemsize * count
+        raw  = view[pos:pos + size]
+        if sys.byteorder == 'little':
+            data = raw.cast(code)
+        else:
+            data = array(code, bytes(raw))
+            data.byteswap()
+        return data, _pad(pos + size)
+
+    def close(self):
+        "Unmaps the file, the model can't be used afterwards"
+        for view in reversed(self._views):
+            if isinstance(view, memoryview):
+                view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def name(self, i):
+        "the name of world i"
+        return bytes(self._names[self._name_offsets[i]:self._name_offsets[i + 1]]).decode('utf-8')
+
+    def variables(self):
+        "the variables with a valuation in the model"
+        return sorted(self._bitmaps)
+
+    def bitset(self, progress=None):
+        return self
+
+    def entails(self, expression):
+        "Checks whether the model entails the expression"
+        return expression.bit_calc(self) == self.all
+
+    def to_kripke(self):
+        "Materialises the model as a regular Kripke object"
+        from data import Kripke
+        kripke = Kripke()
+        names  = [self.name(i) for i in range(self.size)]
+        kripke.add_worlds(names[:self._rows])
+        kripke.add_transes((names[i], names[j]) for i in range(self._rows)
+                           for j in self.indices[self.indptr[i]:self.indptr[i + 1]])
+        for var in self._bitmaps:
+            kripke.add_vals(var, self.worlds(self.var(var)))
+        return kripke
+
+    # conversion between world sets and bitsets, see bitset.WorldIndex
+    def to_bits(self, ws):
+        "Converts a collection of worlds into a bitset"
+        if self._index is None:
+            self._index = dict((self.name(i), i) for i in range(self.size))
+        flags = bytearray(b'0' * self.size)
+        for w in ws:
+            flags[self._index[w]] = ord('1')
+        return int(bytes(flags[::-1]), 2) if flags else 0
+
+    from_worlds = to_bits   # the name the algebras share, see fixpoint.solve
+
+    def worlds(self, bits):
+        "Converts a bitset back into a list of world names (in index order)"
+        members = self._members(bits)
+        return [self.name(i) for i in range(self.size) if members[i] == '1']
+
+    def sample(self, bits, k):
+        "Lists at most k worlds of a bitset (all of them if k is None), in index order"
+        members, names = self._members(bits), []
+        i = members.find('1')
+        while i != -1 and (k is None or len(names) < k):
+            names.append(self.name(i))
+            i = members.find('1', i + 1)
+        return names
+
+    def count(self, bits):
+        "The amount of worlds in a bitset"
+        return bin(bits).count('1')
+
+    def _members(self, bits):
+        "returns a string which has '1' at position i iff world i is in bits"
+        return format(bits, 'b').zfill(self.size)[::-1]
+
+    def _modal(self, x, quantifier, progress=None):
+        "the worlds for which quantifier holds over the successors being in x"
+        members, indptr, indices = self._members(x), self.indptr, self.indices
+        flags = bytearray(b'0' * self._rows)
+        for i in reporting(range(self._rows), self._rows, progress):
+            if quantifier(members[v] == '1' for v in indices[indptr[i]:indptr[i + 1]]):
+                flags[i] = ord('1')
+        return int(bytes(flags[::-1]), 2) if flags else 0
+
+    # the algebra used by LogicExpression.combine
+    def top(self):
+        return self.all
+
+    def bottom(self):
+        return 0
+
+    def var(self, name):
+        bits = self._vals.get(name)
+        if bits is None:
+            bitmap = self._bitmaps.get(name)
+            bits = self._vals[name] = int.from_bytes(bitmap, 'little') if bitmap is not None else 0
+        return bits
+
+    def neg(self, x):
+        return self.all & ~x
+
+    def conj(self, x, y):
+        return x & y
+
+    def disj(self, x, y):
+        return x | y
+
+    def implies(self, x, y):
+        return (self.all & ~x) | (x & y)
+
+    # unlike WorldIndex these walk every world of W, progress follows them
+    # (see bitset.reporting)
+    def box(self, x, progress=None):
+        return self._modal(x, all, progress)
+
+    def diamond(self, x, progress=None):
+        return self._modal(x, any, progress)
+
+
+def self_test():
+    "Round trips models through .kbin files, compares them and the formulas on them with the originals"
+    import os
+    import tempfile
+    from data     import Kripke
+    from generate import generate_model, random_formulas
+    from parser   import parse
+
+    # a world outside of W (only in R and V) gets an index after those of W
+    kripke = Kripke()
+    kripke.add_worlds(['a', 'b', 'ü'])
+    kripke.add_transes([('a', 'b'), ('b', 'ü'), ('ü', 'ü'), ('a', 'x')])
+    kripke.add_vals('p', ['b', 'x'])
+    kripke.add_vals('q', [])
+    models   = [kripke] + [generate_model(shape, 40, 2.0, 3, seed=seed)
+                           for shape in ('random', 'tree', 'grid') for seed in range(10)]
+    formulas = [parse("mu X. p | diamond X"), parse("nu X. q & box X")] + \
+               random_formulas(30, 5, 3, 0.5, seed=3)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'model.kbin')
+        for kripke in models:
+            save_kripke(kripke, filename)
+            with MappedKripke(filename) as model:
+                copy = model.to_kripke()
+                assert copy.W == kripke.W and copy.R == kripke.R and copy.V == kripke.V, str(kripke)
+                assert model.variables() == sorted(kripke.V)
+                for formula in formulas:
+                    worlds = formula.calc(kripke)
+                    bits   = formula.evaluate(model)
+                    assert set(model.worlds(bits)) == worlds, (formula, str(kripke))
+                    assert model.count(bits) == len(worlds)
+                    sample = model.sample(bits, 3)
+                    assert set(sample) <= worlds and len(sample) == min(3, len(worlds))
+                    assert model.entails(formula) == kripke.entails(formula)
+    print("kbin ok: %d formulas on %d models" % (len(formulas), len(models)))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="converts .kripke models to the memory mapped .kbin format")
+    parser.add_argument("input", nargs='?', help="kripke file (see examples)")
+    parser.add_argument("output", nargs='?', help="output file (default: input with .kbin extension)")
+    parser.add_argument("--self-test", action='store_true',
+        help="round trips generated models through .kbin files and checks them")
+    args = parser.parse_args()
+    if args.self_test:
+        self_test()
+        sys.exit(0)
+    if args.input is None:
+        parser.error("expected a kripke file")
+
+    from evaluator import parse_kripke_file
+    output = args.output or args.input.rsplit('.', 1)[0] + '.kbin'
+    save_kripke(parse_kripke_file(args.input), output)
+
+    with MappedKripke(output) as model:
+        print("%s: %d worlds, %d transitions, %d variables" % (
+            output, model.count(model.all), len(model.indices), len(model.variables())))
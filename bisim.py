@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Bisimulation minimisation of Kripke models.
+#
+# No modal formula (not even with fixpoints) tells bisimilar worlds apart, so
+# a formula can be checked on the quotient of a model by its coarsest
+# bisimulation, with a world per class, and the result mapped back to the
+# worlds of the classes. Only the variables of the formula count, so a model
+# generated from a few symmetric parts usually shrinks by a lot.
+#
+# The coarsest bisimulation is found by Paige-Tarjan partition refinement in
+# O(|R| log |W|): the classes are split by the predecessors of a splitter
+# block, always the smaller half of a compound block, and the per world
+# counts of transitions into compound blocks give the second split without
+# looking at the bigger half.
+#
+# Worlds outside W never satisfy a Box or Diamond, so their transitions don't
+# matter and being in W is part of what has to match, like the valuation.
+#
+# Usage:
+#     minimizer = Minimizer(kripke)
+#     minimizer.calc(parse("p -> diamond q"))      # same as calc on kripke
+#     minimizer.quotient({'p', 'q'}).kripke        # the quotient model
+#
+#     ./bisim.py examples/example1.kripke p q
+#     ./bisim.py --self-test
+from context import EvalContext
+from data    import Kripke
+
+
+def coarsest_partition(kripke, names):
+    """
+    Returns the classes (lists of worlds) of the coarsest bisimulation of a
+    Kripke model that respects W and the variables in names
+    """
+    worlds = set(kripke.W)
+    for w in kripke.W:
+        worlds.update(kripke.R.get(w, ()))
+    for name in names:
+        worlds.update(kripke.V.get(name, ()))
+    worlds = sorted(worlds)
+    index  = dict((w, i) for i, w in enumerate(worlds))
+
+    # the transitions, only those from W, numbered
+    succ  = [[] for w in worlds]
+    preds = [[] for w in worlds]   # world -> [(predecessor, transition)]
+    edges = 0
+    for w in kripke.W:
+        x = index[w]
+        for v in kripke.R.get(w, ()):
+            y = index[v]
+            succ[x].append(y)
+            preds[y].append((x, edges))
+            edges += 1
+
+    labels = {}
+    for x, w in enumerate(worlds):
+        label = (w in kripke.W, frozenset(name for name in names if w in kripke.V.get(name, ())))
+        labels.setdefault(label, []).append(x)
+    return [[worlds[x] for x in block] for block in _refine(succ, preds, edges, labels.values())]
+
+
+def _refine(succ, preds, edges, initial):
+    """
+    Paige-Tarjan refinement of the initial blocks (lists of world indices)
+    until they're stable with respect to the transitions, returns the blocks
+    """
+    size     = len(succ)
+    members  = [set(block) for block in initial]     # block -> worlds
+    block_of = [0] * size                            # world -> block
+    for b, block in enumerate(members):
+        for x in block:
+            block_of[x] = b
+    compound = [0] * len(members)                    # block -> compound block
+    parts    = [set(range(len(members)))]            # compound block -> blocks
+    pending  = [0] if len(members) > 1 else []       # compound blocks of more than one block
+
+    # counts[t] is shared by the transitions of one world into one compound
+    # block: the amount of them
+    cells  = [[len(ys)] for ys in succ]
+    counts = [None] * edges
+    for y in range(size):
+        for x, t in preds[y]:
+            counts[t] = cells[x]
+
+    def split(splitter):
+        "splits every block into the worlds in splitter and the others"
+        touched = {}
+        for x in splitter:
+            touched.setdefault(block_of[x], []).append(x)
+        for b, xs in touched.items():
+            if len(xs) == len(members[b]):
+                continue
+            new = len(members)
+            members.append(set(xs))
+            members[b].difference_update(xs)
+            for x in xs:
+                block_of[x] = new
+            c = compound[b]
+            compound.append(c)
+            parts[c].add(new)
+            if len(parts[c]) == 2:
+                pending.append(c)
+
+    # stable with respect to all worlds: with or without successors
+    split([x for x in range(size) if succ[x]])
+
+    while pending:
+        s = pending.pop()
+        if len(parts[s]) < 2:
+            continue
+        # the smaller of two blocks of s becomes a compound block of its own
+        blocks = iter(parts[s])
+        first, second = next(blocks), next(blocks)
+        b = first if len(members[first]) <= len(members[second]) else second
+        parts[s].discard(b)
+        compound[b] = len(parts)
+        parts.append(set([b]))
+        if len(parts[s]) > 1:
+            pending.append(s)
+
+        # the splits below can split b itself (when it has transitions into
+        # itself), the transitions into all of its worlds are recounted
+        targets = list(members[b])
+        into_b, old = {}, {}   # world -> transitions into b, its count cell for s
+        for y in targets:
+            for x, t in preds[y]:
+                into_b[x] = into_b.get(x, 0) + 1
+                old[x] = counts[t]
+        # worlds with a transition into b, and those without one into s - b
+        only_b = [x for x, n in into_b.items() if n == old[x][0]]
+        split(list(into_b))
+        split(only_b)
+
+        cells = dict((x, [n]) for x, n in into_b.items())
+        for x, n in into_b.items():
+            old[x][0] -= n
+        for y in targets:
+            for x, t in preds[y]:
+                counts[t] = cells[x]
+    return [sorted(block) for block in members if block]
+
+
+class Quotient:
+    """
+    A Kripke model divided by its coarsest bisimulation for the variables in
+    names, see coarsest_partition. Every class is a world of the quotient,
+    named after its first world. It's evaluated in an EvalContext with
+    backend, or in one like context (see EvalContext.like) when given.
+
+    kripke  : the quotient, a Kripke object
+    block   : dict { world -> the quotient world of its class }
+    members : dict { quotient world -> the worlds of its class }
+    """
+    def __init__(self, kripke, names, backend=None, context=None):
+        self.names   = frozenset(names)
+        self.block   = {}
+        self.members = {}
+        for block in coarsest_partition(kripke, self.names):
+            self.members[block[0]] = block
+            for w in block:
+                self.block[w] = block[0]
+
+        self.kripke = Kripke()
+        self.kripke.add_worlds(w for w in self.members if w in kripke.W)
+        self.kripke.add_transes((w, self.block[v]) for w in self.kripke.W for v in kripke.R.get(w, ()))
+        for name in self.names:
+            if kripke.V.get(name):
+                self.kripke.add_vals(name, set(self.block[w] for w in kripke.V[name]))
+        self.context = context.like(self.kripke) if context is not None else EvalContext(self.kripke, backend)
+
+    def __len__(self):
+        return len(self.members)
+
+    def lift(self, worlds):
+        "returns the worlds of the original model in the classes of the given quotient worlds"
+        return set(w for q in worlds for w in self.members[q])
+
+    def calc(self, expression):
+        "returns the set of worlds (of the original model) in which the expression holds"
+        return self.lift(self.context.worlds(expression))
+
+    def count(self, expression):
+        "returns the amount of worlds (of the original model) in which the expression holds"
+        return sum(len(self.members[q]) for q in self.context.worlds(expression))
+
+    def entails(self, expression):
+        "Checks whether the original model entails the expression"
+        return self.context.entails(expression)
+
+
+class Minimizer:
+    """
+    Evaluates expressions on the quotients of one Kripke model, a quotient
+    per set of variables is built on first use and kept until the model
+    changes (it tracks Kripke.version).
+
+    backend : the world set algebra the quotients are evaluated in, see
+              EvalContext
+    context : a context the ones of the quotients are made like instead,
+              e.g. a budget.BudgetContext, see EvalContext.like
+    """
+    def __init__(self, kripke, backend=None, context=None):
+        self.kripke   = kripke
+        self.backend  = backend
+        self.context  = context
+        self._cache   = {}   # frozenset of variables -> Quotient
+        self._version = kripke.version
+
+    def quotient(self, names):
+        "returns the Quotient of the model for the variables in names"
+        if self._version != self.kripke.version:
+            self._cache, self._version = {}, self.kripke.version
+        names = frozenset(names)
+        if names not in self._cache:
+            self._cache[names] = Quotient(self.kripke, names, self.backend, self.context)
+        return self._cache[names]
+
+    def calc(self, expression):
+        "returns the set of worlds in which the expression holds"
+        return self.quotient(expression.variables()).calc(expression)
+
+    def count(self, expression):
+        "returns the amount of worlds in which the expression holds"
+        return self.quotient(expression.variables()).count(expression)
+
+    def entails(self, expression):
+        "Checks whether the model entails the expression"
+        return self.quotient(expression.variables()).entails(expression)
+
+
+def minimize(kripke, names):
+    "Returns the Quotient of a Kripke model for the variables in names"
+    return Quotient(kripke, names)
+
+
+def self_test():
+    "Checks formulas on quotients against checking them on the models themselves"
+    from generate import generate_model, random_formulas
+    from parser   import parse
+
+    # the splits by a splitter block can split that block itself, the
+    # transitions into all of its worlds have to be recounted after
+    kripke = Kripke()
+    kripke.add_worlds('w%02d' % i for i in range(10))
+    kripke.add_transes([('w00', 'w03'), ('w03', 'w00'), ('w03', 'w04'), ('w04', 'w00'),
+                        ('w06', 'w00'), ('w06', 'w03'), ('w07', 'w04'), ('w07', 'w07')])
+    kripke.add_vals('p', ['w02', 'w04', 'w05', 'w06', 'w08', 'w09'])
+    models   = [kripke] + [generate_model(shape, 12, 1.5, 2, seed=seed)
+                           for shape in ('random', 'tree', 'grid') for seed in range(20)]
+    formulas = [parse("diamond (~p & diamond p)"), parse("mu X. p | diamond X")] + \
+               random_formulas(30, 5, 2, 0.5, seed=1)
+    for model in models:
+        minimizer = Minimizer(model)
+        for formula in formulas:
+            assert minimizer.calc(formula) == formula.calc(model), (formula, str(model))
+    print("bisimulation ok: %d formulas on %d models" % (len(formulas), len(models)))
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+    from evaluator import load_model
+
+    parser = ArgumentParser(prog=prog, description="prints the bisimulation quotient of a kripke model")
+    parser.add_argument("file", nargs='?', help="kripke file (see examples)")
+    parser.add_argument("variables", nargs='*',
+        help="the variables that distinguish worlds (default: all variables of the model)")
+    parser.add_argument("--self-test", action='store_true',
+        help="checks formulas on quotients of generated models against the models themselves")
+    args = parser.parse_args(argv)
+    if args.self_test:
+        self_test()
+        return
+    if args.file is None:
+        parser.error("expected a kripke file")
+
+    model = load_model(args.file)
+    if not isinstance(model, Kripke):
+        model = model.to_kripke()
+    quotient = minimize(model, args.variables or model.V)
+    print(str(quotient.kripke))
+    print("")
+    print("%d classes for %d worlds" % (len(quotient), len(quotient.block)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Bitset representation of world sets.
+#
+# Every world of a Kripke model gets a dense integer index, a set of worlds is
+# then a single (arbitrary precision) int with bit i set iff world i is in the
+# set. Intersection, union and complement become single bitwise operations
+# instead of a freshly allocated hash set per node.
+from itertools import islice
+
+ZERO, ONE = ord('0'), ord('1')
+
+REPORT_EVERY = 1024   # worlds between two progress reports, see reporting
+
+
+def reporting(items, total, progress):
+    """
+    Generates items, calling progress(done, total) after every REPORT_EVERY of
+    them, or returns items as is when progress is None. The modal operators
+    walk their worlds through it, so a caller can follow (and abort, by
+    raising from progress) a long Box or Diamond, see budget.py.
+    """
+    if progress is None:
+        return items
+    return _reporting(items, total, progress)
+
+
+def _reporting(items, total, progress):
+    for done, item in enumerate(items, 1):
+        yield item
+        if not done % REPORT_EVERY:
+            progress(done, total)
+
+
+class WorldIndex:
+    """
+    A dense index over the worlds of a Kripke model, doubling as the bitset
+    algebra that LogicExpression.evaluate uses (see LogicExpression.combine).
+
+    The worlds of W get the lowest indices (in sorted order), worlds that only
+    occur in R or V are indexed after them, so results stay identical to the
+    set based calc even for sloppy models.
+
+    progress follows building the index (see reporting), which walks the
+    worlds of R and then of W.
+    """
+    def __init__(self, kripke, progress=None):
+        worlds = sorted(kripke.W)
+        extra  = set()
+        for w, ws in reporting(kripke.R.items(), len(kripke.R), progress):
+            extra.add(w)
+            extra.update(ws)
+        for ws in kripke.V.values():
+            extra.update(ws)
+        extra.difference_update(kripke.W)
+
+        self.kripke = kripke
+        self.names  = worlds + sorted(extra)                   # index -> world
+        self.index  = dict((w, i) for i, w in enumerate(self.names)) # world -> index
+        self.size   = len(self.names)
+        self.all    = (1 << len(worlds)) - 1                   # bitset of W
+
+        # successors (as indices) of every world in W, index aligned with names
+        self._succ = [tuple(self.index[v] for v in kripke.R.get(w, ()))
+                      for w in reporting(worlds, len(worlds), progress)]
+        self._pred = None   # predecessors (in W) of every world, see _predecessors
+        self._vals = {}
+
+    # conversion between world sets and bitsets, only needed at the boundaries
+    def to_bits(self, ws):
+        "Converts a collection of worlds into a bitset"
+        flags = bytearray(b'0' * self.size)
+        for w in ws:
+            flags[self.index[w]] = ONE
+        return self._pack(flags)
+
+    from_worlds = to_bits   # the name the algebras share, see fixpoint.solve
+
+    def worlds(self, bits):
+        "Converts a bitset back into a list of world names (in index order)"
+        members = self._members(bits)
+        return [w for w, m in zip(self.names, members) if m == '1']
+
+    def sample(self, bits, k):
+        "Lists at most k worlds of a bitset (all of them if k is None), in index order"
+        return [self.names[i] for i in islice(self._indices(self._members(bits)), k)]
+
+    def count(self, bits):
+        "The amount of worlds in a bitset"
+        return bin(bits).count('1')
+
+    def _members(self, bits):
+        "returns a string which has '1' at position i iff world i is in bits"
+        return format(bits, 'b').zfill(self.size)[::-1]
+
+    def _indices(self, members, flag='1'):
+        "generates the indices i for which members[i] == flag"
+        i = members.find(flag)
+        while i != -1:
+            yield i
+            i = members.find(flag, i + 1)
+
+    def _predecessors(self, progress=None):
+        if self._pred is None:
+            # lists are only made for worlds with a predecessor, and only
+            # while reporting progress, a list per world up front can take
+            # longer than a whole REPORT_EVERY step (mostly garbage collection)
+            pred = [()] * self.size
+            for w, successors in reporting(enumerate(self._succ), len(self._succ), progress):
+                for v in successors:
+                    if pred[v]:
+                        pred[v].append(w)
+                    else:
+                        pred[v] = [w]
+            self._pred = pred
+        return self._pred
+
+    def _pack(self, flags):
+        "inverse of _members, packs a sequence of '0'/'1' flags in an int"
+        return int(bytes(flags[::-1]), 2) if flags else 0
+
+    # the algebra used by LogicExpression.combine
+    def top(self):
+        return self.all
+
+    def bottom(self):
+        return 0
+
+    def var(self, name):
+        bits = self._vals.get(name)
+        if bits is None:
+            bits = self._vals[name] = self.to_bits(self.kripke.V.get(name, ()))
+        return bits
+
+    def neg(self, x):
+        return self.all & ~x
+
+    def conj(self, x, y):
+        return x & y
+
+    def disj(self, x, y):
+        return x | y
+
+    def implies(self, x, y):
+        return (self.all & ~x) | (x & y)
+
+    # The modal operators only visit the transitions into x (or into its
+    # complement for a box over a large x), not every world
+    def box(self, x, progress=None):
+        members, pred = self._members(x), self._predecessors(progress)
+        inside = members.count('1')
+        if 2 * inside <= len(self._succ):
+            # box holds in blind worlds and where all successors are in x
+            flags  = bytearray(ZERO if succ else ONE for succ in self._succ)
+            counts = {}
+            for v in reporting(self._indices(members), inside, progress):
+                for w in pred[v]:
+                    counts[w] = counts.get(w, 0) + 1
+            for w, n in counts.items():
+                if n == len(self._succ[w]):
+                    flags[w] = ONE
+        else:
+            # box holds except where a successor is outside of x
+            flags = bytearray(b'1' * len(self._succ))
+            for v in reporting(self._indices(members, '0'), self.size - inside, progress):
+                for w in pred[v]:
+                    flags[w] = ZERO
+        return self._pack(flags)
+
+    def diamond(self, x, progress=None):
+        members, pred = self._members(x), self._predecessors(progress)
+        flags = bytearray(b'0' * len(self._succ))
+        total = members.count('1') if progress else None
+        for v in reporting(self._indices(members), total, progress):
+            for w in pred[v]:
+                flags[w] = ONE
+        return self._pack(flags)
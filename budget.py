@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Evaluation within a budget: a deadline, a maximum amount of world set
+# operations and a maximum amount of memory for the extensions an evaluation
+# computes, and cooperative cancellation from another thread (or an asyncio
+# task).
+#
+# A BudgetContext is an EvalContext that checks its Budget before every
+# operator it applies and, for the set and bitset algebras and mapped .kbin
+# models, every bitset.REPORT_EVERY worlds inside the Box and Diamond loops and while
+# building the world index and the predecessor index. The clock starts before
+# the algebra is built, so the first query on a large model is bounded too. When the
+# budget runs out, evaluation stops with BudgetExceeded, whose report tells
+# which nodes finished and how far the current one got. Finished nodes stay
+# in the context's memo, so asking again with more budget picks up from there.
+#
+# Operations and memory are counted per evaluation: every top, var, neg,
+# conj, ... the algebra applies (including those in fixpoint iterations), and
+# an estimate (sys.getsizeof) of the extensions it adds to the memo. Fixpoints are
+# iterated in the algebra rather than by fixpoint.FixpointSolver, so their
+# rounds are checked as well.
+#
+# Usage:
+#     context = BudgetContext(kripke, Budget(seconds=2.0, memory=1 << 30))
+#     try:
+#         worlds = context.calc(parse("mu X. p or diamond X"))
+#     except BudgetExceeded as e:
+#         print(e)                     # or json.dumps(e.report)
+#
+#     worlds = await evaluate_async(context, expression)   # cancellable
+#
+#     ./budget.py --self-test
+import sys
+import threading
+from timeit import default_timer as timer
+
+from binmodel import MappedKripke
+from bitset   import WorldIndex
+from context  import EvalContext
+from data     import WorldSets, postorder
+from tracing  import operator_label
+
+
+class Budget:
+    """
+    The limits of an evaluation, None is no limit
+
+    seconds    : the time one evaluation may take
+    operations : the amount of world set operations one evaluation may apply
+    memory     : the amount of bytes the extensions one evaluation memoises may take
+    """
+    def __init__(self, seconds=None, operations=None, memory=None):
+        self.seconds    = seconds
+        self.operations = operations
+        self.memory     = memory
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Stops every evaluation within this budget at its next check, for good,
+        see BudgetContext.cancellable to cancel a single evaluation
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def __repr__(self):
+        return "Budget(seconds=%r, operations=%r, memory=%r)" % (self.seconds, self.operations, self.memory)
+
+
+class BudgetExceeded(Exception):
+    """
+    Raised when an evaluation runs out of budget (or is cancelled)
+
+    reason   : 'seconds', 'operations', 'memory' or 'cancelled'
+    report   : json friendly dict, see BudgetContext.report
+    finished : the nodes that were evaluated before it stopped
+    current  : the node it stopped in
+    """
+    def __init__(self, reason, report, finished, current):
+        self.reason, self.report = reason, report
+        self.finished, self.current = finished, current
+        Exception.__init__(self, self._describe())
+
+    def _describe(self):
+        report = self.report
+        if self.reason == 'cancelled':
+            text = "evaluation cancelled after %.3fs" % report['seconds']
+        else:
+            used, limit = report[self.reason], report['budget'][self.reason]
+            if self.reason == 'seconds':
+                used, limit = "%.3fs" % used, "%gs" % limit
+            text = "evaluation ran out of %s (budget %s, used %s)" % (self.reason, limit, used)
+        if not report['nodes']:
+            text += ", while building the algebra"
+            if report['progress'] is not None:
+                text += " after %d of %s worlds" % (report['progress']['worlds'], report['progress']['of'])
+            return text
+        text += ", %d of %d nodes finished" % (len(report['finished']), report['nodes'])
+        if report['current'] is not None:
+            text += ", stopped in %s [%d]" % (report['current']['operator'], report['current']['id'])
+            if report['progress'] is not None:
+                text += " after %d of %s worlds" % (report['progress']['worlds'], report['progress']['of'])
+        return text
+
+
+class _Budgeted:
+    """
+    Wraps the algebra of a BudgetContext, checks the budget before every
+    operation and follows the Box and Diamond loops of the set and bitset
+    algebras and of mapped .kbin models (the NumPy backends can't be followed). It has no kripke, so fixpoint.solve iterates in it.
+    """
+    kripke = None
+
+    def __init__(self, algebra, context):
+        self._algebra, self._context = algebra, context
+        self._progress = context._progress if isinstance(algebra, (WorldSets, WorldIndex, MappedKripke)) else None
+        self.worlds, self.count = algebra.worlds, algebra.count
+
+    def _apply(self, name, *args):
+        self._context._operation()
+        return getattr(self._algebra, name)(*args)
+
+    def top(self):
+        return self._apply('top')
+
+    def bottom(self):
+        return self._apply('bottom')
+
+    def var(self, name):
+        return self._apply('var', name)
+
+    def neg(self, x):
+        return self._apply('neg', x)
+
+    def conj(self, x, y):
+        return self._apply('conj', x, y)
+
+    def disj(self, x, y):
+        return self._apply('disj', x, y)
+
+    def implies(self, x, y):
+        return self._apply('implies', x, y)
+
+    def from_worlds(self, ws):
+        return self._apply('from_worlds', ws)
+
+    def box(self, x):
+        if self._progress is None:
+            return self._apply('box', x)
+        return self._apply('box', x, self._progress)
+
+    def diamond(self, x):
+        if self._progress is None:
+            return self._apply('diamond', x)
+        return self._apply('diamond', x, self._progress)
+
+
+class BudgetContext(EvalContext):
+    """
+    An EvalContext (see context.py) that evaluates within a Budget, every
+    evaluate (so every calc, worlds, count, entails) gets the full budget.
+    Raises BudgetExceeded when it runs out.
+
+    Not thread safe, but budget.cancel() and the events of cancellable may
+    be set from any thread.
+    """
+    def __init__(self, kripke, budget, backend=None):
+        self.budget   = budget
+        self._pending = None   # the cancellation event of the next evaluation
+        EvalContext.__init__(self, kripke, backend or self._bitset)
+        self._begin()
+
+    def _bitset(self, kripke):
+        "the default backend, builds the bitset algebra within the budget"
+        return kripke.bitset(self._progress)
+
+    def like(self, kripke):
+        "a new BudgetContext for another model, within the same budget"
+        backend = None if self.backend == self._bitset else self.backend
+        return BudgetContext(kripke, self.budget, backend)
+
+    def cancellable(self):
+        """
+        Returns a threading.Event that cancels the next evaluation (and only
+        that one) once it's set, also when it's set before that evaluation
+        starts. Later evaluations on the context aren't affected.
+        """
+        self._pending = threading.Event()
+        return self._pending
+
+    def _begin(self):
+        "starts the clock and the counts of an evaluation"
+        self._cancel, self._pending = self._pending or threading.Event(), None
+        self._nodes, self._finished, self._current, self._progressed = [], [], None, None
+        self._start    = timer()
+        self._deadline = self._start + self.budget.seconds if self.budget.seconds is not None else None
+        self.operations = 0
+        self.memory     = 0   # estimated bytes of the extensions memoised so far
+
+    def evaluate(self, expression):
+        # building the algebra (see _sync) counts against the budget as well
+        self._begin()
+        self._sync()
+        value = self._evaluate(expression)
+        self._trim(expression)
+        return value
+
+    def _evaluate(self, expression):
+        memo = self._memo
+        if expression in memo:
+            self.hits += 1
+            return memo[expression]
+        self._nodes = list(postorder(expression, memo, operands=True))
+        self._check()
+
+        algebra = _Budgeted(self.algebra, self)
+        references = 1
+        for node in self._nodes:
+            self._current, self._progressed = node, None
+            self._check()
+            args = [memo[operand] for operand in node.operands()]
+            value = memo[node] = node.combine(algebra, *args)
+            self.memory += sys.getsizeof(value)
+            self._finished.append(node)
+            references += len(args)
+            self._check()
+        self._current = None
+        self.misses += len(self._nodes)
+        self.hits   += references - len(self._nodes)
+        return memo[expression]
+
+    def _operation(self):
+        self.operations += 1
+        self._check()
+
+    def _progress(self, done, total):
+        "called from the Box and Diamond loops, see bitset.reporting"
+        self._progressed = (done, total)
+        self._check()
+
+    def _check(self):
+        budget = self.budget
+        if budget.cancelled or self._cancel.is_set():
+            reason = 'cancelled'
+        elif self._deadline is not None and timer() > self._deadline:
+            reason = 'seconds'
+        elif budget.operations is not None and self.operations > budget.operations:
+            reason = 'operations'
+        elif budget.memory is not None and self.memory > budget.memory:
+            reason = 'memory'
+        else:
+            return
+        # the nodes finished so far are kept in the memo
+        finished, current = list(self._finished), self._current
+        raise BudgetExceeded(reason, self.report(), finished, current)
+
+    def report(self):
+        """
+        How far the last evaluate got, as a dict: the time, operations and
+        memory used (and the budget), the amount of nodes it had to evaluate,
+        the finished ones and the current one (id: position in the order of
+        evaluation, operator: see tracing.operator_label) and, in a Box or
+        Diamond, how many of the worlds it walks it has done
+        """
+        ids = dict((node, i) for i, node in enumerate(self._nodes))
+        describe = lambda node: {'id': ids[node], 'operator': operator_label(node)}
+        budget = self.budget
+        return {
+            'seconds':    timer() - self._start,
+            'operations': self.operations,
+            'memory':     self.memory,
+            'budget':     {'seconds': budget.seconds, 'operations': budget.operations, 'memory': budget.memory},
+            'nodes':      len(self._nodes),
+            'finished':   [describe(node) for node in self._finished],
+            'current':    None if self._current is None else describe(self._current),
+            'progress':   None if self._progressed is None else
+                          {'worlds': self._progressed[0], 'of': self._progressed[1]},
+        }
+
+
+async def evaluate_async(context, expression, method='calc', executor=None):
+    """
+    Runs context.method(expression) (calc, worlds, count or entails of a
+    BudgetContext) in executor (default: the loop's) without blocking the
+    event loop. Cancelling the awaiting task cancels this evaluation (see
+    BudgetContext.cancellable) and waits for it to stop, so the worker is free
+    again once the CancelledError comes through. The context can go on with
+    other evaluations after that.
+    """
+    import asyncio
+    loop   = asyncio.get_running_loop()
+    cancel = context.cancellable()
+    future = loop.run_in_executor(executor, getattr(context, method), expression)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.set()
+        try:
+            await future
+        except BudgetExceeded:
+            pass
+        raise
+
+
+def self_test():
+    "Cancels an evaluation of a generated model, then checks the context still evaluates"
+    import asyncio
+    from generate import generate_model
+    from parser   import parse
+
+    kripke  = generate_model('random', 200000, variables=3, seed=1)
+    context = BudgetContext(kripke, Budget())
+    slow    = parse("box diamond box diamond (p & q)")
+
+    async def cancel_one():
+        task = asyncio.ensure_future(evaluate_async(context, slow, 'count'))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(cancel_one()), "the evaluation finished before it was cancelled"
+    assert not context.budget.cancelled
+    for formula in ("q & r", "box diamond box diamond (p & q)"):
+        expression = parse(formula)
+        assert context.count(expression) == kripke.bitset().count(expression.bit_calc(kripke)), formula
+
+    # an evaluation cancelled before it starts stops at its first check
+    context.cancellable().set()
+    try:
+        context.count(parse("p | diamond r"))
+        raise AssertionError("the cancelled evaluation went on")
+    except BudgetExceeded as e:
+        assert e.reason == 'cancelled'
+    assert context.count(parse("p | diamond r")) == len(parse("p | diamond r").calc(kripke))
+    print("budget ok: cancelled one evaluation, the context went on")
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog=prog, description="checks the cancellation of budgeted evaluations")
+    parser.add_argument("--self-test", action='store_true',
+        help="cancels an evaluation and evaluates more formulas on the same context")
+    args = parser.parse_args(argv)
+    if not args.self_test:
+        parser.error("nothing to do, see --self-test")
+    self_test()
+
+
+if __name__ == '__main__':
+    main()
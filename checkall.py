@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Checks a set of formulas against many models in a pool of processes.
+#
+# The formulas are parsed once and sent to the workers as a dump_expressions
+# table (plain tuples) rather than as pickled LogicExpression objects, every
+# worker rebuilds them once in its own intern table. Results are streamed as
+# soon as a model is done.
+#
+# A model that fails to load or to evaluate gets a record with an error, the
+# other models are checked regardless. A formula that doesn't parse stops the
+# run before any model is checked, with the line it's on.
+from __future__ import print_function
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit             import default_timer as timer
+import os
+
+from data      import dump_expressions, load_expressions
+from context   import EvalContext
+from evaluator import load_model
+from simplify  import Simplifier, closed_model
+
+MODEL_EXTENSIONS = ('.kripke', '.kbin', '.skripke')
+
+_expressions = None   # the expressions of a worker, see _init_worker
+_simplify    = True
+
+
+def model_files(paths):
+    "Generates the model files in paths, directories are searched recursively"
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(MODEL_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def _init_worker(table, simplify=True):
+    global _expressions, _simplify
+    _expressions = load_expressions(table)
+    _simplify    = simplify
+
+
+def check_model(filename, expressions=None, simplify=None):
+    """
+    Loads a model and checks the expressions (by default those of the worker)
+    on it, returns a dict with the timings and per expression whether the
+    model entails it and in how many worlds it holds. The expressions are
+    simplified for the model first unless simplify is False (by default the
+    setting of the worker).
+    """
+    expressions = _expressions if expressions is None else expressions
+    simplify    = _simplify if simplify is None else simplify
+    record = {'model': filename}
+    start  = timer()
+    try:
+        model = load_model(filename)
+    except Exception as e:
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        return record
+    loaded  = timer()
+    try:
+        if simplify:
+            simplifier  = Simplifier(closed_model(model))
+            expressions = [simplifier.simplify(e) for e in expressions]
+        context = EvalContext(model)
+        record['results'] = [{'entails': context.entails(e), 'holds_in': context.count(e)} for e in expressions]
+    except Exception as e:
+        # e.g. a MemoryError or RecursionError on one huge model, the others go on
+        record['error'] = "%s: %s" % (type(e).__name__, e)
+        return record
+    record['load_time'] = loaded - start
+    record['eval_time'] = timer() - loaded
+    return record
+
+
+def check_all(expressions, filenames, jobs=None, simplify=True):
+    """
+    Checks expressions against every model file in a process pool (jobs
+    processes, by default one per core). Generates the check_model records
+    in the order in which the models finish.
+    """
+    table = dump_expressions(expressions)
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(table, simplify)) as pool:
+        futures = dict((pool.submit(check_model, filename), filename) for filename in filenames)
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # the worker died (e.g. killed for running out of memory)
+                yield {'model': futures[future], 'error': "%s: %s" % (type(e).__name__, e)}
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+    from parser   import parse, ParseError
+    import json
+    import sys
+
+    parser = ArgumentParser(prog=prog, description="checks formulas against many kripke models in parallel")
+    parser.add_argument("paths", nargs='+', help="model files or directories with .kripke/.kbin files")
+    parser.add_argument("-f", "--formulas", required=True, metavar='FILE',
+        help="file with one formula per line (- for stdin), all of them have to parse")
+    parser.add_argument("-S", "--no-simplify", action='store_true',
+        help="evaluates the formulas as given, without simplifying them first")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="amount of worker processes (default: #cores)")
+    args = parser.parse_args(argv)
+
+    if args.formulas == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.formulas) as stream:
+            lines = stream.readlines()
+    formulas, expressions = [], []
+    for number, line in enumerate(lines, 1):
+        formula = line.strip()
+        if not formula or formula.startswith('#'):
+            continue
+        try:
+            expressions.append(parse(formula))
+        except ParseError as e:
+            parser.error("%s, line %d: %s" % (args.formulas, number, e))
+        formulas.append(formula)
+    filenames   = list(model_files(args.paths))
+
+    start    = timer()
+    entailed = [0] * len(formulas)
+    failed   = 0
+    for done, record in enumerate(check_all(expressions, filenames, args.jobs, not args.no_simplify), 1):
+        if 'error' in record:
+            failed += 1
+        else:
+            for i, result in enumerate(record['results']):
+                entailed[i] += result['entails']
+            record['results'] = [dict(result, formula=f) for f, result in zip(formulas, record['results'])]
+        print(json.dumps(record, ensure_ascii=False))
+        sys.stderr.write("[%d/%d] %s %s\n" % (done, len(filenames), record['model'],
+            "failed" if 'error' in record else "load %.3fs, eval %.3fs" % (record['load_time'], record['eval_time'])))
+
+    sys.stderr.write("checked %d formulas on %d models in %.3fs (%d failed)\n" % (
+        len(formulas), len(filenames), timer() - start, failed))
+    for formula, count in zip(formulas, entailed):
+        sys.stderr.write("  %d/%d models entail %s\n" % (count, len(filenames) - failed, formula))
+
+
+if __name__ == '__main__':
+    main()
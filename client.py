@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Client of the model checking server (see server.py). It only needs the
+# standard library, so it starts quickly.
+#
+# Usage:
+#     ./client.py load m examples/example1.kripke
+#     ./client.py entails m "p -> diamond q"
+#     ./client.py extension m "diamond p"
+#     ./client.py batch m formulas.txt       # json record per formula, like evaluator.py --batch
+#     ./client.py stats
+#     ./client.py shutdown
+#
+#     with Client() as client:
+#         client.request(op='entails', model='m', formula='p')['entails']
+import json
+import os
+import socket
+import tempfile
+from contextlib import nullcontext
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'modlog.sock')
+
+
+class ServerError(Exception):
+    "Raised when the server answers a request with an error"
+
+
+class Client:
+    """
+    A connection to the server, on a Unix socket or a localhost port.
+    Requests are dicts, see server.py for the protocol.
+    """
+    def __init__(self, socket_path=DEFAULT_SOCKET, port=None):
+        if port is not None:
+            self._socket = socket.create_connection(('127.0.0.1', port))
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(socket_path)
+        self._reader = self._socket.makefile('r', encoding='utf-8')
+        self._writer = self._socket.makefile('w', encoding='utf-8')
+
+    def close(self):
+        self._reader.close()
+        self._writer.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self):
+        line = self._reader.readline()
+        if not line:
+            raise ServerError("the server closed the connection")
+        return json.loads(line)
+
+    def request(self, **request):
+        "sends one request, returns the response, raises ServerError if it failed"
+        self._writer.write(json.dumps(request, ensure_ascii=False) + "\n")
+        self._writer.flush()
+        response = self._read()
+        if not response.get('ok'):
+            raise ServerError(response.get('error'))
+        return response
+
+    def pipeline(self, requests, window=256):
+        """
+        Sends many requests without waiting for every response, keeping at
+        most window of them in flight, and generates the responses in order
+        (failed ones too, see their 'ok')
+        """
+        pending = 0
+        for request in requests:
+            self._writer.write(json.dumps(request, ensure_ascii=False) + "\n")
+            pending += 1
+            if pending == window:
+                self._writer.flush()
+                yield self._read()
+                pending -= 1
+        self._writer.flush()
+        for _ in range(pending):
+            yield self._read()
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+    import sys
+
+    parser = ArgumentParser(prog=prog, description="client of the model checking server (server.py)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="the server's Unix socket (default: %(default)s)")
+    parser.add_argument("--port", type=int, help="connects to this localhost port instead of a Unix socket")
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('load', help="loads a model file under a name")
+    command.add_argument("name")
+    command.add_argument("file")
+    command = commands.add_parser('unload', help="forgets a model")
+    command.add_argument("name")
+    commands.add_parser('models', help="lists the loaded models")
+    command = commands.add_parser('entails', help="checks whether a model entails a formula")
+    command.add_argument("model")
+    command.add_argument("formula")
+    command = commands.add_parser('extension', help="lists the worlds of a model in which a formula holds")
+    command.add_argument("model")
+    command.add_argument("formula")
+    command.add_argument("-l", "--limit", type=int, default=1000, help="the most worlds listed (default: 1000)")
+    command = commands.add_parser('batch', help="checks the formulas in a file (- for stdin) against a model")
+    command.add_argument("model")
+    command.add_argument("file")
+    commands.add_parser('stats', help="shows the server's cache statistics")
+    commands.add_parser('shutdown', help="stops the server")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.error("expected a command")
+
+    try:
+        client = Client(args.socket, args.port)
+    except (IOError, OSError) as e:
+        sys.exit("can't connect to the server: %s" % e)
+    try:
+        if args.command == 'batch':
+            with nullcontext(sys.stdin) if args.file == '-' else open(args.file) as formulas:
+                lines = [(number, line.strip()) for number, line in enumerate(formulas, 1)]
+            lines = [(number, line) for number, line in lines if line and not line.startswith('#')]
+            requests = ({'op': 'entails', 'model': args.model, 'formula': line} for number, line in lines)
+            for (number, line), response in zip(lines, client.pipeline(requests)):
+                record = {'line': number, 'formula': line}
+                if response.get('ok'):
+                    record['entails'], record['holds_in'] = response['entails'], response['holds_in']
+                else:
+                    record['error'] = response.get('error')
+                print(json.dumps(record, ensure_ascii=False))
+        elif args.command in ('entails', 'extension'):
+            request = {'op': args.command, 'model': args.model, 'formula': args.formula}
+            if args.command == 'extension':
+                request['limit'] = args.limit
+            response = client.request(**request)
+            print("𝓜  %s %s" % ("⊨" if response['entails'] else "⊭", args.formula))
+            if args.command == 'extension':
+                for w in response['worlds']:
+                    print("𝓜 , %s ⊨ %s" % (w, args.formula))
+                if response['holds_in'] > len(response['worlds']):
+                    print("... and in %d more worlds" % (response['holds_in'] - len(response['worlds'])))
+        else:
+            request = {'op': args.command}
+            if args.command == 'load':
+                request.update(name=args.name, file=os.path.abspath(args.file))
+            elif args.command == 'unload':
+                request['name'] = args.name
+            response = client.request(**request)
+            response.pop('ok')
+            if response:
+                print(json.dumps(response, ensure_ascii=False, indent=2))
+    except ServerError as e:
+        sys.exit("error: %s" % e)
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
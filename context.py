@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Memoised evaluation of expressions against a single model.
+#
+# create_expression hash-conses expressions, so equal sub expressions are the
+# very same object, e.g. (p -> q) & ◇(p -> q) contains one Implies node. Plain
+# calc still evaluates such a node once for every parent referencing it, an
+# EvalContext evaluates every distinct node only once per model.
+from collections import OrderedDict
+
+from data import postorder, sample_worlds
+
+
+class EvalContext:
+    """
+    Caches the extension of every evaluated (sub) expression for one model.
+
+    kripke   : the Kripke model all expressions are evaluated in
+    backend  : callable creating the world set algebra from the model,
+               defaults to the bitset algebra (Kripke.bitset)
+    profiler : a profiling.Profiler that records every node evaluated
+               (default: none, nothing is recorded)
+    capacity : the most extensions kept, after an evaluation the least
+               recently used ones (not part of a recently evaluated
+               expression) are dropped (default: None, all are kept)
+
+    The cache is dropped automatically when the model is mutated through its
+    add_* methods (it tracks Kripke.version), call invalidate after changing
+    the model in any other way (it invalidates the model as well).
+    """
+    def __init__(self, kripke, backend=None, profiler=None, capacity=None):
+        self.kripke   = kripke
+        self.backend  = backend or (lambda kripke: kripke.bitset())
+        self.profiler = profiler
+        self.capacity = capacity
+        self.hits    = 0
+        self.misses  = 0
+        self._reset()
+
+    def like(self, kripke):
+        "a new context for another model that evaluates the way this one does"
+        return EvalContext(kripke, self.backend, self.profiler, self.capacity)
+
+    def invalidate(self):
+        "Forgets all memoised extensions and what the model derived from itself"
+        if hasattr(self.kripke, 'invalidate'):
+            self.kripke.invalidate()
+        self._reset()
+
+    def _reset(self):
+        self.algebra  = None
+        self._memo    = {} if self.capacity is None else OrderedDict()
+        self._version = None
+
+    def _sync(self):
+        "makes sure the memo belongs to the current version of the model"
+        if self._version != self.kripke.version or self.algebra is None:
+            self._reset()
+            self.algebra  = self.backend(self.kripke)
+            self._version = self.kripke.version
+
+    def evaluate(self, expression):
+        "returns the extension of expression in the representation of the algebra"
+        self._sync()
+        value = self._evaluate(expression)
+        self._trim(expression)
+        return value
+
+    def _trim(self, expression):
+        "marks the memoised nodes of expression as most recently used, drops the least recently used beyond capacity"
+        if self.capacity is None:
+            return
+        memo, stack, seen = self._memo, [expression], set()
+        while stack:
+            node = stack.pop()
+            if node in seen or node not in memo:
+                continue
+            seen.add(node)
+            memo.move_to_end(node)
+            stack.extend(node.operands())
+        while len(memo) > self.capacity:
+            memo.popitem(last=False)
+
+    def _evaluate(self, expression):
+        # every reference to a node (the root, or a parent using a child)
+        # either computes it for the first time or is answered by the memo
+        memo, algebra = self._memo, self.algebra
+        if self.profiler is not None:
+            return self._profiled(expression)
+        references, computed = 1, 0
+        for node in postorder(expression, memo, operands=True):
+            args = [memo[operand] for operand in node.operands()]
+            memo[node] = node.combine(algebra, *args)
+            references += len(args)
+            computed   += 1
+        self.misses += computed
+        self.hits   += references - computed
+        return memo[expression]
+
+    def _profiled(self, expression):
+        "_evaluate through the profiler"
+        profiler = self.profiler
+        references, computed = profiler.references, profiler.computed
+        value = profiler.evaluate(expression, self.algebra, self._memo)
+        references, computed = profiler.references - references, profiler.computed - computed
+        self.misses += computed
+        self.hits   += references - computed
+        return value
+
+    def calc(self, expression):
+        "returns the set of worlds in which the expression holds"
+        return set(self.worlds(expression))
+
+    def worlds(self, expression):
+        "returns the worlds in which the expression holds, in index order"
+        value = self.evaluate(expression)
+        return self.algebra.worlds(value)
+
+    def sample(self, expression, k):
+        "returns at most k of the worlds in which the expression holds"
+        return sample_worlds(self.algebra, self.evaluate(expression), k)
+
+    def count(self, expression):
+        "returns the amount of worlds in which the expression holds"
+        value = self.evaluate(expression)
+        return self.algebra.count(value)
+
+    def entails(self, expression):
+        "Checks whether the model entails the expression"
+        # value equals top iff it has as many worlds and adds none to top,
+        # this avoids translating the world sets back to world names
+        value, algebra = self.evaluate(expression), self.algebra
+        top = algebra.top()
+        return algebra.count(value) == algebra.count(top) == algebra.count(algebra.disj(value, top))
+
+    def __len__(self):
+        return len(self._memo)
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from collections import defaultdict
+import heapq
+import threading
+from collections import defaultdict, OrderedDict
+from weakref     import WeakValueDictionary
+from bitset      import WorldIndex, reporting
 
 # To model modal logic, we have here a Kripke class
 class Kripke:
@@ -13,10 +17,73 @@ class Kripke:
         self.R    = defaultdict(set) # dict { world -> set(worlds) }
 
         self._cached_blind_worlds = None
+        self._cached_bitset       = None
+        self._predecessors        = None   # dict { world -> set(worlds) }, see predecessors
+        self.version              = 0      # bumped on every mutation
+        self._watchers            = []
 
     def entails(self, expression):
         "Checks whether our model 𝓜 entails the expression"
-        return sorted(self.W) == sorted(expression.calc(self))
+        return expression.bit_calc(self) == self.bitset().top()
+
+    def bitset(self, progress=None):
+        """
+        Returns the dense world index used for bitset evaluation (see
+        bitset.py), progress follows building it (see bitset.reporting)
+        """
+        if self._cached_bitset is None:
+            self._cached_bitset = WorldIndex(self, progress)
+        return self._cached_bitset
+
+    def watch(self, watcher):
+        """
+        Registers watcher(kind, items), which is called after every change of
+        the model with the things that were actually added:
+          'W' : a list of worlds
+          'R' : a list of transitions (a, b)
+          'V' : a list of (var, world) tuples
+        """
+        self._watchers.append(watcher)
+
+    def unwatch(self, watcher):
+        "Unregisters a watcher registered with watch"
+        self._watchers.remove(watcher)
+
+    def invalidate(self):
+        """
+        Drops everything that was derived from the model, call it after
+        changing W, R or V directly rather than through the add_* methods
+        """
+        self._cached_blind_worlds = None
+        self._cached_bitset       = None
+        self._predecessors        = None
+        self.version             += 1
+
+    def _changed(self, kind, items):
+        "Drops everything that was derived from the model and notifies the watchers"
+        if not items:
+            return
+        # the predecessor index is kept up to date by add_trans(es)
+        self._cached_blind_worlds = None
+        self._cached_bitset       = None
+        self.version             += 1
+        for watcher in self._watchers:
+            watcher(kind, items)
+
+    def predecessors(self, progress=None):
+        """
+        Returns the reverse accessibility relation, a dict { world -> set of
+        worlds with a transition to it }. It's built on first use and kept up
+        to date by add_trans(es) after that, don't modify it. progress follows
+        building it (see bitset.reporting).
+        """
+        if self._predecessors is None:
+            predecessors = defaultdict(set)
+            for a, successors in reporting(self.R.items(), len(self.R), progress):
+                for b in successors:
+                    predecessors[b].add(a)
+            self._predecessors = predecessors
+        return self._predecessors
 
     def blind_worlds(self):
         if self._cached_blind_worlds != None:
@@ -26,34 +93,46 @@ class Kripke:
 
     def add_vals(self, var, ws):
         "Adds valuations to the worlds (aka V(p) = {w1, w2, w3})"
-        self.V[var].update(ws)
+        val, new = self.V[var], []
+        for w in ws:
+            if w not in val:
+                val.add(w)
+                new.append((var, w))
+        self._changed('V', new)
         return self
 
     def add_val(self, var, w):
         "Adds world w to V(var) set"
-        self.V[var].add(w)
-        return self
+        return self.add_vals(var, (w,))
 
     def add_worlds(self, ws):
         "Adds worlds ws"
-        self.W.update(ws)
+        new = [w for w in set(ws) if w not in self.W]
+        self.W.update(new)
+        self._changed('W', new)
         return self
 
     def add_world(self, w):
         "Adds a world w"
-        self.W.add(w)
-        return self
+        return self.add_worlds((w,))
 
     def add_transes(self, ts):
         "Adds transistions between worlds, ts is a sequence of tuples"
+        new = []
         for (a,b) in ts:
-            self.R[a].add(b)
+            successors = self.R[a]
+            if b not in successors:
+                successors.add(b)
+                new.append((a, b))
+        if self._predecessors is not None:
+            for a, b in new:
+                self._predecessors[b].add(a)
+        self._changed('R', new)
         return self
 
     def add_trans(self, t):
         "Adds transition between worlds, t is a tuple of worlds"
-        self.R[t[0]].add(t[1])
-        return self
+        return self.add_transes((t,))
 
     def __repr__(self):
         return "Kripke(W=%s, R=%s, V=%s)" % (str(self.W), str(self.R), str(self.V))
@@ -73,14 +152,21 @@ class Kripke:
 #
 # Currently implemented are the Objects
 # And, Or, Implies, Not, Var, Constant (true or false)
+#
+# Expressions share their sub expressions (see create_expression), so an
+# expression is a DAG. All the traversals below walk that DAG with an explicit
+# stack (see postorder), which keeps very deep expressions such as ◇◇◇...p away
+# from the recursion limit and visits every shared node only once.
 class LogicExpression:
     """
     Logic Expression is a parent-class, a sort of interface all Logical
     Expressions have to uphold
     """
-    class_name = None    # Text representing class
-    symbols    = []      # A data container for all operators for expr
-    out_symbol = None    # The symbol used to output
+    class_name   = None    # Text representing class
+    symbols      = []      # A data container for all operators for expr
+    out_symbol   = None    # The symbol used to output
+    stack_indent = "    "  # Extra spacing for the sub expressions in stack_calc
+    modal        = False   # Whether it holds in a world depending on the successors
 
     def __init__(self):
         """
@@ -95,13 +181,21 @@ class LogicExpression:
         repr is the way for the logic expression to show itself as an object structure.
         for instance: And(Or(Var(a), Var(b)), Constant(False))
         """
-        raise NotImplementedError()
+        return fold(self, lambda node, *args: node.repr_format(*args))
 
     def __str__(self):
         """
         str is the way for the logic expression to be human readable
         for instance: (a ∨ b) ∧ 0
         """
+        return fold(self, lambda node, *args: node.str_format(*args))
+
+    def repr_format(self, *args):
+        "the repr of this node, given the reprs of its direct sub expressions"
+        raise NotImplementedError()
+
+    def str_format(self, *args):
+        "the str of this node, given the strs of its direct sub expressions"
         raise NotImplementedError()
 
     def calc(self, kripke):
@@ -112,34 +206,121 @@ class LogicExpression:
         kripke : Kripke model
         returns a set of worlds in which the expression holds
         """
-        raise NotImplementedError()
+        return self.evaluate(WorldSets(kripke))
 
     def stack_calc(self, kripke, spacing=""):
         """
         A variant of calc which gives a stack trace like structure back
         return (set of worlds, stack trace (string))
         """
+        values = {}
+        evaluate(self, WorldSets(kripke), values)
+
+        # The trace follows the tree rather than the DAG (every occurrence gets
+        # its own indentation), it's expanded top down with an explicit stack
+        lines = []
+        todo  = [(self, spacing)]
+        while todo:
+            item = todo.pop()
+            if isinstance(item, str):
+                lines.append(item)
+                continue
+            node, indent = item
+            children = list(node.operands())
+            parts = node.stack_format(kripke, indent, values[node], [values[c] for c in children])
+            for part in reversed(parts):
+                if isinstance(part, int):
+                    part = (children[part], indent + node.stack_indent)
+                todo.append(part)
+        return values[self], "\n".join(lines)
+
+    def stack_format(self, kripke, spacing, res, args):
+        """
+        Formats the stack_calc trace of this node as a list of lines, an int i
+        in that list stands for the trace of the i-th operand
+        res  : the worlds in which this node holds
+        args : the worlds in which the operands hold
+        """
+        raise NotImplementedError()
+
+    def bit_calc(self, kripke):
+        """
+        A variant of calc which works on bitsets rather than sets of worlds.
+        returns an int with bit i set iff the expression holds in world
+        kripke.bitset().names[i], use kripke.bitset().worlds to convert back
+        """
+        return self.evaluate(kripke.bitset())
+
+    def evaluate(self, algebra):
+        """
+        Evaluates the expression bottom up in an algebra of world sets (for
+        instance a bitset.WorldIndex), returns the algebra's representation of
+        the set of worlds in which the expression holds
+        """
+        return evaluate(self, algebra)
+
+    def combine(self, algebra, *args):
+        """
+        Applies the operator of this expression to the already evaluated
+        operands (args, in the order of operands). An algebra
+        provides top, bottom, var, neg, conj, disj, implies, box and diamond,
+        and from_worlds for the fixpoint binders (see fixpoint.py).
+        """
+        raise NotImplementedError()
+
+    def holds_at(self, kripke, world, *args):
+        """
+        Pointwise variant of combine, whether this expression holds in world
+        given the sets of worlds in which the direct sub expressions hold
+        (args, in the order of children)
+        """
         raise NotImplementedError()
 
     def game_calc(self, kripke, world, spacing=""):
         """
-        A variant of calc which generates game trees
-        returns (true/false, stack_trace)
+        A variant of calc which generates game trees, it only checks whether
+        the expression holds in world (see game.LocalChecker)
+        returns (true/false, stack_trace) where stack_trace is the winning
+        strategy of the verifier (if true) or the falsifier (if false)
+        """
+        from game import LocalChecker
+        checker = LocalChecker(kripke)
+        return checker.holds(self, world), checker.strategy(self, world, spacing)
+
+    def game_moves(self, kripke, world):
+        """
+        The position (this expression, world) in the evaluation game, either
+        True/False when it's decided on the spot or a tuple (quantifier, moves):
+          quantifier : all (the falsifier picks a move) or any (the verifier does)
+          moves      : list of (sub expression, world, positive), the move
+                       wins for the verifier iff (sub expression holds in
+                       world) == positive
         """
         raise NotImplementedError()
 
     def expressions(self):
         "returns a set of sub expressions"
-        raise NotImplementedError()
+        return set(postorder(self))
 
     def depth(self):
         "returns the amount of levels of expressions"
-        raise NotImplementedError()
+        return fold(self, lambda node, *depths: max(depths) + 1 if depths else 0)
+
+    def variables(self):
+        "returns the set of (free) variable names used in the expression"
+        return set(free_variables(self))
 
     def children(self):
         "returns generator that loops through direct sub expressions"
         raise NotImplementedError()
 
+    def operands(self):
+        """
+        The direct sub expressions combine needs the value of, the children
+        except for binders: their bodies are evaluated by fixpoint.solve
+        """
+        return self.children()
+
     def same_type(self, other):
         "basically an isinstance of"
         return self.class_name == other.class_name
@@ -153,42 +334,30 @@ class And(LogicExpression):
     def __init__(self, l, r):
         self._left, self._right = l, r
 
-    def __str__(self):
-        l = str(self._left)
-        r = str(self._right)
+    def str_format(self, l, r):
         return "(%s %s %s)" % (l, And.out_symbol, r)
 
-    def __repr__(self):
-        return "And(%s,%s)" % (self._left.__repr__(), self._right.__repr__())
-
-    def calc(self, kripke):
-        return set.intersection(self._left.calc(kripke), self._right.calc(kripke))
-
-    def stack_calc(self, kripke, spacing=""):
-        lhs, lstack = self._left.stack_calc(kripke, spacing+"    ")
-        rhs, rstack = self._right.stack_calc(kripke, spacing+"    ")
-        res = set.intersection(lhs, rhs)
+    def repr_format(self, l, r):
+        return "And(%s,%s)" % (l, r)
 
-        lines = [
+    def stack_format(self, kripke, spacing, res, args):
+        lhs, rhs = args
+        return [
             "%s%s returns {%s}" % (spacing, And.out_symbol, ", ".join(res)),
             '%s- left  expression %s returns {%s}' % (spacing, self._left, ", ".join(lhs)),
-            lstack,
+            0,
             '%s- right expression %s returns {%s}' % (spacing, self._right, ", ".join(rhs)),
-            rstack
+            1
         ]
-        return res, "\n".join(lines)
 
-    def expressions(self):
-        e = self._left.expressions()
-        e.add(self)
-        e.update(self._right.expressions())
-        return e
+    def combine(self, algebra, l, r):
+        return algebra.conj(l, r)
 
-    def depth(self):
-        return max(self._left.depth(), self._right.depth()) + 1
+    def holds_at(self, kripke, world, l, r):
+        return world in l and world in r
 
-    def variables(self):
-        return self._left.variables().union(self._right.variables())
+    def game_moves(self, kripke, world):
+        return all, [(self._left, world, True), (self._right, world, True)]
 
     def children(self):
         yield self._left
@@ -203,42 +372,30 @@ class Or(LogicExpression):
     def __init__(self, l, r):
         self._left, self._right = l, r
 
-    def __str__(self):
-        l = str(self._left)
-        r = str(self._right)
+    def str_format(self, l, r):
         return "(%s %s %s)" % (l, Or.out_symbol, r)
 
-    def __repr__(self):
-        return "Or(%s, %s)" % (self._left.__repr__(), self._right.__repr__())
-
-    def calc(self, kripke):
-        return set.union(self._left.calc(kripke), self._right.calc(kripke))
-
-    def stack_calc(self, kripke, spacing=""):
-        lhs, lstack = self._left.stack_calc(kripke, spacing+"    ")
-        rhs, rstack = self._right.stack_calc(kripke, spacing+"    ")
-        res = set.union(lhs, rhs)
+    def repr_format(self, l, r):
+        return "Or(%s, %s)" % (l, r)
 
-        lines = [
+    def stack_format(self, kripke, spacing, res, args):
+        lhs, rhs = args
+        return [
             "%s%s returns {%s}" % (spacing, Or.out_symbol, ", ".join(res)),
             '%s- left expression %s gives back {%s}' % (spacing, self._left, ", ".join(lhs)),
-            lstack,
+            0,
             '%s- right expression %s gives back {%s}' % (spacing, self._right, ", ".join(rhs)),
-            rstack
+            1
         ]
-        return res, "\n".join(lines)
 
-    def expressions(self):
-        e = self._left.expressions()
-        e.add(self)
-        e.update(self._right.expressions())
-        return e
+    def combine(self, algebra, l, r):
+        return algebra.disj(l, r)
 
-    def depth(self):
-        return max(self._left.depth(), self._right.depth()) + 1
+    def holds_at(self, kripke, world, l, r):
+        return world in l or world in r
 
-    def variables(self):
-        return self._left.variables().union(self._right.variables())
+    def game_moves(self, kripke, world):
+        return any, [(self._left, world, True), (self._right, world, True)]
 
     def children(self):
         yield self._left
@@ -253,51 +410,35 @@ class Implies(LogicExpression):
     def __init__(self, l, r):
         self._left, self._right = l, r
 
-    def __str__(self):
-        l = str(self._left)
-        r = str(self._right)
+    def str_format(self, l, r):
         return "(%s %s %s)" % (l, Implies.out_symbol, r)
 
-    def __repr__(self):
-        return "Implies(%s, %s)" % (self._left.__repr__(), self._right.__repr__())
-
-    def calc(self, kripke):
-        lhs = self._left.calc(kripke)
-        res = kripke.W.difference(lhs)
-
-        if not lhs:
-            return res
-
-        res.update(lhs.intersection(self._right.calc(kripke)))
-        return res
+    def repr_format(self, l, r):
+        return "Implies(%s, %s)" % (l, r)
 
-    def stack_calc(self, kripke, spacing=""):
-        lhs, lstack = self._left.stack_calc(kripke, spacing+"    ")
+    def stack_format(self, kripke, spacing, res, args):
+        lhs, rhs = args
         premise_doesnt_hold = kripke.W.difference(lhs)
-        rhs, rstack = self._right.stack_calc(kripke, spacing+"    ")
-        res = set.union(premise_doesnt_hold, lhs.intersection(rhs))
 
-        lines = [
+        return [
             "%s%s, returns {%s}" % (spacing, Implies.out_symbol, ", ".join(res)),
             "%s- Premise doesn't hold for {%s}" % (spacing, ", ".join(premise_doesnt_hold)),
             '%s- left expression %s gives back {%s}' % (spacing, self._left, ", ".join(lhs)),
-            lstack,
+            0,
             '%s- right expression %s gives back {%s}' % (spacing, self._right, ", ".join(rhs)),
-            rstack
+            1
         ]
-        return res, "\n".join(lines)
 
-    def expressions(self):
-        e = self._left.expressions()
-        e.add(self)
-        e.update(self._right.expressions())
-        return e
+    def combine(self, algebra, l, r):
+        return algebra.implies(l, r)
 
-    def depth(self):
-        return max(self._left.depth(), self._right.depth()) + 1
+    def holds_at(self, kripke, world, l, r):
+        return (world in kripke.W and world not in l) or (world in l and world in r)
 
-    def variables(self):
-        return self._left.variables().union(self._right.variables())
+    def game_moves(self, kripke, world):
+        if world not in kripke.W:
+            return all, [(self._left, world, True), (self._right, world, True)]
+        return any, [(self._left, world, False), (self._right, world, True)]
 
     def children(self):
         yield self._left
@@ -308,34 +449,30 @@ class Not(LogicExpression):
     class_name = 'not'
     symbols = ('not', '~', '¬', '!')
     out_symbol = '¬'
+    stack_indent = "  "
 
     def __init__(self, e):
         self._expr = e
 
-    def __repr__(self):
-        return "Not(%s)" % self._expr.__repr__()
-
-    def __str__(self):
-        return "~%s" % str(self._expr)
+    def repr_format(self, e):
+        return "Not(%s)" % e
 
-    def calc(self, kripke):
-        return kripke.W.difference(self._expr.calc(kripke))
+    def str_format(self, e):
+        return "~%s" % e
 
-    def stack_calc(self, kripke, spacing=""):
-        expr_res, expr_stack = self._expr.stack_calc(kripke, spacing+"  ")
-        res = kripke.W.difference(expr_res)
-        return res, "%s returned {%s}\n%s" % (Not.out_symbol, ", ".join(res), expr_stack)
+    def stack_format(self, kripke, spacing, res, args):
+        return ["%s returned {%s}" % (Not.out_symbol, ", ".join(res)), 0]
 
-    def expressions(self):
-        expr = self._expr.expressions()
-        expr.add(self)
-        return expr
+    def combine(self, algebra, e):
+        return algebra.neg(e)
 
-    def depth(self):
-        return self._expr.depth() + 1
+    def holds_at(self, kripke, world, e):
+        return world in kripke.W and world not in e
 
-    def variables(self):
-        return self._expr.variables()
+    def game_moves(self, kripke, world):
+        if world not in kripke.W:
+            return False
+        return any, [(self._expr, world, False)]
 
     def children(self):
         yield self._expr
@@ -345,44 +482,36 @@ class Box(LogicExpression):
     class_name = 'box'
     symbols = ('☐', 'box')
     out_symbol = '☐'
+    modal = True
 
     def __init__(self, e):
         self._expr = e
 
-    def __repr__(self):
-        return "☐%s" % self._expr.__repr__()
-
-    def __str__(self):
-        return "Box(%s)" % str(self._expr)
+    def repr_format(self, e):
+        return "☐%s" % e
 
-    def calc(self, kripke):
-        internal = self._expr.calc(kripke)
-        actual   = set(w for w in kripke.W if all(v in internal for v in kripke.R[w]))
-        actual.update(kripke.blind_worlds())
-        return actual
+    def str_format(self, e):
+        return "Box(%s)" % e
 
-    def stack_calc(self, kripke, spacing=""):
-        inter, inter_stack = self._expr.stack_calc(kripke, spacing+"    ")
-        actual             = set(w for w in kripke.W if all(v in inter for v in kripke.R[w]))
-        out                = actual.union(kripke.blind_worlds())
-        stack = [
-            "%s%s returned {%s}" % (spacing, Box.out_symbol, ", ".join(out)),
-            "%s- blind worlds, for which any box holds {%s}" % (spacing, ", ".join(actual)),
-            "%s- worlds with successors in which condition holds {%s}" % (spacing, ", ".join(actual)),
-            inter_stack
+    def stack_format(self, kripke, spacing, res, args):
+        blind = kripke.blind_worlds()
+        return [
+            "%s%s returned {%s}" % (spacing, Box.out_symbol, ", ".join(res)),
+            "%s- blind worlds, for which any box holds {%s}" % (spacing, ", ".join(blind)),
+            "%s- worlds with successors in which condition holds {%s}" % (spacing, ", ".join(res - blind)),
+            0
         ]
-        return out, "\n".join(stack)
 
-    def expressions(self):
-        expr = self._expr.expressions()
-        expr.add(self)
-        return expr
+    def combine(self, algebra, e):
+        return algebra.box(e)
 
-    def depth(self):
-        return self._expr.depth() + 1
+    def holds_at(self, kripke, world, e):
+        return world in kripke.W and all(v in e for v in kripke.R.get(world, ()))
 
-    def variables(self):
-        return self._expr.variables()
+    def game_moves(self, kripke, world):
+        if world not in kripke.W:
+            return False
+        return all, [(self._expr, v, True) for v in sorted(kripke.R.get(world, ()))]
 
     def children(self):
         yield self._expr
@@ -392,40 +521,90 @@ class Diamond(LogicExpression):
     class_name = 'box'
     symbols = ('◇', 'diamond')
     out_symbol = '◇'
+    stack_indent = "  "
+    modal = True
 
     def __init__(self, e):
         self._expr = e
 
-    def __repr__(self):
-        return "Diamond(%s)" % self._expr.__repr__()
+    def repr_format(self, e):
+        return "Diamond(%s)" % e
 
-    def __str__(self):
-        return "◇%s" % str(self._expr)
+    def str_format(self, e):
+        return "◇%s" % e
 
-    def calc(self, kripke):
-        internal = self._expr.calc(kripke)
-        return set(w for w in kripke.W if any(v in internal for v in kripke.R[w]))
+    def stack_format(self, kripke, spacing, res, args):
+        return ["%s%s returned {%s}" % (spacing, self.out_symbol, ", ".join(res)), 0]
 
-    def stack_calc(self, kripke, spacing=""):
-        inter, inter_stack = self._expr.stack_calc(kripke, spacing+"  ")
-        out =  set(w for w in kripke.W if any(v in inter for v in kripke.R[w]))
-        stack = "%s%s returned {%s}\n%s" % (spacing, self.out_symbol, ", ".join(out), inter_stack)
-        return out, stack
+    def combine(self, algebra, e):
+        return algebra.diamond(e)
 
-    def expressions(self):
-        expr = self._expr.expressions()
-        expr.add(self)
-        return expr
+    def holds_at(self, kripke, world, e):
+        return world in kripke.W and any(v in e for v in kripke.R.get(world, ()))
 
-    def depth(self):
-        return self._expr.depth() + 1
+    def game_moves(self, kripke, world):
+        if world not in kripke.W:
+            return False
+        return any, [(self._expr, v, True) for v in sorted(kripke.R.get(world, ()))]
 
-    def variables(self):
-        return self._expr.variables()
+    def children(self):
+        yield self._expr
+
+
+class Fixpoint(LogicExpression):
+    """
+    Base class of the fixpoint binders Mu and Nu, binds the variable name in
+    the expression. The variable may only occur positively (under an even
+    amount of negations), which makes the fixpoints exist.
+    """
+    least = True   # least (Mu) or greatest (Nu) fixpoint
+    stack_indent = "  "
+
+    def __init__(self, name, e):
+        if (name, False) in fold(e, _occurrences):
+            raise ValueError("%s occurs negatively in %s, so %s%s can't bind it" % (name, e, self.out_symbol, name))
+        self.name, self._expr = name, e
+
+    def repr_format(self, e):
+        return "%s(%s, %s)" % (type(self).__name__, self.name, e)
+
+    def str_format(self, e):
+        return "(%s%s.%s)" % (self.out_symbol, self.name, e)
+
+    def stack_format(self, kripke, spacing, res, args):
+        return ["%s%s%s returned {%s}" % (spacing, self.out_symbol, self.name, ", ".join(res))]
+
+    def combine(self, algebra):
+        # the body has no value of its own (the bound variable has none
+        # outside of it), the fixpoint is iterated by fixpoint.solve
+        from fixpoint import solve
+        return solve(self, algebra)
+
+    def game_moves(self, kripke, world):
+        # no local game for fixpoints (plays could go on forever), the
+        # position is decided from the extension
+        return world in self.calc(kripke)
 
     def children(self):
         yield self._expr
 
+    def operands(self):
+        return ()
+
+
+class Mu(Fixpoint):
+    class_name = 'mu'
+    symbols = ('μ', 'mu')
+    out_symbol = 'μ'
+    least = True
+
+
+class Nu(Fixpoint):
+    class_name = 'nu'
+    symbols = ('ν', 'nu')
+    out_symbol = 'ν'
+    least = False
+
 
 class Var(LogicExpression):
     class_name = 'var'
@@ -433,27 +612,23 @@ class Var(LogicExpression):
     def __init__(self, n):
         self.name = n
 
-    def __str__(self):
+    def str_format(self):
         return "%s" % self.name
 
-    def __repr__(self):
+    def repr_format(self):
         return "Var(%s)" % self.name
 
-    def calc(self, kripke):
-        return kripke.V[self.name]
-
-    def stack_calc(self, kripke, spacing=""):
-        holds_in = kripke.V[self.name]
-        return holds_in, "%s%s holds in {%s}" % (spacing, self.name, ", ".join(holds_in))
+    def stack_format(self, kripke, spacing, res, args):
+        return ["%s%s holds in {%s}" % (spacing, self.name, ", ".join(res))]
 
-    def expressions(self):
-        return {self}
+    def combine(self, algebra):
+        return algebra.var(self.name)
 
-    def depth(self):
-        return 0
+    def holds_at(self, kripke, world):
+        return world in kripke.V.get(self.name, ())
 
-    def variables(self):
-        return {self.name}
+    def game_moves(self, kripke, world):
+        return self.holds_at(kripke, world)
 
     def children(self):
         return
@@ -470,37 +645,273 @@ class Constant(LogicExpression):
     def __init__(self, value):
         self.value = value
 
-    def __repr__(self):
+    def repr_format(self):
         return "{True}" if self.value else "{False}"
 
-    def __str__(self):
+    def str_format(self):
         return Constant.out_symbols[self.value]
 
-    def calc(self, kripke):
-        return kripke.W if self.value else set()
-
-    def stack_calc(self, kripke, spacing=""):
-        out   = kripke.W if self.value else set()
-        stack = "%s%s holds for {%s}" % (spacing, self.out_symbols[self.value], ", ".join(out))
-        return out, stack
+    def stack_format(self, kripke, spacing, res, args):
+        return ["%s%s holds for {%s}" % (spacing, self.out_symbols[self.value], ", ".join(res))]
 
-    def expressions(self):
-        return {self}
+    def combine(self, algebra):
+        return algebra.top() if self.value else algebra.bottom()
 
-    def depth(self):
-        return 0
+    def holds_at(self, kripke, world):
+        return self.value and world in kripke.W
 
-    def variables(self):
-        return set()
+    def game_moves(self, kripke, world):
+        return self.holds_at(kripke, world)
 
     def children(self):
         return
         yield
 
 
+class WorldSets:
+    """
+    The algebra of plain sets of worlds of a Kripke model, this is what calc
+    and stack_calc evaluate in (see LogicExpression.combine)
+    """
+    def __init__(self, kripke):
+        self.kripke = kripke
+
+    def worlds(self, ws):
+        return sorted(ws)
+
+    def sample(self, ws, k):
+        return sorted(ws) if k is None else heapq.nsmallest(k, ws)
+
+    def count(self, ws):
+        return len(ws)
+
+    def top(self):
+        return self.kripke.W
+
+    def bottom(self):
+        return set()
+
+    def var(self, name):
+        # V is a defaultdict, a lookup would add the name
+        return self.kripke.V.get(name, set())
+
+    def neg(self, x):
+        return self.kripke.W.difference(x)
+
+    def conj(self, x, y):
+        return set.intersection(x, y)
+
+    def disj(self, x, y):
+        return set.union(x, y)
+
+    def implies(self, x, y):
+        res = self.kripke.W.difference(x)
+        res.update(x.intersection(y))
+        return res
+
+    def from_worlds(self, ws):
+        return set(ws)
+
+    # The modal operators work from the predecessors of the worlds in x, so
+    # their cost scales with the transitions into x rather than with |R|
+    def box(self, x, progress=None):
+        kripke = self.kripke
+        pred   = kripke.predecessors(progress)
+        if 2 * len(x) <= len(kripke.W):
+            # count for the predecessors of x how many of their successors are
+            # in x, box holds when that's all of them (or there are none)
+            counts = defaultdict(int)
+            for v in reporting(x, len(x), progress):
+                for w in pred.get(v, ()):
+                    counts[w] += 1
+            res = set(w for w, n in counts.items() if n == len(kripke.R[w]) and w in kripke.W)
+            res.update(kripke.blind_worlds())
+            return res
+        # box holds except where a successor is outside of x
+        res = set(kripke.W)
+        for v, ws in reporting(pred.items(), len(pred), progress):
+            if v not in x:
+                res.difference_update(ws)
+        return res
+
+    def diamond(self, x, progress=None):
+        pred = self.kripke.predecessors(progress)
+        res  = set()
+        for v in reporting(x, len(x), progress):
+            res.update(pred.get(v, ()))
+        res.intersection_update(self.kripke.W)
+        return res
+
+
+def postorder(expression, done=(), operands=False):
+    """
+    Generates the distinct sub expressions of expression (itself included),
+    every sub expression comes after all of its own sub expressions. Sub
+    expressions in done (and everything below them) are skipped. With
+    operands only the operands are walked (see LogicExpression.operands),
+    which leaves out the bodies of binders, as evaluation does.
+
+    Uses an explicit stack, so the depth of the expression doesn't matter
+    """
+    seen  = set()
+    stack = [(expression, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            yield node
+            continue
+        if node in seen or node in done:
+            continue
+        seen.add(node)
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(list(node.operands() if operands else node.children())))
+
+
+def fold(expression, f, memo=None):
+    """
+    Folds f over the expression DAG: f(node, *values of the direct sub
+    expressions) is called exactly once for every distinct sub expression.
+    memo maps sub expressions to their already known value, it gets filled in.
+    """
+    if memo is None:
+        memo = {}
+    for node in postorder(expression, memo):
+        memo[node] = f(node, *[memo[child] for child in node.children()])
+    return memo[expression]
+
+
+def _free(node, *args):
+    if node.class_name == 'var':
+        return frozenset([node.name])
+    free = frozenset().union(*args)
+    return free - frozenset([node.name]) if isinstance(node, Fixpoint) else free
+
+
+def free_variables(expression, memo=None):
+    "The variables of expression that aren't bound by a fixpoint (a frozenset), memo as in fold"
+    return fold(expression, _free, memo)
+
+
+def _occurrences(node, *args):
+    "the (free variable, occurs positively) pairs of node, given those of its direct sub expressions"
+    if node.class_name == 'var':
+        return frozenset([(node.name, True)])
+    if isinstance(node, (Not, Implies)):
+        args = (frozenset((name, not positive) for name, positive in args[0]),) + args[1:]
+    occurrences = frozenset().union(*args)
+    if isinstance(node, Fixpoint):
+        occurrences = frozenset(o for o in occurrences if o[0] != node.name)
+    return occurrences
+
+
+def evaluate(expression, algebra, memo=None):
+    """
+    Evaluates expression in a world set algebra, see LogicExpression.combine.
+    memo as in fold, it gets the values of the sub expressions outside of
+    binders.
+    """
+    if memo is None:
+        memo = {}
+    for node in postorder(expression, memo, operands=True):
+        memo[node] = node.combine(algebra, *[memo[operand] for operand in node.operands()])
+    return memo[expression]
+
+
+def sample_worlds(algebra, x, k):
+    """
+    At most k of the worlds in x (a world set of algebra), converting only
+    those to names when the algebra has a sample, and all of x otherwise
+    """
+    sample = getattr(algebra, 'sample', None)
+    return sample(x, k) if sample else algebra.worlds(x)[:k]
+
+
+class InternTable:
+    """
+    Hash-consing table for expressions, maps a tuple (class, args) to the one
+    instance with those args.
+
+    Expressions are held weakly, so once nothing refers to an expression any
+    more it can be collected (and a new, equal one gets interned later on).
+    Only the `capacity` most recently used expressions are kept alive by the
+    table itself (capacity None keeps everything alive, 0 nothing).
+
+    Interning is thread safe, so expressions may be created from many threads
+    (e.g. by the server, which loads models while it answers queries).
+    """
+    def __init__(self, capacity=4096):
+        self.capacity  = capacity
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._live     = WeakValueDictionary()  # (class, args) -> instance
+        self._recent   = OrderedDict()          # LRU of strong references
+        self._lock     = threading.RLock()
+
+    def intern(self, key, factory):
+        "returns the instance for key, calling factory() to create it if needed"
+        with self._lock:
+            expr = self._live.get(key)
+            if expr is None:
+                self.misses += 1
+                expr = self._live[key] = factory()
+            else:
+                self.hits += 1
+            self._touch(key, expr)
+            return expr
+
+    def _touch(self, key, expr):
+        "marks expr as most recently used, evicting the least recently used"
+        if self.capacity == 0:
+            return
+        self._recent.pop(key, None)
+        self._recent[key] = expr
+        if self.capacity is None:
+            return
+        while len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        return self._live.get(key, default)
+
+    def clear(self):
+        "Unpins all expressions and resets the statistics"
+        with self._lock:
+            self._recent.clear()
+            self._live.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def stats(self):
+        "returns a dict with the size, hit rate and evictions of the table"
+        return {
+            'size'      : len(self._live),
+            'pinned'    : len(self._recent),
+            'capacity'  : self.capacity,
+            'hits'      : self.hits,
+            'misses'    : self.misses,
+            'hit_rate'  : self.hit_rate(),
+            'evictions' : self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._live)
+
+    def __contains__(self, key):
+        return key in self._live
+
+    def __repr__(self):
+        return "InternTable(%s)" % ", ".join("%s=%s" % i for i in sorted(self.stats().items()))
+
+
 # The infix classes, prefix classes etc.
 infix_classes = [And, Or, Implies]
 prefix_classes = [Not, Box, Diamond]
+binder_classes = [Mu, Nu]
 
 # These are some meta data structures, to quickly lookup:
 # - what class belongs to what symbol
@@ -509,7 +920,8 @@ prefix_classes = [Not, Box, Diamond]
 operator_class   = {}  # maps a symbol to its class '&' -> class And
 infix_operators  = []  # a list of all symbols used for infix operators e.g. '&'
 prefix_operators = []  # a list of all symbols used for prefix operators e.g. '~'
-instances        = {}  # maps a tuple (class, args) to instance, since no duplicates are allowed
+binder_operators = []  # a list of all symbols used for fixpoint binders e.g. 'mu'
+instances        = InternTable()  # maps a tuple (class, args) to instance, since no duplicates are allowed
 
 
 # initialise the meta structures
@@ -519,18 +931,21 @@ for c in infix_classes:
 for c in prefix_classes:
     operator_class.update((s, c) for s in c.symbols)
     prefix_operators.extend(c.symbols)
+for c in binder_classes:
+    operator_class.update((s, c) for s in c.symbols)
+    binder_operators.extend(c.symbols)
 
 
 def create_expression(operator, *kwargs):
-    "Creates an expression from tokens, or if operator is 'var', 'const', 'varconst'"
+    """
+    Creates an expression from tokens, or if operator is 'var', 'const', 'varconst'
+    (binders take the name of the bound variable first, e.g. ('mu', 'X', body))
+    """
     if operator in ('var', 'const', 'varconst'):
         return create_var_const(*kwargs)
 
     constructor = operator_class[operator]
-    expression = instances.get((constructor, kwargs))
-    if expression is None:
-        expression = instances[(constructor, kwargs)] = constructor(*kwargs)
-    return expression
+    return instances.intern((constructor, kwargs), lambda: constructor(*kwargs))
 
 
 def create_var_const(name):
@@ -542,10 +957,47 @@ def create_var_const(name):
         constructor = Var
         args = name
 
-    expr = instances.get((constructor, args))
-    if expr == None:
-        expr = instances[(constructor, args)] = constructor(args)
-    return expr
+    return instances.intern((constructor, args), lambda: constructor(args))
+
+
+def dump_expressions(expressions):
+    """
+    Encodes expressions as a compact table of plain tuples, which is cheap to
+    pickle or send to other processes (unlike the interned objects).
+    Shared sub expressions are stored once. returns (nodes, roots) where
+      node  : ('var', name), ('const', value), (binder symbol, name, child index)
+              or (symbol, child indices...)
+      roots : the indices of the given expressions in nodes
+    """
+    index, nodes = {}, []
+    for expression in expressions:
+        for node in postorder(expression, index):
+            if node.class_name == 'var':
+                nodes.append(('var', node.name))
+            elif node.class_name == 'const':
+                nodes.append(('const', node.value))
+            elif isinstance(node, Fixpoint):
+                nodes.append((node.out_symbol, node.name, index[node._expr]))
+            else:
+                nodes.append((node.out_symbol,) + tuple(index[child] for child in node.children()))
+            index[node] = len(nodes) - 1
+    return nodes, [index[expression] for expression in expressions]
+
+
+def load_expressions(table):
+    "Inverse of dump_expressions, returns the list of (interned) expressions"
+    nodes, roots = table
+    built = []
+    for node in nodes:
+        if node[0] == 'var':
+            built.append(create_var_const(node[1]))
+        elif node[0] == 'const':
+            built.append(create_var_const('true' if node[1] else 'false'))
+        elif node[0] in binder_operators:
+            built.append(create_expression(node[0], node[1], built[node[2]]))
+        else:
+            built.append(create_expression(node[0], *[built[i] for i in node[1:]]))
+    return [built[i] for i in roots]
 
 
 if __name__ == '__main__':
@@ -1,7 +1,161 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from data        import Kripke
-import pyparsing as pp
+from context     import EvalContext
+from contextlib  import contextmanager, nullcontext
+import re
+
+
+# Statements of a .kripke file, every statement ends with a ';' and can span
+# multiple lines, '#' starts a comment that runs until the end of the line:
+#
+#   W    = { w1, w2 };
+#   R    = { (w1, w2), (w2, w2) };
+#   V(p) = { w1 };
+#
+# Whitespace and comments are skipped by the token regex itself, and a whole
+# (a, b) transition is a single token when it doesn't contain comments.
+_ident        = r'[A-Za-z0-9_$]+'
+_kripke_token = re.compile(r'(?:\s+|#[^\n]*)*(?:(?P<pair>\(\s*(%s)\s*,\s*(%s)\s*\))|'
+                           r'(?P<ident>%s)|(?P<punct>[{}(),;=])|(?P<bad>.)|\Z)' % (_ident, _ident, _ident))
+_is_ident     = re.compile(_ident + r'\Z').match
+
+# the most worlds listed in which a formula that isn't entailed does hold
+MAX_LISTED = 1000
+
+
+class KripkeFileError(ValueError):
+    "Raised when a .kripke file can't be parsed"
+    def __init__(self, msg, line):
+        ValueError.__init__(self, "line %s: %s" % (line, msg))
+        self.line = line
+
+
+class _KripkeTokens:
+    """
+    Tokenizes a stream in chunks, generates names, punctuation and (a, b)
+    tuples. Line numbers are only worked out when they are asked for.
+    """
+    def __init__(self, stream, chunk_size):
+        self.stream, self.chunk_size = stream, chunk_size
+        self._lines, self._buf, self._pos = 1, '', 0
+
+    def line(self):
+        "the line of the last generated token"
+        return self._lines + self._buf.count('\n', 0, self._pos)
+
+    def __iter__(self):
+        carry = ''
+        while True:
+            chunk = self.stream.read(self.chunk_size)
+            self._lines += self._buf.count('\n', 0, len(self._buf) - len(carry))
+            buf = self._buf = carry + chunk
+            carry = ''
+            for match in _kripke_token.finditer(buf):
+                kind = match.lastgroup
+                self._pos = match.start(kind) if kind else match.start()
+                if chunk and match.end() == len(buf) and kind in (None, 'ident'):
+                    carry = buf[match.start():]   # might continue in the next chunk
+                    break
+                if kind == 'pair':
+                    yield match.group(2, 3)
+                elif kind in ('ident', 'punct'):
+                    yield match.group(kind)
+                elif kind == 'bad':
+                    raise KripkeFileError("unexpected character %r" % match.group(kind), self.line())
+            if not chunk:
+                return
+
+
+def _batched(iterable, size):
+    "Generates lists of at most size items of iterable"
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_kripke(stream, kripke=None, batch_size=4096, chunk_size=1 << 16):
+    """
+    Loads a kripke model from a stream (in the .kripke format) into kripke (a
+    new Kripke object by default), the stream is read incrementally and the
+    model is fed in batches, so memory stays proportional to the model.
+    """
+    if kripke is None:
+        kripke = Kripke()
+    tokenizer = _KripkeTokens(stream, chunk_size)
+    tokens    = iter(tokenizer)
+
+    def take():
+        return next(tokens, None)
+
+    def fail(msg, token):
+        raise KripkeFileError("%s, got %r" % (msg, token), tokenizer.line())
+
+    def expect(*wanted):
+        token = take()
+        if token not in wanted:
+            fail("expected %s" % " or ".join(map(repr, wanted)), token)
+        return token
+
+    def name(token):
+        if not isinstance(token, str) or not _is_ident(token):
+            fail("expected a name", token)
+        return token
+
+    def transition(token):
+        if isinstance(token, tuple):
+            return token
+        if token != '(':
+            fail("expected '('", token)
+        a = name(take())
+        expect(',')
+        b = name(take())
+        expect(')')
+        return a, b
+
+    def sequence(item):
+        "generates the items of '{' [item [',' item]*] '}'"
+        expect('{')
+        token = take()
+        if token == '}':
+            return
+        while True:
+            yield item(token)
+            if expect(',', '}') == '}':
+                return
+            token = take()
+
+    found = False
+    for token in iter(take, None):
+        found = True
+        if token == 'W':
+            expect('=')
+            for batch in _batched(sequence(name), batch_size):
+                kripke.add_worlds(batch)
+        elif token == 'R':
+            expect('=')
+            for batch in _batched(sequence(transition), batch_size):
+                kripke.add_transes(batch)
+        elif token == 'V':
+            expect('(')
+            var = name(take())
+            expect(')')
+            expect('=')
+            kripke.add_vals(var, ())   # a variable with an empty valuation still exists
+            for batch in _batched(sequence(name), batch_size):
+                kripke.add_vals(var, batch)
+        else:
+            fail("expected W, R or V", token)
+        expect(';')
+
+    if not found:
+        raise KripkeFileError("no statements found", tokenizer.line())
+    return kripke
 
 
 def parse_kripke_file(filename):
@@ -10,84 +164,283 @@ def parse_kripke_file(filename):
     """
     assert(filename.endswith(".kripke"))
     with open(filename) as kf:
-        # Remove comments and empty lines
-        kl = []
-        for line in kf:
-            if "#" in line:
-                line, comment = line.split('#', 1)
-
-            line = line.strip()
-            if line:
-                kl.append(line)
-        kstring = "\n".join(kl)
-    assert(kstring)
+        return load_kripke(kf)
 
-    # Create a kripke model
-    kripke = Kripke()
 
-    obrack,  cbrack   = pp.Suppress('{'), pp.Suppress('}')
-    oparens, cparens  = pp.Suppress('('), pp.Suppress(')')
-    equals,  end      = pp.Suppress('='),pp.Suppress(';')
-    comma             = pp.Suppress(',')
-
-    ident     = pp.Word(pp.alphanums + '_$')
-    ident.setParseAction(lambda tokens:tokens[0])
-
-    ident_seq = pp.Optional(ident + pp.ZeroOrMore(comma + ident))
-    ident_seq.setParseAction(lambda tokens:tokens)
-    ident_set = obrack + ident_seq + cbrack
+def load_model(filename):
+    """
+    Loads a model, either a .kripke file (a Kripke object), a memory mapped
+    .kbin file (a binmodel.MappedKripke, see binmodel.py) or a .skripke file
+    (a symbolic.SymbolicKripke, see symbolic.py)
+    """
+    if filename.endswith(".kbin"):
+        from binmodel import MappedKripke
+        return MappedKripke(filename)
+    if filename.endswith(".skripke"):
+        from symbolic import parse_symbolic_file
+        return parse_symbolic_file(filename)
+    return parse_kripke_file(filename)
 
-    tup       = oparens + ident + comma + ident + cparens
-    tup.setParseAction(lambda t:(t[0], t[1]))
-    tup_seq   = pp.Optional(tup + pp.ZeroOrMore(comma + tup))
-    tup_seq.setParseAction(lambda t:t)
-    tup_set   = obrack + tup_seq + cbrack
 
-    V = pp.Suppress('V') + oparens + ident + cparens + equals + ident_set + end
-    V.setParseAction(lambda t:kripke.add_vals(t[0], t[1:]))
+def check_batch(model, formulas, context=None, simplify=True, bisim=False):
+    """
+    Checks many formulas (strings, one formula each) against one model and
+    generates a result dict per formula. All formulas share one EvalContext,
+    so sub expressions that recur between formulas are only evaluated once.
+    Unless simplify is False the formulas are simplified first (see
+    simplify.py). With bisim the formulas are checked on the bisimulation
+    quotients of the model (a Kripke object), one per set of variables, see
+    bisim.py, in contexts like context. Empty formulas and those starting
+    with '#' are skipped.
+    A formula that runs out of the budget of a budget.BudgetContext gets an
+    error and the report of how far it got.
+    """
+    from parser import parse, ParseError
+    from budget import BudgetExceeded
+    if context is None:
+        context = EvalContext(model)
+    if bisim:
+        from bisim import Minimizer
+        minimizer = Minimizer(model, context=context)
+    if simplify:
+        from simplify import Simplifier, closed_model
+        simplifier = Simplifier(closed_model(model))
+    for number, formula in enumerate(formulas, 1):
+        formula = formula.strip()
+        if not formula or formula.startswith('#'):
+            continue
+        record = {'line': number, 'formula': formula}
+        try:
+            expression = parse(formula)
+        except ParseError as e:
+            record['error'] = str(e)
+            yield record
+            continue
+        if simplify:
+            expression = simplifier.simplify(expression)
+        checker = minimizer.quotient(expression.variables()) if bisim else context
+        try:
+            record['entails']  = checker.entails(expression)
+            record['holds_in'] = checker.count(expression)
+        except BudgetExceeded as e:
+            record.pop('entails', None)
+            record['error'], record['budget'] = str(e), e.report
+        yield record
 
-    W = pp.Suppress('W') + equals + ident_set + end
-    W.setParseAction(lambda t:kripke.add_worlds(set(t)))
 
-    R = pp.Suppress('R') + equals + tup_set + end
-    R.setParseAction(lambda t:kripke.add_transes(set(t)))
+@contextmanager
+def _untimed(name):
+    "stands in for Profiler.phase when not profiling"
+    yield
 
-    expr = pp.OneOrMore(V | W | R)
-    return expr.parseString(kstring)[0]
 
-if __name__ == '__main__':
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
     from argparse import ArgumentParser
     from parser import parse
+    from timeit import default_timer as timer
+    import json
+    import sys
 
-    parser = ArgumentParser(description="finite kripke model evaluator")
-    parser.add_argument("file", help="kripke file (see examples)")
-    parser.add_argument("expression", help="logical expression to test over the kripke model")
+    parser = ArgumentParser(prog=prog, description="finite kripke model evaluator")
+    parser.add_argument("file",
+        help="kripke file (see examples), .kbin file (see binmodel.py) or .skripke file (see symbolic.py)")
+    parser.add_argument("expression", nargs='?', help="logical expression to test over the kripke model")
     parser.add_argument("-m", "--model", action='store_true', help="displays model")
     parser.add_argument("-s", "--stack", action='store_true', help="displays a sort of stacktrace when evaluating")
-    args = parser.parse_args()
+    parser.add_argument("--json", action='store_true', help="with -s, writes the trace as json lines")
+    parser.add_argument("--trace-depth", type=int, metavar='N', help="with -s, traces down to depth N")
+    parser.add_argument("--trace-limit", type=int, metavar='N', help="with -s, stops the trace after N nodes")
+    parser.add_argument("--sample", type=int, default=5, metavar='K',
+        help="with -s, shows up to K worlds per node (default: 5)")
+    parser.add_argument("-n", "--numpy", action='store_true', help="evaluates with the (optional) NumPy backend")
+    parser.add_argument("-P", "--parallel", type=int, metavar='N',
+        help="evaluates the modal operators in N processes (sharded NumPy backend)")
+    parser.add_argument("-b", "--batch", metavar='FILE',
+        help="checks the formulas in FILE (one per line, - for stdin) and prints a json record per formula")
+    parser.add_argument("-S", "--no-simplify", action='store_true',
+        help="evaluates the expression as given, without simplifying it first")
+    parser.add_argument("-B", "--bisim", action='store_true',
+        help="evaluates on the bisimulation quotient of the model for the variables of the expression")
+    parser.add_argument("--profile", action='store_true',
+        help="reports the time spent per phase and the slowest nodes of the expression(s)")
+    parser.add_argument("--profile-out", metavar='FILE', help="writes the profile as json to FILE")
+    parser.add_argument("--timeout", type=float, metavar='SECONDS',
+        help="stops evaluating an expression after SECONDS, with a report of how far it got")
+    parser.add_argument("--max-operations", type=int, metavar='N',
+        help="stops evaluating an expression after N world set operations")
+    parser.add_argument("--max-memory", type=float, metavar='MB',
+        help="stops evaluating an expression when its extensions take more than MB megabytes")
+    parser.add_argument("-w", "--world", help="only checks the expression in WORLD (local model checking, "
+        "with -s the winning strategy of the evaluation game is displayed)")
+    args = parser.parse_args(argv)
+    if (args.expression is None) == (args.batch is None):
+        parser.error("give either an expression or --batch")
+    if args.batch is not None and (args.model or args.stack or args.world is not None):
+        parser.error("--model, --stack and --world can't be combined with --batch")
+    if args.batch is not None and args.parallel and args.bisim:
+        # every set of variables has its own quotient, a pool of processes each
+        parser.error("--parallel can't be combined with --bisim and --batch")
+    if (args.profile or args.profile_out) and not (
+            args.timeout is None and args.max_operations is None and args.max_memory is None):
+        parser.error("--profile can't be combined with --timeout, --max-operations or --max-memory")
+
+    profiler, phase = None, _untimed
+    if args.profile or args.profile_out:
+        from profiling import Profiler
+        profiler = Profiler()
+        phase    = profiler.phase
+
+    def create_context(model, backend):
+        "an EvalContext, or a BudgetContext when a budget is given"
+        if args.timeout is None and args.max_operations is None and args.max_memory is None:
+            return EvalContext(model, backend, profiler)
+        from budget import Budget, BudgetContext
+        memory = None if args.max_memory is None else int(args.max_memory * (1 << 20))
+        return BudgetContext(model, Budget(args.timeout, args.max_operations, memory), backend)
 
-    model      = parse_kripke_file(args.file)
-    expression = parse(args.expression)
+    def write_profile(stream):
+        if args.profile:
+            stream.write("profile\n--------------------------------\n%s\n" % profiler.report())
+        if args.profile_out:
+            with open(args.profile_out, 'w') as out:
+                json.dump(profiler.to_json(), out, ensure_ascii=False)
+
+    if args.batch:
+        start   = timer()
+        with phase('load'):
+            model = load_model(args.file)
+        loaded  = timer()
+        if (args.numpy or args.parallel or args.bisim) and not isinstance(model, Kripke):
+            model = model.to_kripke()
+        backend, sharded = None, None
+        if args.parallel:
+            # -P implies the NumPy backend, its modal operators run sharded
+            from sharded import ShardedKripke
+            sharded = ShardedKripke(model, args.parallel)
+            backend = lambda model: sharded
+        elif args.numpy:
+            from numpy_backend import FrozenKripke as backend
+
+        count    = 0
+        try:
+            context = create_context(model, backend)
+            with nullcontext(sys.stdin) if args.batch == '-' else open(args.batch) as formulas:
+                with phase('check'):
+                    for record in check_batch(model, formulas, context, not args.no_simplify, args.bisim):
+                        print(json.dumps(record, ensure_ascii=False))
+                        count += 1
+        finally:
+            if sharded is not None:
+                sharded.close()
+        done = timer()
+        sys.stderr.write("checked %d formulas in %.3fs (%.0f formulas/second), model loaded in %.3fs\n" % (
+            count, done - loaded, count / max(done - loaded, 1e-9), loaded - start))
+        if profiler:
+            write_profile(sys.stderr)
+        sys.exit(0)
+
+    with phase('load'):
+        model = load_model(args.file)
+    with phase('parse'):
+        formula = parse(args.expression)
+    expression = formula
+    if not args.no_simplify:
+        from simplify import Simplifier, closed_model
+        with phase('simplify'):
+            expression = Simplifier(closed_model(model)).simplify(formula)
+
+    # these need the sets of a regular Kripke object
+    if ((args.model or args.numpy or args.parallel or args.bisim or args.world is not None) and
+            not isinstance(model, Kripke)):
+        model = model.to_kripke()
 
     if args.model:
         print("𝓜  consists of the triplet (W, R, V):")
         print(str(model))
         print("")
 
+    if args.world is not None:
+        if args.world not in model.W:
+            parser.error("there's no world %s in %s" % (args.world, args.file))
+        from game import LocalChecker
+        checker = LocalChecker(model)
+        with phase('local check'):
+            holds = checker.holds(expression, args.world)
+        if args.stack:
+            print("evaluation game")
+            print("--------------------------------")
+            print(checker.strategy(expression, args.world))
+            print("")
+        print("𝓜 , %s %s %s" % (args.world, "⊨" if holds else "⊭", formula))
+        if profiler:
+            write_profile(sys.stdout)
+        sys.exit(0)
+
     if args.stack:
-        print("stack based evaluation")
-        print("--------------------------------")
-        res, stack = expression.stack_calc(model)
-        print(stack)
+        if not args.json:
+            print("stack based evaluation")
+            print("--------------------------------")
+        from tracing import trace, render, to_json
+        with phase('trace'):
+            for record in trace(expression, model, max_depth=args.trace_depth,
+                                max_records=args.trace_limit, sample=args.sample):
+                print(json.dumps(to_json(record), ensure_ascii=False) if args.json else render(record))
+        if not args.json:
+            print("")
+
+    # bisimilar worlds agree on the expression, so the quotient will do
+    quotient = None
+    if args.bisim:
+        from bisim import minimize
+        with phase('bisimulation'):
+            quotient = minimize(model, expression.variables())
+        model    = quotient.kripke
+
+    backend, sharded = None, None
+    if args.parallel:
+        from sharded import ShardedKripke
+        sharded = ShardedKripke(model, args.parallel)
+        backend = lambda model: sharded
+    elif args.numpy:
+        from numpy_backend import FrozenKripke as backend
+
+    try:
+        # shared sub expressions are evaluated once, world sets only get
+        # translated back to world names here, at the boundary
+        from budget import BudgetExceeded
+        context = create_context(model, backend)
+        try:
+            with phase('evaluate'):
+                entailed = context.entails(expression)
+        except BudgetExceeded as e:
+            sys.exit(str(e))
+        if entailed:
+            print("𝓜  ⊨ %s" % formula)
+        else:
+            print("𝓜  ⊭ %s" % formula)
+
+            # symbolic models can have far more worlds than can be listed
+            if quotient is None:
+                holds, listed = context.count(expression), context.sample(expression, MAX_LISTED)
+            else:
+                lifted = sorted(quotient.lift(context.worlds(expression)))
+                holds, listed = len(lifted), lifted[:MAX_LISTED]
+            if holds:
+                print("However,")
+                for w in listed:
+                    print("𝓜 , %s ⊨ %s" % (w, formula))
+                if holds > MAX_LISTED:
+                    print("... and in %d more worlds" % (holds - MAX_LISTED))
+    finally:
+        # the workers and shared memory of the sharded backend
+        if sharded is not None:
+            sharded.close()
+
+    if profiler:
         print("")
+        write_profile(sys.stdout)
 
-    if model.entails(expression):
-        print("𝓜  ⊨ %s" % expression)
-    else:
-        print("𝓜  ⊭ %s" % expression)
 
-        worlds = expression.calc(model)
-        if worlds:
-            print("However,")
-            for w in worlds:
-                print("𝓜 , %s ⊨ %s" % (w, expression))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Evaluation of the fixpoint binders μX.φ (Mu) and νX.φ (Nu).
+#
+# μX.φ is the least set of worlds X with X = φ(X), reached by iterating φ from
+# the empty set, νX.φ the greatest, reached by iterating down from W. Rather
+# than evaluating φ from scratch in every round, FixpointSolver only looks at
+# what can change: when a round changes X by delta, the sub expressions with X
+# in them are updated at the worlds of delta only, and going up through a Box
+# or Diamond only the predecessors of the worlds that changed below it are
+# re-examined (semi-naive iteration, like incremental.IncrementalChecker).
+#
+# Nested fixpoints keep their approximation when a surrounding variable moves
+# in their favour (Emerson-Lei): a μ inside can only grow when an outer
+# variable grows, so it goes on from where it was rather than from the empty
+# set, the same goes for a ν inside when an outer variable shrinks. Only
+# otherwise it starts over.
+#
+# Interning shares sub expressions between binders of the same name, e.g. the
+# ◇X in (μX.◇X) ∧ (νX.◇X), so the solver works on a compiled copy of the DAG
+# with a node for every sub expression and binding of its free variables.
+#
+# The solver works on the Kripke object itself, so only the algebras that are
+# backed by one (the set, bitset, numpy and sharded ones) use it. The others,
+# binmodel.MappedKripke, symbolic.SymbolicKripke and budget's wrapper, have
+# no Kripke to walk and fall back to iterate, which evaluates the body anew
+# in every round.
+from weakref import WeakKeyDictionary
+
+from data import Kripke, Fixpoint, WorldSets, _occurrences, fold, free_variables, postorder
+
+_solvers = WeakKeyDictionary()   # algebra -> (model version, its FixpointSolver)
+
+
+def solve(fixpoint, algebra):
+    """
+    Evaluates a Mu/Nu expression in an algebra (see LogicExpression.combine),
+    with a FixpointSolver when the algebra is backed by a Kripke object and by
+    plain iteration in the algebra otherwise. The binders evaluated in one
+    algebra (and version of its model) share a solver, so nested and repeated
+    ones are solved once.
+    """
+    kripke = getattr(algebra, 'kripke', None)
+    if not isinstance(kripke, Kripke):
+        return iterate(fixpoint, algebra)
+    version, solver = _solvers.get(algebra, (None, None))
+    if version != kripke.version:
+        solver = FixpointSolver(kripke)
+        _solvers[algebra] = (kripke.version, solver)
+    return algebra.from_worlds(solver.extension(fixpoint))
+
+
+class FixpointSolver:
+    """
+    Computes the extensions (sets of worlds) of expressions with fixpoints in
+    one Kripke model, sub expressions shared between the expressions given to
+    one solver are computed once.
+
+    The model is assumed not to change while the solver is used.
+    """
+    def __init__(self, kripke):
+        self.kripke = kripke
+        self._sets  = WorldSets(kripke)
+        self._free  = {}   # expression -> its free variables, see free_variables
+        self._occ   = {}   # expression -> its (free variable, positive) occurrences
+        self._ids   = {}   # (expression, binders of its free variables) -> node
+        self._expr  = []   # node -> expression
+        self._kids  = []   # node -> the nodes of the direct sub expressions
+        self._bound = []   # node -> its binder if it's a bound variable, else None
+        self._ext   = []   # node -> set of worlds (the approximation for binders)
+        self._deps  = {}   # binder -> the nodes in which it's free, children first
+
+    def extension(self, expression):
+        "returns the set of worlds in which expression holds"
+        for node in self._compile(expression):
+            if self._bound[node] is not None:
+                self._ext[node] = set(self._ext[self._bound[node]])
+            elif isinstance(self._expr[node], Fixpoint):
+                self._iterate(node)
+            else:
+                args = [self._ext[kid] for kid in self._kids[node]]
+                self._ext[node] = set(self._expr[node].combine(self._sets, *args))
+        return self._ext[self._ids[self._key(expression, {})]]
+
+    def _key(self, expression, env):
+        "the compiled node of expression where env maps variable names to binders"
+        free = free_variables(expression, self._free)
+        return expression, tuple(sorted((name, env[name]) for name in free if name in env))
+
+    def _compile(self, expression):
+        "adds the nodes of expression that are missing, returns them children first"
+        order, stack = [], [(expression, {}, None)]
+        while stack:
+            expression, env, node = stack.pop()
+            if node is not None:
+                # all sub expressions are compiled, env is the one inside node
+                self._kids[node] = [self._ids[self._key(child, env)] for child in expression.children()]
+                for name, binder in self._key(expression, env)[1]:
+                    self._deps[binder].append(node)
+                order.append(node)
+                continue
+
+            key = self._key(expression, env)
+            if key in self._ids:
+                continue
+            node = self._ids[key] = len(self._expr)
+            self._expr.append(expression)
+            self._kids.append(None)
+            self._bound.append(env.get(expression.name) if expression.class_name == 'var' else None)
+            self._ext.append(None)
+            if isinstance(expression, Fixpoint):
+                env = dict(env)
+                env[expression.name] = node
+                self._deps[node] = []
+                self._ext[node]  = set() if expression.least else set(self.kripke.W)
+            stack.append((expression, env, node))
+            stack.extend((child, env, None) for child in expression.children())
+        return order
+
+    def _iterate(self, binder):
+        "iterates binder until its approximation is a fixpoint of its body"
+        ext, body = self._ext, self._kids[binder][0]
+        direction = 1 if self._expr[binder].least else -1
+        while ext[body] != ext[binder]:
+            self._update(binder, ext[body] ^ ext[binder], direction)
+
+    def _update(self, binder, delta, direction):
+        """
+        changes the approximation of binder by the worlds in delta (which all
+        get added when direction is 1 or removed when it's -1) and brings the
+        nodes in which the binder is free up to date
+        """
+        kripke, ext, pred = self.kripke, self._ext, self.kripke.predecessors()
+        bulk = len(kripke.W) // 8
+        ext[binder] ^= delta
+        flips = {}
+        for node in self._deps[binder]:
+            expression = self._expr[node]
+            if self._bound[node] == binder:
+                flipped = delta
+            elif isinstance(expression, Fixpoint):
+                flips[node] = self._resolve(node, self._expr[binder].name, direction)
+                continue
+            else:
+                values, args = ext[node], [ext[kid] for kid in self._kids[node]]
+                changes = [flips.get(kid, ()) for kid in self._kids[node]]
+                if sum(len(changed) for changed in changes) > bulk:
+                    # most of the model changed, whole set operations are cheaper
+                    flipped = values ^ expression.combine(self._sets, *args)
+                else:
+                    candidates = set()
+                    for changed in changes:
+                        if expression.modal:
+                            for w in changed:
+                                candidates.update(pred.get(w, ()))
+                        else:
+                            candidates.update(changed)
+                    flipped = set(w for w in candidates if expression.holds_at(kripke, w, *args) != (w in values))
+            ext[node] ^= flipped
+            flips[node] = flipped
+
+    def _resolve(self, binder, name, direction):
+        """
+        brings a nested binder up to date after the variable name around it
+        moved in direction, returns the worlds in which its value changed
+        """
+        ext, least = self._ext, self._expr[binder].least
+        before = set(ext[binder])
+        occurrences = fold(self._expr[binder], _occurrences, self._occ)
+        if (name, False) in occurrences or (direction > 0) != least:
+            # moved against the binder (or the binder isn't monotone in the
+            # variable), its approximation may be past the new fixpoint so it
+            # starts over
+            start = set() if least else set(self.kripke.W)
+            if start != ext[binder]:
+                self._update(binder, ext[binder] ^ start, -1 if least else 1)
+        self._iterate(binder)
+        return before ^ ext[binder]
+
+
+def iterate(fixpoint, algebra, env=None, memo=None):
+    """
+    Evaluates a Mu/Nu expression by plain iteration in any algebra: the body
+    is evaluated anew in every round (sub expressions without bound variables
+    only once) until the approximation doesn't change anymore
+
+    env  : values of the variables bound around fixpoint
+    memo : values of sub expressions without bound variables
+    """
+    env  = dict(env or {})
+    memo = {} if memo is None else memo
+    x = algebra.bottom() if fixpoint.least else algebra.top()
+    while True:
+        env[fixpoint.name] = x
+        y = _evaluate_in(fixpoint._expr, algebra, env, memo)
+        if algebra.count(algebra.disj(x, y)) == algebra.count(algebra.conj(x, y)):
+            return y
+        x = y
+
+
+def _evaluate_in(expression, algebra, env, memo):
+    "evaluates expression with the bound variables in env, see iterate"
+    values, free = {}, {}
+    for node in postorder(expression, operands=True):
+        if node.class_name == 'var' and node.name in env:
+            values[node] = env[node.name]
+            continue
+        closed = not any(name in env for name in free_variables(node, free))
+        if closed and node in memo:
+            values[node] = memo[node]
+            continue
+        if isinstance(node, Fixpoint):
+            value = iterate(node, algebra, env, memo)
+        else:
+            value = node.combine(algebra, *[values[child] for child in node.children()])
+        values[node] = value
+        if closed:
+            memo[node] = value
+    return values[expression]
+
+
+if __name__ == '__main__':
+    # Testing
+
+    # a nested binder that isn't monotone in the outer variable has to start
+    # over when that variable moves, the solver must agree with iterate
+    from parser import parse
+    kripke = Kripke()
+    kripke.add_worlds(['c', 'd'])
+    kripke.add_transes([('c', 'c'), ('d', 'c')])
+    kripke.add_vals('p', ['c'])
+    for formula in ("mu X. p or diamond ~(mu Y. ~X or diamond Y)",
+                    "nu X. p and box ~(nu Y. ~X and box Y)",
+                    "mu X. p or diamond (mu Y. X or diamond Y)"):
+        expression = parse(formula)
+        solved  = FixpointSolver(kripke).extension(expression)
+        iterated = WorldSets(kripke).worlds(iterate(expression, WorldSets(kripke)))
+        print("%s: %s" % (formula, sorted(solved)))
+        assert solved == set(iterated), (formula, solved, iterated)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Local (on the fly) model checking: whether a formula holds in one world is
+# decided by playing the evaluation game from (formula, world) rather than by
+# computing the extension of every sub formula over the whole model.
+#
+# The verifier tries to show that the formula holds, the falsifier that it
+# doesn't. At Or and Diamond the verifier picks a move, at And and Box the
+# falsifier does, Not swaps the roles (see LogicExpression.game_moves). A
+# position is decided as soon as the player to move has a winning move, so
+# only the worlds reachable within the modal depth of the formula are ever
+# looked at, and usually far fewer than that.
+#
+# Usage:
+#     checker = LocalChecker(kripke)
+#     checker.holds(expression, 'w1')
+#     print(checker.strategy(expression, 'w1'))
+from data import Fixpoint, WorldSets, evaluate
+
+
+class LocalChecker:
+    """
+    Plays evaluation games on one Kripke model. Decided positions
+    (sub expression, world) are remembered, so asking about several formulas
+    or worlds of the same model shares the work.
+
+    The model is assumed not to change while the checker is used.
+    """
+    def __init__(self, kripke):
+        self.kripke = kripke
+        self._won    = {}   # (sub expression, world) -> True iff the verifier wins
+        self._choice = {}   # (sub expression, world) -> the index of the winning move, if any
+        self._sets   = WorldSets(kripke)
+        self._fixed  = {}   # fixpoint -> its extension
+
+    def __len__(self):
+        "the amount of positions decided so far"
+        return len(self._won)
+
+    def _moves(self, node, world):
+        """
+        node.game_moves, but a fixpoint's extension is computed once per
+        checker rather than at every position it's asked about
+        """
+        if isinstance(node, Fixpoint):
+            if node not in self._fixed:
+                self._fixed[node] = evaluate(node, self._sets)
+            return world in self._fixed[node]
+        return node.game_moves(self.kripke, world)
+
+    def holds(self, expression, world):
+        "Checks whether expression holds in world"
+        won, choice = self._won, self._choice
+        # frames: [position, (quantifier, moves) or None, index of the next move]
+        stack = [[(expression, world), None, 0]]
+        while stack:
+            frame = stack[-1]
+            position = frame[0]
+            if position in won:
+                stack.pop()
+                continue
+            if frame[1] is None:
+                game = self._moves(*position)
+                if game is True or game is False:
+                    won[position] = game
+                    stack.pop()
+                    continue
+                frame[1] = game
+
+            quantifier, moves = frame[1]
+            while frame[2] < len(moves):
+                sub, w, positive = moves[frame[2]]
+                if (sub, w) not in won:
+                    stack.append([(sub, w), None, 0])
+                    break
+                # the player to move wins with this move: the position is decided
+                if (won[(sub, w)] == positive) == (quantifier is any):
+                    won[position]    = quantifier is any
+                    choice[position] = frame[2]
+                    stack.pop()
+                    break
+                frame[2] += 1
+            else:
+                # every move loses for the player to move
+                won[position] = quantifier is all
+                stack.pop()
+        return won[(expression, world)]
+
+    def strategy(self, expression, world, spacing=""):
+        """
+        The winning strategy for the game on (expression, world) as a game
+        tree: the winner's move where it's their turn, and every move where
+        it's the opponent's turn. Returns the lines joined by newlines.
+        """
+        self.holds(expression, world)
+        won, choice = self._won, self._choice
+        lines, stack = [], [((expression, world), spacing)]
+        while stack:
+            position, indent = stack.pop()
+            node, w = position
+            winner  = "verifier" if won[position] else "falsifier"
+            line    = "%s𝓜 , %s %s %s  [%s wins" % (indent, w, "⊨" if won[position] else "⊭", node, winner)
+            game    = self._moves(node, w)
+            if game is True or game is False:
+                lines.append(line + "]")
+                continue
+            quantifier, moves = game
+            mover = "verifier" if quantifier is any else "falsifier"
+            if position in choice:
+                moves = [moves[choice[position]]]
+                line += ", %s picks %s" % (mover, moves[0][1] if node.modal else moves[0][0])
+            elif not moves:
+                line += ", %s has no move" % mover
+            lines.append(line + "]")
+            for sub, v, positive in reversed(moves):
+                stack.append(((sub, v), indent + "  "))
+        return "\n".join(lines)
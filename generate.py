@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Seeded generators of Kripke models and formulas, for benchmarks (see
+# bench.py) and for testing with bigger models than the ones in examples/.
+#
+# Model shapes, every one with `worlds` worlds named w0, w1, ...:
+#
+#   random   `density` transitions per world on average, between random worlds
+#   chain    w0 -> w1 -> ... -> wn, the last world loops
+#   tree     every world has `density` children (at least 1), leaves are blind
+#   clique   a transition between every pair of worlds, also to itself
+#   grid     a square grid, every world has a transition to its neighbours
+#
+# Each of the `variables` variables holds in a world with probability
+# `valuation`. Generators take a seed, the same arguments always give the
+# same model.
+#
+# Usage:
+#     kripke  = generate_model('grid', 10000, variables=3, seed=1)
+#     formula = random_formula(random.Random(1), depth=6, sharing=0.3)
+#
+#     ./generate.py grid 10000 -v 3 -o grid.kripke
+#     ./generate.py --formulas 100 --depth 6
+import random
+
+from data import Kripke, create_expression, create_var_const
+
+
+def variable_names(count):
+    "the names of the first count variables: p, q, r, s, t, u, p_a, p_b, ..."
+    names = list('pqrstu'[:count])
+    for i in range(count - len(names)):
+        name = ''
+        while True:
+            name = chr(ord('a') + i % 26) + name
+            i = i // 26 - 1
+            if i < 0:
+                break
+        names.append('p_' + name)
+    return names
+
+
+def _random(n, density, rng):
+    for _ in range(int(round(n * density))):
+        yield rng.randrange(n), rng.randrange(n)
+
+
+def _chain(n, density, rng):
+    for i in range(n):
+        yield i, min(i + 1, n - 1)
+
+
+def _tree(n, density, rng):
+    branching = max(1, int(round(density)))
+    for i in range(1, n):
+        yield (i - 1) // branching, i
+
+
+def _clique(n, density, rng):
+    for i in range(n):
+        for j in range(n):
+            yield i, j
+
+
+def _grid(n, density, rng):
+    width = max(1, int(round(n ** 0.5)))
+    for i in range(n):
+        if i % width:
+            yield i, i - 1
+        if (i + 1) % width and i + 1 < n:
+            yield i, i + 1
+        if i >= width:
+            yield i, i - width
+        if i + width < n:
+            yield i, i + width
+
+
+SHAPES = {
+    'random': _random,
+    'chain':  _chain,
+    'tree':   _tree,
+    'clique': _clique,
+    'grid':   _grid,
+}
+
+
+def generate_model(shape, worlds, density=2.0, variables=3, valuation=0.4, seed=0):
+    """
+    Generates a Kripke model of one of the SHAPES (see above)
+
+    worlds    : the amount of worlds
+    density   : transitions per world for random, children per world for tree
+    variables : the amount of variables (see variable_names)
+    valuation : the chance a variable holds in a world
+    seed      : the seed of the random generator
+    """
+    if shape not in SHAPES:
+        raise ValueError("unknown shape %s, expected one of %s" % (shape, ", ".join(sorted(SHAPES))))
+    rng, names = random.Random(seed), ['w%d' % i for i in range(worlds)]
+    kripke = Kripke()
+    kripke.add_worlds(names)
+    kripke.add_transes((names[a], names[b]) for a, b in SHAPES[shape](worlds, density, rng))
+    for name in variable_names(variables):
+        kripke.add_vals(name, [w for w in names if rng.random() < valuation])
+    return kripke
+
+
+def write_kripke(kripke, stream):
+    "Writes a Kripke object to a stream in the .kripke format (see evaluator.load_kripke)"
+    stream.write("W = { %s };\n" % ", ".join(sorted(kripke.W)))
+    stream.write("R = { %s };\n" % ", ".join("(%s, %s)" % (a, b)
+                                             for a in sorted(kripke.R) for b in sorted(kripke.R[a])))
+    for name in sorted(kripke.V):
+        stream.write("V(%s) = { %s };\n" % (name, ", ".join(sorted(kripke.V[name]))))
+
+
+def random_formula(rng, depth, variables=3, modal=0.3, modal_depth=None, sharing=0.0, pool=None):
+    """
+    Generates a formula (a LogicExpression) of at most depth operators deep
+
+    rng         : a random.Random
+    variables   : the amount of variables to use (see variable_names)
+    modal       : the chance an operator is a Box or Diamond
+    modal_depth : the most Box and Diamond operators nested in each other
+    sharing     : the chance a sub formula is one generated before (from
+                  pool), which makes the formula a DAG rather than a tree
+    pool        : dict { depth -> [formulas] } of sub formulas to share, pass
+                  the same dict to share between formulas
+    """
+    names = variable_names(variables) + ['true', 'false']
+    pool  = {} if pool is None else pool
+    if modal_depth is None:
+        modal_depth = depth
+
+    def build(depth, modal_left):
+        shared = [f for d in range(depth + 1) for f in pool.get(d, ())]
+        if shared and rng.random() < sharing:
+            return rng.choice(shared)
+        if depth == 0 or rng.random() < 0.1:
+            return create_var_const(rng.choice(names[:-2] if rng.random() < 0.9 else names))
+        if modal_left and rng.random() < modal:
+            formula = create_expression(rng.choice(['box', 'diamond']), build(depth - 1, modal_left - 1))
+        else:
+            op = rng.choice(['&', '|', '->', '~'])
+            if op == '~':
+                formula = create_expression(op, build(depth - 1, modal_left))
+            else:
+                formula = create_expression(op, build(depth - 1, modal_left), build(depth - 1, modal_left))
+        if sharing:
+            pool.setdefault(depth, []).append(formula)
+        return formula
+
+    return build(depth, modal_depth)
+
+
+def random_formulas(count, depth, variables=3, modal=0.3, modal_depth=None, sharing=0.0, seed=0):
+    "Generates count formulas (see random_formula), sub formulas are shared between them as well"
+    rng, pool = random.Random(seed), {}
+    return [random_formula(rng, depth, variables, modal, modal_depth, sharing, pool) for _ in range(count)]
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+    import sys
+
+    parser = ArgumentParser(prog=prog,
+        description="generates random kripke models (.kripke) or formulas (one per line)")
+    parser.add_argument("shape", nargs='?', choices=sorted(SHAPES), help="the shape of the model")
+    parser.add_argument("worlds", nargs='?', type=int, default=100, help="the amount of worlds (default: 100)")
+    parser.add_argument("-d", "--density", type=float, default=2.0,
+        help="transitions per world (random) or children per world (tree), default: 2")
+    parser.add_argument("-v", "--variables", type=int, default=3, help="the amount of variables (default: 3)")
+    parser.add_argument("--valuation", type=float, default=0.4,
+        help="the chance a variable holds in a world (default: 0.4)")
+    parser.add_argument("-f", "--formulas", type=int, metavar='N', help="generates N formulas instead of a model")
+    parser.add_argument("--depth", type=int, default=6, help="with -f, the depth of the formulas (default: 6)")
+    parser.add_argument("--modal", type=float, default=0.3,
+        help="with -f, the chance an operator is a Box or Diamond (default: 0.3)")
+    parser.add_argument("--modal-depth", type=int, help="with -f, the most nested Box/Diamond operators")
+    parser.add_argument("--sharing", type=float, default=0.0,
+        help="with -f, the chance a sub formula is one generated before (default: 0)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="the seed (default: 0)")
+    parser.add_argument("-o", "--output", help="file to write to (default stdout)")
+    args = parser.parse_args(argv)
+    if (args.shape is None) == (args.formulas is None):
+        parser.error("give either a shape or --formulas")
+
+    def write(output):
+        if args.formulas is not None:
+            for formula in random_formulas(args.formulas, args.depth, args.variables, args.modal,
+                                           args.modal_depth, args.sharing, args.seed):
+                output.write("%s\n" % formula)
+        else:
+            write_kripke(generate_model(args.shape, args.worlds, args.density, args.variables,
+                                        args.valuation, args.seed), output)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            write(output)
+    else:
+        write(sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Incremental model checking: the extensions of a set of standing formulas
+# are kept up to date while worlds, transitions and valuations are added to
+# the model, rather than re-evaluating everything after every change.
+#
+# Usage:
+#     checker = IncrementalChecker(kripke)
+#     checker.register(expression)
+#     kripke.add_trans(('w1', 'w2'))
+#     checker.update()     # {expression: (added worlds, removed worlds)}
+from collections import defaultdict
+
+from data import Fixpoint, postorder
+
+
+class IncrementalChecker:
+    """
+    Maintains the extension (set of worlds) of every sub expression of the
+    registered formulas of one Kripke model.
+
+    It watches the model (see Kripke.watch), changes are collected and only
+    applied on update (or when an extension is asked for). An update only
+    re-examines the worlds that can be affected: the changed worlds of the
+    sub expressions, and for Box/Diamond the predecessors of those and the
+    sources of new transitions.
+    """
+    def __init__(self, kripke):
+        self.kripke = kripke
+        self._ext   = {}    # sub expression -> set of worlds
+        self._order = []    # all sub expressions, children before parents
+        self._roots = set()   # the registered formulas
+        self._flips = {}    # registered formula -> worlds it changed in since the last update
+
+        self._new_worlds = set()
+        self._sources    = set()              # worlds with new successors
+        self._new_vals   = defaultdict(set)   # var -> worlds
+        kripke.watch(self._on_change)
+
+    def close(self):
+        "Stops watching the model"
+        self.kripke.unwatch(self._on_change)
+
+    def _on_change(self, kind, items):
+        if kind == 'W':
+            self._new_worlds.update(items)
+        elif kind == 'R':
+            self._sources.update(a for a, b in items)
+        elif kind == 'V':
+            for var, w in items:
+                self._new_vals[var].add(w)
+
+    def register(self, expression):
+        "Starts maintaining the extension of expression"
+        if any(isinstance(node, Fixpoint) for node in postorder(expression)):
+            raise ValueError("fixpoints can't be maintained incrementally: %s" % expression)
+        if expression in self._roots:
+            return expression
+        self._apply()
+        kripke, ext = self.kripke, self._ext
+        for node in postorder(expression, ext):
+            args = [ext[child] for child in node.children()]
+            candidates = set(kripke.W)
+            if node.class_name == 'var':
+                candidates.update(kripke.V.get(node.name, ()))
+            for arg in args:
+                candidates.update(arg)
+            ext[node] = set(w for w in candidates if node.holds_at(kripke, w, *args))
+            self._order.append(node)
+        self._roots.add(expression)
+        return expression
+
+    def update(self):
+        """
+        Applies the pending changes of the model, returns a dict that maps
+        every registered formula whose extension changed since the last update
+        to a tuple (set of worlds added, set of worlds removed). Changes
+        applied by register or extension in between are included.
+        """
+        self._apply()
+        changes, ext = {}, self._ext
+        for root, flipped in self._flips.items():
+            if flipped:
+                changes[root] = (flipped & ext[root], flipped - ext[root])
+        self._flips = {}
+        return changes
+
+    def _apply(self):
+        "applies the pending changes of the model, collects the changed worlds of the formulas"
+        if not (self._new_worlds or self._sources or self._new_vals):
+            return
+        kripke, ext, pred = self.kripke, self._ext, self.kripke.predecessors()
+        flips = {}
+        for node in self._order:
+            children   = list(node.children())
+            candidates = set(self._new_worlds)
+            if node.class_name == 'var':
+                candidates.update(self._new_vals.get(node.name, ()))
+            for child in children:
+                if node.modal:
+                    for w in flips[child]:
+                        candidates.update(pred.get(w, ()))
+                else:
+                    candidates.update(flips[child])
+            if node.modal:
+                candidates.update(self._sources)
+
+            values, args, flipped = ext[node], [ext[child] for child in children], set()
+            for w in candidates:
+                if node.holds_at(kripke, w, *args) != (w in values):
+                    flipped.add(w)
+            values.symmetric_difference_update(flipped)
+            flips[node] = flipped
+
+        self._new_worlds, self._sources, self._new_vals = set(), set(), defaultdict(set)
+        for root in self._roots:
+            if flips[root]:
+                # a world that flips back and forth didn't change
+                self._flips[root] = self._flips.get(root, set()) ^ flips[root]
+
+    def extension(self, expression):
+        "returns the set of worlds in which a registered expression holds"
+        self._apply()
+        return self._ext[expression]
+
+    def entails(self, expression):
+        "Checks whether the model entails a registered expression"
+        return self.extension(expression) == self.kripke.W
+
+
+if __name__ == '__main__':
+    # Testing
+
+    # the extensions and reported changes of the registered formulas must
+    # match evaluating them from scratch after every change of the model
+    import random
+    from generate import generate_model, random_formulas
+    rng = random.Random(1)
+    for seed in range(20):
+        kripke   = generate_model('random', 30, 1.0, 3, seed=seed)
+        checker  = IncrementalChecker(kripke)
+        formulas = random_formulas(10, 5, 3, 0.4, seed=seed)
+        before   = {}
+        for formula in formulas + formulas[:3]:   # registering twice changes nothing
+            checker.register(formula)
+            before[formula] = set(formula.calc(kripke))   # calc of a variable is V's own set
+        for step in range(30):
+            worlds = sorted(kripke.W)
+            change = rng.randrange(4)
+            if change == 0:
+                kripke.add_worlds(['n%d' % step])
+            elif change == 1:
+                kripke.add_vals(rng.choice('pqr'), [rng.choice(worlds)])
+            else:
+                kripke.add_trans((rng.choice(worlds), rng.choice(worlds)))
+            if step % 3 == 0:
+                checker.extension(formulas[0])   # applies the changes without reporting them
+            if step % 2 == 0:
+                continue
+            changes = checker.update()
+            for formula in before:
+                after = set(formula.calc(kripke))
+                assert checker.extension(formula) == after, formula
+                expected = (after - before[formula], before[formula] - after)
+                assert changes.get(formula, (set(), set())) == expected, formula
+                before[formula] = after
+        checker.close()
+    print("incremental ok")
+
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Single entry point with a subcommand per tool. Only the module of the chosen
+# subcommand gets imported, so a short check doesn't pay for the others (or
+# for pyparsing, which only parser.py --pyparsing needs).
+#
+# Usage:
+#     ./modlog.py parse "p -> diamond q"
+#     ./modlog.py tree "p -> diamond q" | dot -Tpng > tree.png
+#     ./modlog.py eval examples/example1.kripke "p -> diamond q"
+#     ./modlog.py eval -h
+import sys
+
+# subcommand -> (module with a main(argv, prog), description)
+COMMANDS = {
+    'parse':    ('parser',    "parses expressions and shows how they're read"),
+    'tree':     ('tree',      "writes the parse tree of an expression in the .dot format"),
+    'eval':     ('evaluator', "checks an expression against a model"),
+    'check':    ('checkall',  "checks formulas against many models in parallel"),
+    'bisim':    ('bisim',     "prints the bisimulation quotient of a model"),
+    'server':   ('server',    "runs the model checking server"),
+    'client':   ('client',    "talks to the model checking server"),
+    'generate': ('generate',  "generates random models or formulas"),
+    'bench':    ('bench',     "runs the benchmarks, including the start up time of the commands"),
+}
+
+
+def usage():
+    lines = ["usage: modlog.py COMMAND [arguments], COMMAND -h shows the arguments of a command", ""]
+    for command in sorted(COMMANDS):
+        lines.append("  %-9s %s" % (command, COMMANDS[command][1]))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return
+    if argv[0] not in COMMANDS:
+        sys.exit("unknown command %s\n\n%s" % (argv[0], usage()))
+    module = __import__(COMMANDS[argv[0]][0])
+    module.main(argv[1:], "modlog.py " + argv[0])
+
+
+if __name__ == '__main__':
+    main()
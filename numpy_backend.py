@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Optional NumPy backend: a Kripke model frozen into CSR arrays and boolean
+# valuation vectors, so the modal operators become segment reductions over
+# the accessibility relation instead of interpreted loops over every world.
+#
+# Usage:
+#     frozen = FrozenKripke(kripke)
+#     worlds = frozen.worlds(expression.evaluate(frozen))
+import numpy as np
+
+
+class FrozenKripke:
+    """
+    Immutable, vectorised snapshot of a Kripke model. It implements the same
+    world set algebra as bitset.WorldIndex (see LogicExpression.combine), a
+    world set is a boolean vector indexed like kripke.bitset().names.
+
+    The relation is stored as CSR arrays: the successors of world i are
+    indices[indptr[i]:indptr[i+1]]. Only the worlds of W have rows.
+
+    box and diamond are single vectorised reductions, they take no progress
+    callback (see bitset.reporting), so a budget.BudgetContext can only stop
+    an evaluation between two operators, not inside one.
+    """
+    def __init__(self, kripke):
+        index = kripke.bitset()
+        rows  = index.names[:index.count(index.all)]
+
+        self.kripke = kripke
+        self.names  = index.names
+        self.index  = index.index
+        self.size   = len(self.names)
+
+        counts = np.fromiter((len(kripke.R.get(w, ())) for w in rows), dtype=np.int64, count=len(rows))
+        self.indptr  = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.indptr[1:])
+        self.indices = np.fromiter((index.index[v] for w in rows for v in kripke.R.get(w, ())),
+                                   dtype=np.int64, count=int(self.indptr[-1]))
+
+        self.all = np.zeros(self.size, dtype=bool)
+        self.all[:len(rows)] = True
+
+        # reduceat can't deal with empty segments, so only reduce the others
+        self._nonempty = counts > 0
+        self._starts   = self.indptr[:-1][self._nonempty]
+        self._vals     = {}
+
+    def from_worlds(self, ws):
+        "Converts a collection of worlds into a boolean vector"
+        out = np.zeros(self.size, dtype=bool)
+        out[[self.index[w] for w in ws]] = True
+        return out
+
+    def worlds(self, x):
+        "Converts a boolean vector back into a list of world names (in index order)"
+        return [self.names[i] for i in np.flatnonzero(x)]
+
+    def sample(self, x, k):
+        "Lists at most k worlds of a boolean vector (all of them if k is None), in index order"
+        return [self.names[i] for i in np.flatnonzero(x)[:k]]
+
+    def count(self, x):
+        "The amount of worlds in a boolean vector"
+        return int(np.count_nonzero(x))
+
+    def _reduce(self, ufunc, x, empty):
+        "reduces x over the successors of every world, empty is used for blind worlds"
+        out  = np.zeros(self.size, dtype=bool)
+        rows = out[:len(self.indptr) - 1]
+        rows[:] = empty
+        if len(self._starts):
+            rows[self._nonempty] = ufunc.reduceat(x[self.indices], self._starts)
+        return out
+
+    # the algebra used by LogicExpression.combine
+    def top(self):
+        return self.all
+
+    def bottom(self):
+        return np.zeros(self.size, dtype=bool)
+
+    def var(self, name):
+        x = self._vals.get(name)
+        if x is None:
+            x = self._vals[name] = self.from_worlds(self.kripke.V.get(name, ()))
+        return x
+
+    def neg(self, x):
+        return self.all & ~x
+
+    def conj(self, x, y):
+        return x & y
+
+    def disj(self, x, y):
+        return x | y
+
+    def implies(self, x, y):
+        return (self.all & ~x) | (x & y)
+
+    def box(self, x):
+        # blind worlds have no successors, so any box holds there
+        return self._reduce(np.logical_and, x, True)
+
+    def diamond(self, x):
+        return self._reduce(np.logical_or, x, False)
@@ -2,8 +2,16 @@
 # -*- coding: utf-8 -*-
 #
 # Parser that deals with the most ridiculous expressions
-from pyparsing import *
-from data import create_var_const, create_expression, And, Or, Implies, prefix_operators
+#
+# parse uses a hand written single pass tokenizer and operator precedence
+# parser, parse_pyparsing is the original pyparsing grammar, kept around as
+# the reference implementation (see parser.py --benchmark, and --self-test,
+# which checks that both agree on generated formulas). pyparsing is only
+# imported when that grammar is first used, it takes longer to import than
+# everything else together.
+import re
+from data import create_var_const, create_expression, And, Or, Implies, Constant, \
+    infix_classes, prefix_classes, binder_classes, prefix_operators, binder_operators, operator_class
 
 __bnf = None
 
@@ -11,6 +19,7 @@ def _bnf():
     global __bnf
     if __bnf:
         return __bnf
+    from pyparsing import Forward, Suppress, Word, ZeroOrMore, alphas, oneOf
     # varconst    := Word of letters numbers and underscores
     # atom        := varconst | '(' expression ')'
     # prefix_expr := [ prefix ]* atom
@@ -47,14 +56,186 @@ def parse_infix_op(toks):
         left = create_expression(op, left, right)
     return left
 
-def parse(string):
+def parse_pyparsing(string):
+    "parses string with the (slow) pyparsing grammar, returns an expression"
     return _bnf().parseString(string)[0]
 
-if __name__ == '__main__':
+
+class ParseError(ValueError):
+    "Raised by parse when a string is not a valid expression"
+    def __init__(self, msg, string, pos):
+        ValueError.__init__(self, "%s at position %d of '%s'" % (msg, pos, string))
+        self.string, self.pos = string, pos
+
+
+# Binding power of the infix operators, higher binds tighter. Prefix operators
+# bind tighter than any of them and all infix operators are left associative:
+# expression := or_expr [impl or_expr]*, or_expr := and_expr [or and_expr]*, ...
+_precedence = {And: 3, Or: 2, Implies: 1}
+_prefix     = 4
+_binder     = 0   # μX. and νX. reach as far to the right as possible
+
+# Word symbols (e.g. 'and', 'box') are matched case insensitively and only as
+# whole words, where the parser expects an operand a word is a prefix operator
+# or a variable, where it expects an operator it has to be an infix operator.
+# Other symbols (e.g. '&', '☐', 'μ') are matched as they are.
+_is_word = re.compile(r'[A-Za-z_]+\Z').match
+
+_infix_words  = dict((s.lower(), s) for c in infix_classes for s in c.symbols if _is_word(s))
+_prefix_words = dict((s.lower(), s) for c in prefix_classes for s in c.symbols if _is_word(s))
+_binder_words = dict((s.lower(), s) for c in binder_classes for s in c.symbols if _is_word(s))
+
+_symbols   = [s for c in infix_classes + prefix_classes + binder_classes for s in c.symbols if not _is_word(s)]
+_constants = [s for s in Constant.true_symbols + Constant.false_symbols if not s.isalpha()]
+_tokens    = re.compile(r'(?P<word>[A-Za-z_]+)|(?P<symbol>%s)|(?P<paren>[()])|(?P<dot>\.)|(?P<end>\Z)' %
+                        "|".join(re.escape(s) for s in sorted(_symbols + _constants, key=len, reverse=True)))
+_spaces    = re.compile(r'\s*')
+
+
+def tokenize(string):
+    """
+    Generates (kind, text, position) tokens of string, kind is one of
+    'word', 'symbol', 'paren', 'dot' or 'end' (the last token)
+    """
+    pos = 0
+    while True:
+        pos   = _spaces.match(string, pos).end()
+        match = _tokens.match(string, pos)
+        if match is None:
+            raise ParseError("Unexpected character", string, pos)
+        kind = match.lastgroup
+        yield kind, match.group(kind), pos
+        if kind == 'end':
+            return
+        pos = match.end()
+
+
+def parse(string):
+    """
+    Parses string into an expression, feeding create_expression directly.
+
+    A shunting yard style operator precedence parser, it uses explicit stacks
+    so deeply nested expressions don't touch the recursion limit
+    """
+    operands  = []     # parsed sub expressions
+    operators = []     # pending (symbol, binding power), (symbol, _binder, variable,
+                       # position) and '(' markers
+
+    def reduce_while(power):
+        "applies pending operators that bind at least as tight as power"
+        while operators and operators[-1] != '(' and operators[-1][1] >= power:
+            operator = operators.pop()
+            symbol, bound = operator[:2]
+            if bound == _binder:
+                name, pos = operator[2:]
+                try:
+                    operands.append(create_expression(symbol, name, operands.pop()))
+                except ValueError as e:
+                    raise ParseError(str(e), string, pos)
+            elif bound == _prefix:
+                operands.append(create_expression(symbol, operands.pop()))
+            else:
+                right = operands.pop()
+                operands.append(create_expression(symbol, operands.pop(), right))
+
+    expect_operand = True
+    tokens = tokenize(string)
+    for kind, text, pos in tokens:
+        if expect_operand:
+            if (kind == 'word' and text.lower() in _binder_words) or text in binder_operators:
+                # a binder is followed by the name of its variable and a '.'
+                symbol = _binder_words.get(text.lower(), text)
+                name, dot = next(tokens), next(tokens, ('end', '', len(string)))
+                if name[0] != 'word' or dot[0] != 'dot':
+                    raise ParseError("Expected a variable and '.' after %s" % text, string,
+                                     dot[2] if name[0] == 'word' else name[2])
+                operators.append((symbol, _binder, name[1], pos))
+            elif kind == 'word' and text.lower() in _prefix_words:
+                operators.append((_prefix_words[text.lower()], _prefix))
+            elif kind == 'word':
+                operands.append(create_var_const(text))
+                expect_operand = False
+            elif kind == 'symbol' and text in prefix_operators:
+                operators.append((text, _prefix))
+            elif kind == 'symbol' and text in _constants:
+                operands.append(create_var_const('true' if text in Constant.true_symbols else 'false'))
+                expect_operand = False
+            elif text == '(':
+                operators.append('(')
+            else:
+                raise ParseError("Expected an operand", string, pos)
+        else:
+            if kind == 'word' and text.lower() in _infix_words:
+                text, kind = _infix_words[text.lower()], 'symbol'
+            if kind == 'symbol' and text not in prefix_operators and text not in _constants:
+                power = _precedence[operator_class[text]]
+                reduce_while(power)
+                operators.append((text, power))
+                expect_operand = True
+            elif text == ')':
+                reduce_while(0)
+                if not operators:
+                    raise ParseError("Unbalanced ')'", string, pos)
+                operators.pop()
+            elif kind == 'end':
+                reduce_while(0)
+                if operators:
+                    raise ParseError("Missing ')'", string, pos)
+                return operands.pop()
+            else:
+                raise ParseError("Expected an operator", string, pos)
+    raise ParseError("Unexpected end", string, len(string))
+
+def benchmark(strings, repeat=1000):
+    """
+    Times parse and parse_pyparsing on strings, returns a dict with the
+    formulas/second of both parsers and whether they agree on every string
+    """
+    from timeit import default_timer as timer
+    result = {'agree': all(parse(s) is parse_pyparsing(s) for s in strings)}
+    for name, parser in (('parse', parse), ('parse_pyparsing', parse_pyparsing)):
+        start = timer()
+        for _ in range(repeat):
+            for s in strings:
+                parser(s)
+        result[name] = repeat * len(strings) / (timer() - start)
+    return result
+
+
+def self_test():
+    "Checks that parse agrees with parse_pyparsing, and with str, on known and generated formulas"
+    from generate import random_formulas
+
+    # the pyparsing grammar has no binders and only spells constants as words
+    strings = ["P \\/ Q /\\ ~R -> S", "((a or c) or d)", "b * (((a))) + d * shit * crazy",
+               "throw_money_in_machine implies candy_rolls_out", "(a implies a) implies (a or ¬ b ^ c)",
+               "! ~ not ~ ! True", "◇d \\/ not ◇◇t", "a -> b -> c", "p & q | r -> s", "p v q & r",
+               "Box p & diamond q", "☐(p)", "~ Box ~ ◇ false"]
+    formulas = random_formulas(300, 6, 3, 0.4, sharing=0.3, seed=2)
+    strings += [str(f).replace('⊤', 'True').replace('⊥', 'False') for f in formulas]
+    for string in strings:
+        assert parse(string) is parse_pyparsing(string), string
+    for formula in formulas:
+        assert parse(str(formula)) is formula, str(formula)
+
+    for string in ("mu X. p or diamond X", "nu Y. mu X. (p and diamond Y) or diamond X", "μX.νY.X ∧ ☐Y"):
+        assert parse(str(parse(string))) is parse(string), string
+    for string in ("", "(", "p q", "p &", ")", "p)", "(p", "mu . p", "mu X p", "& p"):
+        try:
+            parse(string)
+        except ParseError:
+            continue
+        raise AssertionError("parsed %r" % string)
+    print("parser ok: %d formulas agree with pyparsing" % len(strings))
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
     from argparse import ArgumentParser, RawTextHelpFormatter
-    from parser   import parse
+    from parser   import parse, parse_pyparsing, benchmark
+    import sys
 
-    parser = ArgumentParser(description="a kripke expression parser",
+    parser = ArgumentParser(prog=prog, description="a kripke expression parser",
         formatter_class=RawTextHelpFormatter, epilog="""
     Expression examples:
 
@@ -65,17 +246,40 @@ if __name__ == '__main__':
     (a implies a) implies (a or ¬ b ^ c)
     ! ~ not ~ ! True
     ◇d \/ not ◇◇t
+    mu X. p or diamond X
+    nu Y. mu X. (p and diamond Y) or diamond X
     """)
 
-    parser.add_argument("expressions", metavar='expression', nargs='+', help="a logic expression")
-    args = parser.parse_args()
+    parser.add_argument("expressions", metavar='expression', nargs='*', help="a logic expression")
+    parser.add_argument("-p", "--pyparsing", action='store_true', help="use the (reference) pyparsing parser")
+    parser.add_argument("-b", "--benchmark", type=int, metavar='N', default=0,
+        help="parse the expressions N times with both parsers and report formulas/second")
+    parser.add_argument("--self-test", action='store_true',
+        help="checks that both parsers agree on known and generated formulas")
+    args = parser.parse_args(argv)
+    if args.self_test:
+        self_test()
+        return
+    if not args.expressions:
+        parser.error("expected an expression")
+
+    if args.benchmark:
+        result = benchmark(args.expressions, args.benchmark)
+        print("parse           : %10.0f formulas/second" % result['parse'])
+        print("parse_pyparsing : %10.0f formulas/second" % result['parse_pyparsing'])
+        print("parsers agree   : %s" % result['agree'])
+        sys.exit(0 if result['agree'] else 1)
 
     for expr_in in args.expressions:
         try:
             print("Input                  : '%s'" % expr_in)
-            expr_out = parse(expr_in)
+            expr_out = parse_pyparsing(expr_in) if args.pyparsing else parse(expr_in)
             print("Internal representation: %s" % repr(expr_out))
             print("Human    representation: %s" %  str(expr_out))
             print("")
         except Exception:
             print("Input could not be parsed")
+
+
+if __name__ == '__main__':
+    main()
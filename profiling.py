@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Opt-in instrumentation of evaluation.
+#
+# A Profiler records, for every distinct expression node it evaluates, the
+# time spent in its combine (its own operator, the children are timed
+# separately), how often it was computed, how often a memoised value was used
+# instead (cache hits) and the amount of worlds going in and coming out. Next
+# to that it times phases such as parsing and model loading.
+#
+# Nothing is instrumented unless a Profiler is passed in: EvalContext only
+# checks once per evaluate whether it has one. Fixpoints are timed as a
+# whole, the iterations inside are not broken down.
+#
+# Usage:
+#     profiler = Profiler()
+#     with profiler.phase('load'):
+#         kripke = parse_kripke_file("examples/example1.kripke")
+#     context = EvalContext(kripke, profiler=profiler)
+#     context.calc(parse("p -> diamond q"))
+#     print(profiler.report())
+from collections import OrderedDict
+from contextlib  import contextmanager
+from timeit      import default_timer as timer
+
+from data    import WorldSets, postorder
+from tracing import operator_label
+
+
+class NodeStats:
+    "What a Profiler recorded for one expression node"
+    __slots__ = ('seconds', 'calls', 'hits', 'inputs', 'output')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls   = 0
+        self.hits    = 0
+        self.inputs  = []     # the amount of worlds of every argument, last call
+        self.output  = 0      # the amount of worlds of the result, last call
+
+
+class Profiler:
+    """
+    Collects per node statistics (see NodeStats) of the expressions it
+    evaluates and the time spent in named phases.
+    """
+    def __init__(self):
+        self.nodes      = OrderedDict()   # expression -> NodeStats, in evaluation order
+        self.phases     = OrderedDict()   # name -> seconds
+        self.references = 0               # nodes asked for, computed or answered by the memo
+        self.computed   = 0
+
+    @contextmanager
+    def phase(self, name):
+        "times the with block as phase name (times of a recurring phase add up)"
+        start = timer()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + timer() - start
+
+    def _stats(self, node):
+        stats = self.nodes.get(node)
+        if stats is None:
+            stats = self.nodes[node] = NodeStats()
+        return stats
+
+    def evaluate(self, expression, algebra, memo=None):
+        """
+        Evaluates expression in a world set algebra like data.evaluate, sub
+        expressions in memo count as cache hits, memo gets filled in
+        """
+        memo = {} if memo is None else memo
+        self.references += 1
+        if expression in memo:
+            self._stats(expression).hits += 1
+            return memo[expression]
+        fresh = set()   # computed by this call and not referenced yet
+        for node in postorder(expression, memo, operands=True):
+            children = list(node.operands())
+            self.references += len(children)
+            self.computed   += 1
+            for child in children:
+                if child in fresh:
+                    fresh.discard(child)
+                else:
+                    self._stats(child).hits += 1
+            args  = [memo[child] for child in children]
+            start = timer()
+            value = node.combine(algebra, *args)
+            elapsed = timer() - start
+
+            stats = self._stats(node)
+            stats.seconds += elapsed
+            stats.calls   += 1
+            stats.inputs   = [algebra.count(arg) for arg in args]
+            stats.output   = algebra.count(value)
+            memo[node] = value
+            fresh.add(node)
+        return memo[expression]
+
+    def calc(self, expression, kripke):
+        "returns the set of worlds in which expression holds, like LogicExpression.calc"
+        return self.evaluate(expression, WorldSets(kripke))
+
+    def hot(self, limit=None):
+        "the (node, NodeStats) pairs sorted by time, the slowest first"
+        ranked = sorted(self.nodes.items(), key=lambda item: item[1].seconds, reverse=True)
+        return ranked[:limit] if limit is not None else ranked
+
+    def report(self, limit=20):
+        "a readable report of the phases and the limit slowest nodes"
+        total = sum(stats.seconds for stats in self.nodes.values())
+        lines = []
+        for name, seconds in self.phases.items():
+            lines.append("%-12s %9.4fs" % (name, seconds))
+        if lines:
+            lines.append("")
+        lines.append("%9s %6s %6s %6s  %-17s %s" % ("seconds", "share", "calls", "hits", "worlds in -> out", "node"))
+        for node, stats in self.hot(limit):
+            text = str(node)
+            lines.append("%8.4fs %5.1f%% %6d %6d  %-17s %s" % (
+                stats.seconds, 100.0 * stats.seconds / max(total, 1e-9), stats.calls, stats.hits,
+                "%s -> %d" % (",".join(str(n) for n in stats.inputs) or "-", stats.output),
+                text if len(text) <= 60 else text[:57] + "..."))
+        if limit is not None and len(self.nodes) > limit:
+            lines.append("(%d more nodes)" % (len(self.nodes) - limit))
+        return "\n".join(lines)
+
+    def to_json(self):
+        "the recorded statistics as a json compatible dict"
+        ids = dict((node, i) for i, node in enumerate(self.nodes))
+        return {
+            'phases': dict(self.phases),
+            'nodes': [{
+                'id':         ids[node],
+                'operator':   operator_label(node),
+                'children':   [ids[child] for child in node.children() if child in ids],
+                'seconds':    stats.seconds,
+                'calls':      stats.calls,
+                'hits':       stats.hits,
+                'inputs':     stats.inputs,
+                'output':     stats.output,
+            } for node, stats in self.nodes.items()],
+        }
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# A long running model checking server, so many small queries don't each pay
+# for starting Python, importing the parser and loading the model.
+#
+# Models are loaded once under a name and stay resident. Parsed (and
+# simplified) formulas are kept in an LRU cache, and so are the results per
+# model, while every model keeps the extensions of the sub expressions it has
+# seen in its EvalContext (the least recently used are dropped past a limit)
+# and their simplified forms (dropped all at once past that limit).
+#
+# The protocol is one json object per line each way, over a Unix socket or a
+# localhost TCP port. Every request has an "op", the response has "ok" and
+# echoes the "id" of the request if it had one:
+#
+#   {"op": "load", "name": "m", "file": "examples/example1.kripke"}
+#   {"op": "unload", "name": "m"}
+#   {"op": "models"}
+#   {"op": "entails", "model": "m", "formula": "p -> diamond q"}
+#   {"op": "extension", "model": "m", "formula": "p", "limit": 100}
+#   {"op": "stats"}
+#   {"op": "shutdown"}
+#
+# Connections are served by an asyncio loop, the parsing and evaluating is
+# done in a thread pool so slow queries don't hold up the others. A model is
+# evaluated by one thread at a time (its EvalContext isn't thread safe), so
+# queries on one model run one after another, queries on different models
+# run side by side.
+#
+# Usage:
+#     ./server.py --socket /tmp/modlog.sock &
+#     ./client.py --socket /tmp/modlog.sock load m examples/example1.kripke
+#     ./client.py --socket /tmp/modlog.sock entails m "p -> diamond q"
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from collections        import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from context   import EvalContext
+from data      import create_var_const
+from evaluator import load_model
+from parser    import parse
+from simplify  import Simplifier, closed_model
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'modlog.sock')
+
+
+class LRUCache:
+    "A dict of at most capacity items that forgets the least recently used"
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits     = 0
+        self.misses   = 0
+        self._items   = OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._items:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return self._items[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class _Model:
+    "A resident model with its EvalContext, simplifier and result cache"
+    def __init__(self, filename, results, max_nodes):
+        self.filename   = filename
+        self.model      = load_model(filename)
+        self.context    = EvalContext(self.model, capacity=max_nodes)
+        self.simplifier = Simplifier(closed_model(self.model))
+        self.results    = LRUCache(results)   # formula -> (entails, holds_in, worlds)
+        self.max_nodes  = max_nodes
+        self.lock       = threading.Lock()    # the context and the results
+        self._simplifying = threading.Lock()  # the simplifier
+
+    def simplify(self, expression):
+        "the expression simplified for the model"
+        with self._simplifying:
+            if len(self.simplifier) > self.max_nodes:
+                self.simplifier.clear()
+            return self.simplifier.simplify(expression)
+
+    def check(self, key, expression, limit):
+        """
+        returns (entails, holds_in, the first limit worlds) of an expression,
+        simplified already, the result is cached under key. Holds the lock of
+        the model while it evaluates, so the queries on a model are answered
+        one at a time.
+        """
+        with self.lock:
+            result = self.results.get(key)
+            if result is None:
+                result = (self.context.entails(expression), self.context.count(expression),
+                          self.context.sample(expression, limit) if limit else [])
+                self.results.put(key, result)
+            return result
+
+    def close(self):
+        "releases the model (the mapping of a .kbin file), after the query in progress"
+        with self.lock:
+            if hasattr(self.model, 'close'):
+                self.model.close()
+
+
+class ModelServer:
+    """
+    The state of the server: the resident models and the formula cache.
+    handle answers one request (a dict), it's safe to call from many threads.
+
+    formulas  : the size of the LRU cache of parsed formulas
+    results   : the size of the LRU cache of results, per model
+    max_nodes : the most sub expression extensions a model keeps, the least
+                recently used are dropped, and the most simplified sub
+                expressions it keeps before it drops them all
+    """
+    def __init__(self, formulas=65536, results=65536, max_nodes=1 << 20):
+        self.formulas   = LRUCache(formulas)
+        self.results    = results
+        self.max_nodes  = max_nodes
+        self.models     = {}
+        self.queries    = 0
+        self._lock      = threading.Lock()   # the models dict and the formula cache
+
+    def _parse(self, formula, model):
+        "the parsed and simplified formula, only the formula cache is used under the lock"
+        with self._lock:
+            expression = self.formulas.get(formula)
+        if expression is None:
+            # two threads may parse the same formula, interning gives both the same expression
+            expression = parse(formula)
+            with self._lock:
+                self.formulas.put(formula, expression)
+        return model.simplify(expression)
+
+    def _model(self, request):
+        with self._lock:
+            name = request.get('model')
+            if name not in self.models:
+                raise KeyError("no model named %s" % name)
+            return self.models[name]
+
+    def handle(self, request):
+        "answers a request, see the protocol above"
+        op = request.get('op')
+        with self._lock:
+            self.queries += 1
+        if op in ('entails', 'extension'):
+            model   = self._model(request)
+            formula = request['formula']
+            limit   = request.get('limit', 1000) if op == 'extension' else 0
+            result  = model.check((formula, limit), self._parse(formula, model), limit)
+            response = {'entails': result[0], 'holds_in': result[1]}
+            if op == 'extension':
+                response['worlds'] = result[2]
+            return response
+        if op == 'load':
+            # loading interns expressions too (InternTable is thread safe), the
+            # model is only shared once it's in the models dict
+            model  = _Model(request['file'], self.results, self.max_nodes)
+            worlds = model.context.count(create_var_const('true'))
+            with self._lock:
+                previous = self.models.get(request['name'])
+                self.models[request['name']] = model
+            if previous is not None:
+                previous.close()
+            return {'name': request['name'], 'worlds': worlds}
+        if op == 'unload':
+            with self._lock:
+                model = self.models.pop(request['name'])
+            model.close()
+            return {}
+        if op == 'models':
+            with self._lock:
+                return {'models': dict((name, model.filename) for name, model in self.models.items())}
+        if op == 'stats':
+            with self._lock:
+                models = dict((name, {'extensions': len(model.context), 'results': len(model.results),
+                                      'result_hits': model.results.hits}) for name, model in self.models.items())
+            return {'queries': self.queries, 'formulas': len(self.formulas),
+                    'formula_hits': self.formulas.hits, 'models': models}
+        raise ValueError("unknown op %s" % op)
+
+    def respond(self, line):
+        "answers one request line with a response line"
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a json object")
+        except ValueError as e:
+            return json.dumps({'ok': False, 'error': "bad request: %s" % e}) + "\n"
+        try:
+            response = self.handle(request)
+            response['ok'] = True
+        except Exception as e:
+            # anything a request can make go wrong (a file that isn't a
+            # model, a formula that isn't a string) is answered, the
+            # connection stays up
+            response = {'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}
+        if 'id' in request:
+            response['id'] = request['id']
+        return json.dumps(response, ensure_ascii=False) + "\n"
+
+
+def _error_line(e):
+    "the response line to a request that failed outside of respond"
+    return json.dumps({'ok': False, 'error': "%s: %s" % (type(e).__name__, e)}, ensure_ascii=False) + "\n"
+
+
+async def _serve_connection(server, executor, stop, reader, writer):
+    "answers the requests of one connection in order"
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                shutdown = json.loads(line).get('op') == 'shutdown'
+            except (ValueError, AttributeError):
+                shutdown = False
+            if shutdown:
+                writer.write(b'{"ok": true}\n')
+                await writer.drain()
+                stop.set()
+                break
+            try:
+                response = await loop.run_in_executor(executor, server.respond, line)
+            except Exception as e:   # e.g. the executor is shut down already
+                response = _error_line(e)
+            writer.write(response.encode('utf-8'))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    except Exception as e:
+        # e.g. a line longer than the reader's limit, the connection can't
+        # go on but the client hears why
+        try:
+            writer.write(_error_line(e).encode('utf-8'))
+            await writer.drain()
+        except ConnectionError:
+            pass
+    finally:
+        writer.close()
+
+
+async def serve(server, socket=None, port=None, workers=4):
+    "runs the server until a shutdown request, on a Unix socket or a localhost port"
+    executor = ThreadPoolExecutor(workers)
+    stop     = asyncio.Event()
+    handler  = lambda reader, writer: _serve_connection(server, executor, stop, reader, writer)
+    if port is not None:
+        listener = await asyncio.start_server(handler, '127.0.0.1', port, limit=1 << 24)
+    else:
+        if os.path.exists(socket):
+            os.remove(socket)
+        listener = await asyncio.start_unix_server(handler, socket, limit=1 << 24)
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        executor.shutdown(wait=False)
+        if port is None and os.path.exists(socket):
+            os.remove(socket)
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(prog=prog, description="model checking server, see client.py")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="the Unix socket to listen on (default: %(default)s)")
+    parser.add_argument("--port", type=int, help="listens on this localhost port instead of a Unix socket")
+    parser.add_argument("-j", "--workers", type=int, default=4, help="threads evaluating queries (default: 4)")
+    parser.add_argument("--formula-cache", type=int, default=65536, help="parsed formulas kept (default: 65536)")
+    parser.add_argument("--result-cache", type=int, default=65536, help="results kept per model (default: 65536)")
+    parser.add_argument("-l", "--load", nargs=2, action='append', default=[], metavar=('NAME', 'FILE'),
+        help="loads a model at startup (may be repeated)")
+    args = parser.parse_args(argv)
+
+    server = ModelServer(args.formula_cache, args.result_cache)
+    for name, filename in args.load:
+        server.handle({'op': 'load', 'name': name, 'file': filename})
+    try:
+        asyncio.run(serve(server, args.socket, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
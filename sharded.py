@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Intra-model parallel evaluation, the modal operators of one big model are
+# computed by a pool of processes that each own a shard of the worlds.
+#
+# The CSR relation of numpy_backend.FrozenKripke is copied into shared memory
+# once. For every Box/Diamond the main process writes the extension of the
+# sub expression into a shared vector, every worker reduces the successors of
+# its own rows into a shared output vector, and the main process picks the
+# combined result up from there. The propositional operators are cheap
+# vectorised operations and stay in the main process.
+#
+# Usage:
+#     with ShardedKripke(kripke, processes=8) as sharded:
+#         worlds = sharded.worlds(expression.evaluate(sharded))
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from numpy_backend import FrozenKripke
+
+_shared = {}   # the shared arrays of a worker, see _init_worker
+
+
+def _open(block):
+    """
+    attaches to an existing shared memory block without registering it with
+    the resource tracker, the process that created it owns (and unlinks) it
+    """
+    try:
+        return shared_memory.SharedMemory(name=block, track=False)
+    except TypeError:
+        # before Python 3.13 every attach registers the block, and the
+        # tracker unlinks what's registered when a process exits
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=block)
+        finally:
+            resource_tracker.register = register
+
+
+def _attach(spec):
+    "maps the shared arrays described by spec, returns {name: (array, block)}"
+    arrays = {}
+    for name, block, dtype, shape in spec:
+        shm = _open(block)
+        arrays[name] = (np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm)
+    return arrays
+
+
+def _init_worker(spec):
+    _shared.update(_attach(spec))
+
+
+def _modal_shard(task):
+    "reduces the successors of rows lo..hi of the shared relation, see FrozenKripke._reduce"
+    ufunc, empty, lo, hi = task
+    indptr, indices = _shared['indptr'][0], _shared['indices'][0]
+    x, out = _shared['x'][0], _shared['out'][0]
+
+    bounds   = indptr[lo:hi + 1]
+    nonempty = bounds[1:] > bounds[:-1]
+    rows     = out[lo:hi]
+    rows[:]  = empty
+    starts   = bounds[:-1][nonempty] - bounds[0]
+    if len(starts):
+        rows[nonempty] = getattr(np, ufunc).reduceat(x[indices[bounds[0]:bounds[-1]]], starts)
+
+
+class ShardedKripke(FrozenKripke):
+    """
+    A FrozenKripke whose modal operators run in parallel over shards of the
+    worlds. The shards are balanced by their amount of transitions.
+
+    processes : amount of worker processes (default: one per core)
+    shards    : amount of shards (default: 4 per process)
+
+    Holds a process pool and shared memory, so close it (or use it as a
+    context manager) when done.
+    """
+    def __init__(self, kripke, processes=None, shards=None):
+        FrozenKripke.__init__(self, kripke)
+        processes = self.processes = processes or multiprocessing.cpu_count()
+        shards    = shards or 4 * processes
+        rows      = len(self.indptr) - 1
+
+        self._blocks, spec = [], []
+        for name, array in (('indptr', self.indptr), ('indices', self.indices),
+                            ('x', np.zeros(self.size, dtype=bool)), ('out', np.zeros(rows, dtype=bool))):
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            self._blocks.append(shm)
+            spec.append((name, shm.name, array.dtype.str, array.shape))
+        self._arrays = _attach(spec)
+
+        # cut the rows where the running amount of transitions passes i/shards
+        edges  = self.indptr[-1]
+        cuts   = np.searchsorted(self.indptr, np.arange(1, shards) * edges / float(shards))
+        bounds = np.unique(np.concatenate(([0], np.clip(cuts, 0, rows), [rows])))
+        self.shards = [(int(lo), int(hi)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+        self._pool = multiprocessing.Pool(processes, _init_worker, (spec,))
+
+    def _reduce(self, ufunc, x, empty):
+        rows = len(self.indptr) - 1
+        self._arrays['x'][0][:] = x
+        self._pool.map(_modal_shard, [(ufunc.__name__, empty, lo, hi) for lo, hi in self.shards])
+        out = np.zeros(self.size, dtype=bool)
+        out[:rows] = self._arrays['out'][0]
+        return out
+
+    def close(self):
+        "Stops the workers and frees the shared memory"
+        self._pool.close()
+        self._pool.join()
+        self._arrays = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Simplification of expressions before they're evaluated.
+#
+# Every rule below is an identity of the world set algebra the expressions are
+# evaluated in (see data.WorldSets): ~x is W - x, x -> y is (W - x) | (x & y),
+# Box and Diamond only hold in worlds of W. A model may however mention worlds
+# outside W, in a valuation or as the target of a transition, so not every
+# rule holds in every model:
+#
+#   always     ~⊤ = ⊥, ~⊥ = ⊤, x & ⊥ = ⊥, x | ⊥ = x, x & x = x | x = x,
+#              x & (x | y) = x | (x & y) = x, x & (x & y) = x & y,
+#              x | (x | y) = x | y, x & ~x = ⊥, ⊥ -> y = x -> ⊤ = ⊤,
+#              x -> ⊥ = ~x, ◇⊥ = ⊥
+#   within W   (the extension of x is a subset of W, which is the case for
+#              everything but variables and &, |, -> over those)
+#              ~~x = x, x & ⊤ = x, x | ⊤ = ⊤, x | ~x = ⊤, ⊤ -> x = x,
+#              x -> x = ⊤
+#   closed     (every transition and valuation stays within W, see
+#              closed_model)
+#              all of the above for every x, ☐⊤ = ⊤, ~☐~x = ◇x, ~◇~x = ☐x
+#
+# μX.x = νX.x = x when X doesn't occur in x, bound variables are treated like
+# any other variable, so the rules apply inside fixpoints as well.
+#
+# Usage:
+#     simplifier = Simplifier(closed_model(kripke))
+#     expression = simplifier.simplify(parse("~~(p & p) | false"))   # p
+from data import Kripke, And, Or, Implies, Not, Box, Diamond, Fixpoint, create_var_const, fold, \
+    free_variables, instances
+
+
+def closed_model(model):
+    "Checks whether every transition and valuation of a model stays within its worlds W"
+    if isinstance(model, Kripke):
+        return (all(model.W.issuperset(ws) for ws in model.V.values()) and
+                all(model.W.issuperset(ws) for ws in model.R.values()))
+    if hasattr(model, 'closed'):
+        return model.closed()
+    index = model.bitset()
+    return index.size == index.count(index.all)
+
+
+class Simplifier:
+    """
+    Rewrites expressions into an equivalent, usually smaller form. Every
+    distinct sub expression is rewritten once and remembered, so a
+    simplifier shared between many formulas rewrites the shared parts once.
+
+    closed : whether the expressions are meant for closed models only
+             (see closed_model), which allows more rules
+    """
+    def __init__(self, closed=False):
+        self.closed  = closed
+        self._memo   = {}   # expression -> simplified expression
+        self._inside = {}   # simplified expression -> its extension is within W
+        self._free   = {}   # simplified expression -> its free variables
+
+    def __len__(self):
+        return len(self._memo)
+
+    def clear(self):
+        "forgets the expressions rewritten so far"
+        self._memo.clear()
+        self._inside.clear()
+        self._free.clear()
+
+    def simplify(self, expression):
+        "returns the simplified form of expression"
+        return fold(expression, lambda node, *args: self._rewrite(type(node), args, node), self._memo)
+
+    def _within(self, node):
+        "whether the extension of a simplified node is a subset of W"
+        inside = self._inside.get(node)
+        if inside is None:
+            if self.closed:
+                inside = True
+            elif node.class_name == 'var':
+                inside = False
+            elif isinstance(node, (And, Implies)):
+                inside = any(self._within(child) for child in node.children())
+            elif isinstance(node, Or):
+                inside = all(self._within(child) for child in node.children())
+            elif isinstance(node, Fixpoint):
+                inside = False
+            else:
+                inside = True
+            self._inside[node] = inside
+        return inside
+
+    def _make(self, constructor, *args):
+        "creates (and simplifies) the node constructor(*args) over simplified args"
+        return self._rewrite(constructor, args)
+
+    def _rewrite(self, constructor, args, node=None):
+        """
+        returns the simplified form of constructor(*args) where args are
+        already simplified, node is the original expression if there is one
+        """
+        true, false = create_var_const('true'), create_var_const('false')
+
+        if constructor is Not:
+            (a,) = args
+            if a is true or a is false:
+                return false if a is true else true
+            if isinstance(a, Not) and self._within(a._expr):
+                return a._expr
+            if self.closed and isinstance(a, Box) and isinstance(a._expr, Not):
+                return self._make(Diamond, a._expr._expr)
+            if self.closed and isinstance(a, Diamond) and isinstance(a._expr, Not):
+                return self._make(Box, a._expr._expr)
+
+        elif constructor is And:
+            a, b = args
+            if a is false or b is false or _complements(a, b):
+                return false
+            if a is b or (b is true and self._within(a)) or _absorbs(a, b, Or):
+                return a
+            if (a is true and self._within(b)) or _absorbs(b, a, Or):
+                return b
+            if _absorbs(a, b, And):
+                return b
+            if _absorbs(b, a, And):
+                return a
+
+        elif constructor is Or:
+            a, b = args
+            if ((a is true and self._within(b)) or (b is true and self._within(a)) or
+                    (_complements(a, b) and self._within(a) and self._within(b))):
+                return true
+            if a is b or b is false or _absorbs(a, b, And):
+                return a
+            if a is false or _absorbs(b, a, And):
+                return b
+            if _absorbs(a, b, Or):
+                return b
+            if _absorbs(b, a, Or):
+                return a
+
+        elif constructor is Implies:
+            a, b = args
+            if a is false or b is true or (a is b and self._within(a)):
+                return true
+            if a is true and self._within(b):
+                return b
+            if b is false:
+                return self._make(Not, a)
+
+        elif constructor is Box:
+            (a,) = args
+            if self.closed and a is true:
+                return true
+
+        elif constructor is Diamond:
+            (a,) = args
+            if a is false:
+                return false
+
+        elif issubclass(constructor, Fixpoint):
+            (a,) = args
+            if node.name not in free_variables(a, self._free):
+                return a
+
+        if node is not None and all(x is y for x, y in zip(args, node.children())):
+            return node   # nothing changed (this includes variables and constants)
+        if node is not None and isinstance(node, Fixpoint):
+            args = (node.name,) + args
+        return instances.intern((constructor, args), lambda: constructor(*args))
+
+
+def _complements(a, b):
+    "whether one of a and b is the negation of the other"
+    return (isinstance(a, Not) and a._expr is b) or (isinstance(b, Not) and b._expr is a)
+
+
+def _absorbs(a, b, constructor):
+    "whether b is a constructor node (And or Or) that has a as a direct sub expression"
+    return isinstance(b, constructor) and (b._left is a or b._right is a)
+
+
+def simplify(expression, closed=False):
+    "Simplifies one expression, see Simplifier"
+    return Simplifier(closed).simplify(expression)
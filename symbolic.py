@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Symbolic Kripke models, for models far too big to enumerate.
+#
+# The worlds are the assignments to a set of state bits and are never listed:
+# W, R and every V(p) are boolean functions represented as BDDs (see bdd.py),
+# R over the bits of a world and the bits of its successor (next_a for bit a).
+# Evaluating an expression is a handful of BDD operations per node, Box and
+# Diamond are relational products with R.
+#
+# Models are declared in .skripke files:
+#
+#   # Comments are allowed
+#   STATE = { a, b, c };     the state bits, a world is named by its bits in
+#                            this order, e.g. '101' is a, ~b, c
+#   W = ~(a & b);            optional, by default every assignment is a world
+#   R = a' | (b -> c');      may occur more than once, R is their union
+#   V(p) = a & ~c;
+#
+# The constraints are propositional expressions as parsed by parser.parse, a'
+# (or next_a) is bit a of the successor.
+#
+# Variable order: the bit of a world and of its successor are always
+# neighbours, and bits that occur in the same constraints are placed close
+# together (interaction_order), which keeps the BDDs of R and V small.
+import re
+from itertools import islice
+
+from bdd import BDD
+
+NEXT = 'next_'
+
+
+def interaction_order(bits, groups):
+    """
+    Orders bits so that bits used together (in one of groups, sets of bits)
+    end up close together: it starts with the most used bit and then keeps
+    taking the bit with the most groups in common with the bits placed last.
+    Ties are broken by the order of bits.
+    """
+    weight = dict((bit, {}) for bit in bits)
+    for group in groups:
+        for a in group:
+            for b in group:
+                if a != b:
+                    weight[a][b] = weight[a].get(b, 0) + 1
+    order, left = [], list(bits)
+    while left:
+        # bits placed recently count more, so neighbourhoods stay together
+        score = lambda bit: sum(weight[bit].get(placed, 0) / (1.0 + i) for i, placed in enumerate(reversed(order)))
+        if not order:
+            score = lambda bit: sum(weight[bit].values())
+        best = max(left, key=lambda bit: (score(bit), -left.index(bit)))
+        order.append(best)
+        left.remove(best)
+    return order
+
+
+class SymbolicKripke:
+    """
+    A Kripke model over the assignments to state bits, with W, R and V as
+    bdd.Function objects.
+
+    It is its own world set algebra (see LogicExpression.combine), world sets
+    being functions over the state bits, so expression.evaluate(model),
+    EvalContext(model) and model.entails(...) work without ever listing the
+    worlds. Use to_kripke for a regular Kripke object of a small model.
+
+    bits  : the names of the state bits
+    order : the variable order of the BDDs (default: the order of bits)
+    """
+    def __init__(self, bits, order=None):
+        self.bits = list(bits)
+        for bit in self.bits:
+            if bit.startswith(NEXT):
+                raise ValueError("state bit %s can't start with %s" % (bit, NEXT))
+        self.bdd = BDD()
+        for bit in order or self.bits:
+            self.bdd.declare(bit)
+            self.bdd.declare(NEXT + bit)
+        self._to_next   = dict((bit, NEXT + bit) for bit in self.bits)
+        self._from_next = dict((NEXT + bit, bit) for bit in self.bits)
+        self._next_bits = [NEXT + bit for bit in self.bits]
+        self.W = self.bdd.true
+        self.R = self.bdd.false
+        self.V = {}
+        self.version = 0
+
+    def __str__(self):
+        return "%d state bits, %d worlds, R has %d nodes, %d variables" % (
+            len(self.bits), self.count(self.W), len(self.R), len(self.V))
+
+    def state(self, bit):
+        "bit of a world, as a function"
+        return self.bdd.var(bit)
+
+    def next(self, bit):
+        "bit of a successor, as a function"
+        return self.bdd.var(NEXT + bit)
+
+    def constraint(self, expression):
+        "Converts a propositional expression over the bits (and next_ bits) into a function"
+        return expression.evaluate(_Bits(self))
+
+    def restrict(self, f):
+        "Restricts the worlds W to those satisfying f"
+        self.W = self.W & f
+        self.version += 1
+        return self
+
+    def add_trans(self, f):
+        "Adds the transitions satisfying f (over the bits and next_ bits) to R"
+        self.R = self.R | f
+        self.version += 1
+        return self
+
+    def add_val(self, name, f):
+        "Makes variable name hold in the worlds satisfying f as well"
+        self.V[name] = self.V.get(name, self.bdd.false) | f
+        self.version += 1
+        return self
+
+    def variables(self):
+        "the variables with a valuation in the model"
+        return sorted(self.V)
+
+    def closed(self):
+        "Checks whether every transition (from W) and valuation stays within W"
+        outside = ~self.W
+        successors = (self.R & self.W).exists(self.bits).rename(self._from_next)
+        return (successors & outside).is_false and all((v & outside).is_false for v in self.V.values())
+
+    def bitset(self, progress=None):
+        return self
+
+    def entails(self, expression):
+        "Checks whether the model entails the expression"
+        return expression.evaluate(self) == self.W
+
+    def to_kripke(self):
+        "Lists the model as a regular Kripke object, only sensible for small models"
+        from data import Kripke
+        kripke = Kripke()
+        kripke.add_worlds(self.worlds(self.W))
+        for world in kripke.W:
+            successors = (self.R & self.from_worlds([world])).exists(self.bits).rename(self._from_next)
+            kripke.add_transes((world, v) for v in self.worlds(successors))
+        for name, f in self.V.items():
+            kripke.add_vals(name, self.worlds(f))
+        return kripke
+
+    # conversion between world names and functions
+    def from_worlds(self, ws):
+        "Converts a collection of worlds (bit strings) into a function"
+        f = self.bdd.false
+        for w in ws:
+            if len(w) != len(self.bits) or w.strip('01'):
+                raise ValueError("%s is not a world of %d bits" % (w, len(self.bits)))
+            minterm = self.bdd.true
+            for bit, value in zip(self.bits, w):
+                minterm = minterm & (self.state(bit) if value == '1' else ~self.state(bit))
+            f = f | minterm
+        return f
+
+    def worlds(self, x):
+        "Lists the worlds (bit strings) of a function, beware of big sets"
+        return list(self.sample(x, None))
+
+    def sample(self, x, k):
+        "Lists at most k worlds of a function (all of them if k is None)"
+        names = (''.join('1' if value else '0' for value in a) for a in x.assignments(self.bits))
+        return list(islice(names, k))
+
+    def count(self, x):
+        "The amount of worlds in a function"
+        return x.count(self.bits)
+
+    # the algebra used by LogicExpression.combine
+    def top(self):
+        return self.W
+
+    def bottom(self):
+        return self.bdd.false
+
+    def var(self, name):
+        return self.V.get(name, self.bdd.false)
+
+    def neg(self, x):
+        return self.W & ~x
+
+    def conj(self, x, y):
+        return x & y
+
+    def disj(self, x, y):
+        return x | y
+
+    def implies(self, x, y):
+        return (self.W & ~x) | (x & y)
+
+    def box(self, x):
+        # no successor outside of x
+        return self.W & ~self.R.and_exists((~x).rename(self._to_next), self._next_bits)
+
+    def diamond(self, x):
+        # some successor in x
+        return self.W & self.R.and_exists(x.rename(self._to_next), self._next_bits)
+
+
+class _Bits:
+    "The algebra of functions over the bits, for the constraints of SymbolicKripke.constraint"
+    def __init__(self, model):
+        self.model = model
+
+    def top(self):
+        return self.model.bdd.true
+
+    def bottom(self):
+        return self.model.bdd.false
+
+    def var(self, name):
+        if name in self.model._to_next or name in self.model._from_next:
+            return self.model.bdd.var(name)
+        raise ValueError("%s is not a state bit" % name)
+
+    def neg(self, x):
+        return ~x
+
+    def conj(self, x, y):
+        return x & y
+
+    def disj(self, x, y):
+        return x | y
+
+    def implies(self, x, y):
+        return ~x | y
+
+    def box(self, x):
+        raise ValueError("constraints are propositional, they can't use ☐")
+
+    def diamond(self, x):
+        raise ValueError("constraints are propositional, they can't use ◇")
+
+
+_statement = re.compile(r'\s*(?:(STATE)|(W)|(R)|V\s*\(\s*([A-Za-z_]+)\s*\))\s*=\s*(.*?)\s*\Z', re.S)
+_primed    = re.compile(r"([A-Za-z_]+)\s*'")
+
+
+def load_symbolic(stream):
+    "Reads a .skripke declaration (see above) from a stream, returns a SymbolicKripke"
+    from parser import parse, ParseError
+    from evaluator import KripkeFileError
+
+    text, line, statements = stream.read(), 1, []
+    for part in re.sub(r'#[^\n]*', '', text).split(';'):
+        start = line + part[:len(part) - len(part.lstrip())].count('\n')
+        line += part.count('\n')
+        if not part.strip():
+            continue
+        match = _statement.match(part)
+        if match is None:
+            raise KripkeFileError("expected STATE, W, R or V(name) = ...", start)
+        state, w, r, name, body = match.groups()
+        if state:
+            if not (body.startswith('{') and body.endswith('}')):
+                raise KripkeFileError("expected STATE = { bit, ... }", start)
+            bits = [b.strip() for b in body[1:-1].split(',') if b.strip()]
+            statements.append(('STATE', None, bits, start))
+            continue
+        try:
+            expression = parse(_primed.sub(NEXT + r'\1', body))
+        except ParseError as e:
+            raise KripkeFileError(str(e), start)
+        statements.append(('W' if w else 'R' if r else 'V', name, expression, start))
+
+    declared = [s for s in statements if s[0] == 'STATE']
+    if len(declared) != 1:
+        raise KripkeFileError("expected exactly one STATE declaration", declared[1][3] if declared else line)
+    bits   = declared[0][2]
+    groups = [set(v[len(NEXT):] if v.startswith(NEXT) else v for v in e.variables())
+              for kind, name, e, start in statements if kind != 'STATE']
+    model  = SymbolicKripke(bits, interaction_order(bits, groups))
+    for kind, name, expression, start in statements:
+        if kind == 'STATE':
+            continue
+        try:
+            f = model.constraint(expression)
+        except ValueError as e:
+            raise KripkeFileError(str(e), start)
+        if kind == 'W':
+            model.restrict(f)
+        elif kind == 'R':
+            model.add_trans(f)
+        else:
+            model.add_val(name, f)
+    return model
+
+
+def parse_symbolic_file(filename):
+    "Loads a .skripke file, see load_symbolic"
+    with open(filename) as stream:
+        return load_symbolic(stream)
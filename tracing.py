@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Structured evaluation traces.
+#
+# Rather than one big formatted string (see LogicExpression.stack_calc) a trace
+# is a generator of small records, one per visited node, parent before
+# children. Worlds are only counted, and only a sample of them is converted
+# back to names, so a trace costs about as much as the evaluation itself and
+# can be printed or written as json lines while it's generated.
+#
+# Usage:
+#     for record in trace(expression, kripke, max_depth=3, sample=5):
+#         print(render(record))
+from data import Fixpoint, evaluate, postorder, sample_worlds
+
+
+def trace(expression, kripke, backend=None, max_depth=None, max_records=None, sample=0):
+    """
+    Evaluates expression on kripke and generates a record (dict) per node of
+    the expression tree, in depth first order:
+      id       : the index of the node in the DAG (shared nodes share it)
+      depth    : distance to the root
+      operator : the operator symbol, variable name or constant
+      children : ids of the direct sub expressions
+      holds_in : the amount of worlds in which the node holds
+      sample   : the first `sample` of those worlds (only when sample > 0)
+      node     : the LogicExpression itself
+    A shared node is expanded only the first time, later occurrences get
+    'repeat': True. Nodes whose children are cut off by max_depth get
+    'truncated': True, as do fixpoints (their body has no extension of its
+    own). At most max_records records are generated.
+
+    backend : callable creating the world set algebra from the model,
+              defaults to the bitset algebra (Kripke.bitset)
+    """
+    algebra = backend(kripke) if backend else kripke.bitset()
+    values  = {}
+    evaluate(expression, algebra, values)
+    ids = dict((node, i) for i, node in enumerate(postorder(expression)))
+
+    seen, count = set(), 0
+    stack = [(expression, 0)]
+    while stack and (max_records is None or count < max_records):
+        node, depth = stack.pop()
+        children = list(node.children())
+        record = {
+            'id':       ids[node],
+            'depth':    depth,
+            'operator': operator_label(node),
+            'children': [ids[child] for child in children],
+            'holds_in': algebra.count(values[node]),
+        }
+        if sample:
+            record['sample'] = sample_worlds(algebra, values[node], sample)
+        if node in seen:
+            record['repeat'] = True
+        elif children and (isinstance(node, Fixpoint) or max_depth is not None and depth >= max_depth):
+            record['truncated'] = True
+        else:
+            stack.extend((child, depth + 1) for child in reversed(children))
+        seen.add(node)
+        record['node'] = node
+        count += 1
+        yield record
+
+
+def operator_label(node):
+    "The short label of a node: its operator, or its name for variables and constants"
+    if node.class_name == 'var':
+        return node.name
+    if node.class_name == 'const':
+        return node.str_format()
+    if isinstance(node, Fixpoint):
+        return node.out_symbol + node.name
+    return node.out_symbol
+
+
+def render(record, spacing="  "):
+    "Formats a trace record as one indented line of text"
+    line = "%s%s  [%d] holds in %d worlds" % (spacing * record['depth'], record['operator'],
+                                              record['id'], record['holds_in'])
+    if 'sample' in record:
+        more = ", ..." if record['holds_in'] > len(record['sample']) else ""
+        line += " {%s%s}" % (", ".join(record['sample']), more)
+    if record.get('repeat'):
+        line += " (see above)"
+    if record.get('truncated'):
+        line += " (children not shown)"
+    return line
+
+
+def to_json(record):
+    "The json serialisable part of a trace record (everything but the node)"
+    return dict((key, value) for key, value in record.items() if key != 'node')
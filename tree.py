@@ -1,48 +1,104 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from __future__ import print_function
-from itertools import count
-try:
-    from Queue     import Queue
-except ImportError:
-    from queue     import Queue
+#
+# Parse graphs of expressions in the .dot format.
+#
+# Expressions share their sub expressions (see data.create_expression), so
+# every distinct sub expression is written once, as a node with an edge from
+# every node using it. The graph is written to the stream as it's walked
+# rather than built as a string first.
+#
+# With a model every node is annotated with the amount of worlds it holds in,
+# every node being evaluated once, which shows where the big sets (and so
+# most of the work) are. Nodes inside a fixpoint that use its variable have
+# no extension of their own and aren't annotated (unless they also occur
+# outside of it, e.g. the first X of X & (mu X. p | diamond X)).
+#
+# Usage:
+#     write_graph(parse("p & ◇p"), sys.stdout)
+#     write_graph(parse("p & ◇p"), sys.stdout, kripke)   # annotated
+import io
+
 from parser    import parse
+from data      import Fixpoint, evaluate, free_variables, postorder
 
-tree = """
-digraph parse_tree {
+header = """digraph parse_tree {
 rank_dir = LR;
 graph [splines=ortho];
 node [shape=square];
 
-%s
-
-%s
-}
 """
 
-label_gen = ("q%s" % d for d in count())
-
-def to_graph(expr):
-    nodes, edges, todo = [], [], Queue()
-
-    todo.put((expr, next(label_gen)))
-
-    while not todo.empty():
-        subexpr, label = todo.get_nowait()
-        nodes.append('\t%s [label="%s"];' % (label, subexpr.out_symbol or str(subexpr)))
-
-        for child_expr in subexpr.children():
-            child_label = next(label_gen)
-            edges.append('\t%s -> %s' % (label, child_label))
-            todo.put((child_expr, child_label))
 
-    return tree % ("\n".join(nodes), "\n".join(edges))
-
-if __name__ == '__main__':
+def _label(node):
+    text = node.out_symbol or str(node)
+    if isinstance(node, Fixpoint):
+        text += node.name
+    return text.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def _unbound(expr):
+    """
+    the sub expressions of expr that occur at least once where none of their
+    free variables is bound by a fixpoint around them
+    """
+    free, seen, unbound = {}, set(), set()
+    stack = [(expr, frozenset())]
+    while stack:
+        node, binders = stack.pop()
+        binders = binders & free_variables(node, free)
+        if (node, binders) in seen:
+            continue
+        seen.add((node, binders))
+        if not binders:
+            unbound.add(node)
+        if isinstance(node, Fixpoint):
+            binders = binders | frozenset([node.name])
+        stack.extend((child, binders) for child in node.children())
+    return unbound
+
+
+def write_graph(expr, stream, kripke=None, backend=None):
+    """
+    Writes the parse graph of expr in the .dot format to stream, with every
+    distinct sub expression once. With a kripke model the nodes are annotated
+    with the amount of worlds they hold in, evaluated with backend (default:
+    the bitset algebra, see EvalContext).
+    """
+    counts = None
+    if kripke is not None:
+        algebra, values = (backend(kripke) if backend else kripke.bitset()), {}
+        unbound = _unbound(expr)
+        for node in unbound:   # the ones in fixpoint bodies are not evaluated with expr
+            evaluate(node, algebra, values)
+        counts = dict((node, algebra.count(values[node])) for node in unbound)
+
+    stream.write(header)
+    labels = {}
+    for node in postorder(expr):
+        label = labels[node] = "q%d" % len(labels)
+        text  = _label(node)
+        if counts is not None and node in counts:
+            text += "\\n%d worlds" % counts[node]
+        stream.write('\t%s [label="%s"];\n' % (label, text))
+        for child in node.children():
+            stream.write('\t%s -> %s\n' % (label, labels[child]))
+    stream.write("}\n")
+
+
+def to_graph(expr, kripke=None, backend=None):
+    "Returns the parse graph of expr in the .dot format as a string, see write_graph"
+    stream = io.StringIO()
+    write_graph(expr, stream, kripke, backend)
+    return stream.getvalue()
+
+
+def main(argv=None, prog=None):
+    "The command line interface, argv defaults to sys.argv[1:]"
     from argparse import ArgumentParser, RawTextHelpFormatter
     import sys
 
-    parser = ArgumentParser(description="Tree viewer, transforms expression into parsetrees in the .dot format",
+    parser = ArgumentParser(prog=prog, description="Tree viewer, transforms expression into parsetrees in the .dot format",
         formatter_class=RawTextHelpFormatter, epilog="""
 Using it
 ====================
@@ -55,6 +111,10 @@ or
 ./tree.py -o example.dot "Diamond Box p Or q Implies Not r"
 dot example.dot -Tpng -ofile test.png
 
+or, with the amount of worlds every node holds in
+
+./tree.py -m examples/example1.kripke "Diamond Box p Or q Implies Not r" | dot -Tpng > test.png
+
 Expression examples
 =====================
 P \/ Q /\ ~R -> S
@@ -64,14 +124,28 @@ throw_money_in_machine implies candy_rolls_out
 (a implies a) implies (a or ¬ b ^ c)
 ! ~ not ~ ! True
 ◇d \/ not ◇◇t
+mu X. p or diamond X
     """)
 
     parser.add_argument("expression",
         help="Expression to draw a parse tree of (in quotes)")
     parser.add_argument("-o", "--output",
-        help="file to write the dot file to (default stdout)", default=False)
-    args = parser.parse_args()
-    if not args.output:
-        args.output =  sys.stdout
+        help="file to write the dot file to (default stdout)", default=None)
+    parser.add_argument("-m", "--model",
+        help="model file (see evaluator.py), annotates every node with the amount of worlds it holds in")
+    args = parser.parse_args(argv)
+
+    kripke = None
+    if args.model:
+        from evaluator import load_model
+        kripke = load_model(args.model)
+    expression = parse(args.expression)
+    if args.output:
+        with open(args.output, 'w') as stream:
+            write_graph(expression, stream, kripke)
+    else:
+        write_graph(expression, sys.stdout, kripke)
+
 
-    print(to_graph(parse(args.expression)), file=args.output)
+if __name__ == '__main__':
+    main()